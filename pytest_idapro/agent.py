@@ -0,0 +1,239 @@
+"""
+A worker agent, executing IDA workers on behalf of remote pytest-idapro
+masters. The agent listens for authenticated connections; every connection
+starts a fresh IDA instance running the internal worker and relays messages
+between the master and the worker until either side disconnects, at which
+point IDA is terminated.
+
+This lets a few hosts with IDA installed serve test sessions of many CI
+runners, which connect using the --ida-agent option. Test sources (and any
+--ida-file) are expected at the same paths relative to the agent's root
+directory as they are relative to the master's.
+
+Running the agent with --stand-in executes workers without IDA using the
+mocked IDAPython modules, which is useful for testing remote setups locally.
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import threading
+import subprocess
+import logging
+import time
+
+from multiprocessing.connection import Listener
+
+try:
+    from multiprocessing.connection import wait
+except ImportError:
+    # python2 lacks waiting on several connections, poll them instead
+    wait = None
+
+logging.basicConfig()
+log = logging.getLogger('pytest-idapro.agent')
+
+AUTHKEY_ENV = "PYTEST_IDAPRO_AUTHKEY"
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError("Invalid agent address '{}', expected "
+                         "host:port".format(address))
+    return (host, int(port))
+
+
+def get_authkey(authkey=None):
+    authkey = authkey or os.environ.get(AUTHKEY_ENV)
+    if not authkey:
+        raise ValueError("An authentication key is required, provide one "
+                         "using the {} environment variable".format(
+                             AUTHKEY_ENV))
+    return authkey.encode('utf-8')
+
+
+def script_switch(script, *args):
+    """Build IDA's -S switch executing script with args. IDA splits the
+    switch's value like a command line, so every part is quoted to keep
+    paths containing spaces intact."""
+    return "-S" + " ".join('"{}"'.format(part) for part in (script,) + args)
+
+
+class WorkerAgent(object):
+    def __init__(self, address, authkey, ida_path=None, rootdir=None,
+                 workers=1, stand_in=False):
+        self.address = address
+        self.authkey = authkey
+        self.ida_path = ida_path
+        self.rootdir = os.path.abspath(rootdir or os.getcwd())
+        self.stand_in = stand_in
+        self.capacity = threading.Semaphore(workers)
+        self.listener = None
+
+    def serve(self):
+        self.listener = Listener(self.address, authkey=self.authkey)
+        log.info("Agent listening on %s:%s", *self.listener.address)
+        try:
+            while True:
+                try:
+                    conn = self.listener.accept()
+                except Exception:
+                    # failed authentication or a dropped connection should
+                    # not bring the agent down
+                    log.exception("Failed accepting a connection")
+                    continue
+
+                thread = threading.Thread(target=self.handle, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self.listener.close()
+
+    def handle(self, conn):
+        try:
+            request = conn.recv()
+            if request[:2] != ('agent', 'start'):
+                raise RuntimeError("Invalid agent request: "
+                                   "{}".format(request))
+
+            # wait for a free IDA instance
+            with self.capacity:
+                self.run_worker(conn, request[2])
+        except EOFError:
+            log.info("Master disconnected")
+        except Exception:
+            log.exception("Worker session failed")
+        finally:
+            conn.close()
+
+    def worker_args(self, address, stackfile, logfile, ida_file):
+        if self.stand_in:
+            return [sys.executable, "-m", "pytest_idapro.agent",
+                    "--stand-in-worker", address, stackfile]
+
+        internal_script = os.path.join(os.path.dirname(__file__),
+                                       "main_idaworker.py")
+        return [self.ida_path, "-A",
+                script_switch(internal_script, address, stackfile),
+                "-L{}".format(logfile), ida_file if ida_file else "-t"]
+
+    def run_worker(self, conn, ida_file):
+        logfile = self.temp_path("log")
+        stackfile = self.temp_path("stacks")
+        listener = Listener()
+        args = self.worker_args(listener.address, stackfile, logfile,
+                                ida_file)
+        log.info("Starting worker: %s", args)
+
+        with open(logfile, 'ab') as log_fh:
+            proc = subprocess.Popen(args=args, cwd=self.rootdir,
+                                    stdout=log_fh, stderr=log_fh)
+        try:
+            worker_conn = listener.accept()
+            listener.close()
+            conn.send(('agent', 'started', self.rootdir))
+            self.relay(conn, worker_conn)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            for path in (logfile, stackfile):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def relay(conn, worker_conn):
+        """Forward messages in both directions until either side closes its
+        connection. Messages are relayed as raw bytes, without unpickling
+        them"""
+        routes = ((conn, worker_conn), (worker_conn, conn))
+        try:
+            while True:
+                if wait is not None:
+                    wait([conn, worker_conn], 1)
+                else:
+                    time.sleep(0.01)
+
+                for source, destination in routes:
+                    while source.poll():
+                        destination.send_bytes(source.recv_bytes())
+        except (EOFError, IOError, OSError):
+            pass
+        finally:
+            worker_conn.close()
+
+    @staticmethod
+    def temp_path(kind):
+        fd, path = tempfile.mkstemp(prefix="pytest-idapro-agent-",
+                                    suffix="." + kind)
+        os.close(fd)
+        return path
+
+
+def run_stand_in_worker(address, stackfile):
+    """Run the internal worker in this process, with the mocked IDAPython
+    modules standing in for IDA's"""
+    from . import idapro_mock
+    from .plugin_mock import modules_list
+
+    for module_name in modules_list:
+        sys.modules[module_name] = getattr(idapro_mock, module_name)
+    # stand-in workers have no user interface
+    idapro_mock.ida_kernwin.is_idaq = lambda: False
+
+    # IDA makes the directory of the executed script importable
+    sys.path.insert(0, os.path.dirname(__file__))
+    idapro_mock.idc.ARGV = ["main_idaworker.py", address, stackfile]
+    import main_idaworker
+    main_idaworker.main()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Execute IDA workers for "
+                                                 "remote pytest-idapro "
+                                                 "sessions.")
+    parser.add_argument('--listen', default="localhost:5760",
+                        help="host:port to listen on (default: %(default)s)")
+    parser.add_argument('--ida', help="IDA executable used to run workers")
+    parser.add_argument('--rootdir',
+                        help="Directory holding the tested sources, workers "
+                             "are executed from it (default: current "
+                             "directory)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Maximal number of IDA instances executed "
+                             "concurrently (default: %(default)s)")
+    parser.add_argument('--stand-in', action="store_true",
+                        help="Execute workers with mocked IDAPython modules "
+                             "instead of IDA, for testing")
+    parser.add_argument('--stand-in-worker', nargs=2,
+                        metavar=("ADDRESS", "STACKFILE"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.stand_in_worker:
+        return run_stand_in_worker(*args.stand_in_worker)
+
+    if not args.ida and not args.stand_in:
+        parser.error("--ida is required unless --stand-in is used")
+
+    try:
+        address = parse_address(args.listen)
+        authkey = get_authkey()
+    except ValueError as e:
+        parser.error(str(e))
+
+    log.setLevel(logging.INFO)
+    agent = WorkerAgent(address, authkey, args.ida, args.rootdir,
+                        args.workers, args.stand_in)
+    try:
+        agent.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
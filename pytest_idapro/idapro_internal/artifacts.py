@@ -0,0 +1,180 @@
+"""
+Side channel for large test artifacts (byte dumps, graph exports, decompiled
+output) produced by tests inside IDA. Instead of pickling artifacts over the
+worker connection, the worker writes them into memory mapped files in a
+directory owned by the master, placed in shared memory (/dev/shm) when
+available, and only sends their file names. The master attaches their paths
+to test reports, and moves them to the artifacts directory requested by the
+user (if any) as they arrive. The directory is only created once the first
+artifact is stored, by whichever process stores it.
+
+Workers that cannot share files with the master (such as ones executed by
+remote agents) and small artifacts send their content inline instead.
+"""
+
+import os
+import re
+import uuid
+import mmap
+import errno
+import shutil
+import tempfile
+import itertools
+import contextlib
+
+# preferred location of artifact files, memory backed on linux
+SHARED_MEMORY_DIR = "/dev/shm"
+
+# artifacts smaller than this are sent over the connection
+INLINE_SIZE = 0x10000
+
+
+def artifact_filename(nodeid, name):
+    """Return a file name for an artifact unique enough for humans to find"""
+    return re.sub(r'[^\w.\-\[\]]+', '_', "{}-{}".format(nodeid, name))
+
+
+def unique_path(directory, filename):
+    """Return a path in `directory` not used by any file, suffixing
+    `filename` with a number if needed"""
+    path = os.path.join(directory, filename)
+    for i in itertools.count(1):
+        if not os.path.exists(path):
+            return path
+        path = os.path.join(directory, "{}-{}".format(filename, i))
+
+
+def ensure_directory(directory):
+    """Create the artifacts directory, private to the user, unless a worker
+    (or the master) already did"""
+    try:
+        os.mkdir(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class ArtifactWriter(object):
+    """Worker side of the artifacts channel. Artifacts are written to
+    `directory`, or sent inline if it is None"""
+
+    def __init__(self, send, directory=None):
+        self.send = send
+        self.directory = directory
+        self.counter = itertools.count()
+
+    def bind(self, nodeid):
+        return TestArtifacts(self, nodeid)
+
+    def store(self, nodeid, name, data):
+        if self.directory is None or len(data) < INLINE_SIZE:
+            self.send('runtest', 'artifact', nodeid, name,
+                      ('inline', bytes(data)))
+            return
+
+        with self.allocate(nodeid, name, len(data)) as buf:
+            buf[:] = data
+
+    @contextlib.contextmanager
+    def allocate(self, nodeid, name, size):
+        """Yield a writable buffer of `size` bytes to be filled by the caller,
+        memory mapped when possible, which is sent to the master once the
+        block exits"""
+        if self.directory is None:
+            buf = bytearray(size)
+            yield buf
+            self.send('runtest', 'artifact', nodeid, name,
+                      ('inline', bytes(buf)))
+            return
+
+        # workers (and forked children) of a session share the directory
+        filename = "{}-{}-{}".format(os.getpid(), next(self.counter),
+                                     artifact_filename(nodeid, name))
+        ensure_directory(self.directory)
+        path = os.path.join(self.directory, filename)
+        with open(path, 'w+b') as fh:
+            fh.truncate(size)
+            # empty files cannot be mapped
+            buf = mmap.mmap(fh.fileno(), size) if size else bytearray()
+            try:
+                yield buf
+            finally:
+                if size:
+                    buf.close()
+        self.send('runtest', 'artifact', nodeid, name, ('file', filename))
+
+
+class TestArtifacts(object):
+    """Artifacts of a single test, as provided by the idapro_artifacts
+    fixture"""
+
+    def __init__(self, writer, nodeid):
+        self.writer = writer
+        self.nodeid = nodeid
+
+    def store(self, name, data):
+        self.writer.store(self.nodeid, name, data)
+
+    def allocate(self, name, size):
+        return self.writer.allocate(self.nodeid, name, size)
+
+
+class ArtifactStore(object):
+    """Master side of the artifacts channel, owning the artifacts directory
+    shared with local workers"""
+
+    def __init__(self, output_dir=None):
+        self.output_dir = output_dir
+        parent = (SHARED_MEMORY_DIR if os.path.isdir(SHARED_MEMORY_DIR)
+                  else tempfile.gettempdir())
+        # created on first use, the random name keeps others from creating
+        # it beforehand
+        name = "pytest-idapro-artifacts-{}".format(uuid.uuid4().hex)
+        self.directory = os.path.join(parent, name)
+        self.artifacts = {}
+
+    def receive(self, nodeid, name, handle):
+        """Register an artifact sent by a worker, moving it to the output
+        directory if there is one. Returns the artifact's path"""
+        kind, value = handle
+        if kind == 'file':
+            path = os.path.join(self.directory, value)
+        elif kind == 'inline':
+            ensure_directory(self.directory)
+            fd, path = tempfile.mkstemp(prefix=artifact_filename(nodeid, name),
+                                        dir=self.directory)
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(value)
+        else:
+            raise RuntimeError("Invalid artifact handle: {}".format(handle))
+
+        if self.output_dir:
+            if not os.path.isdir(self.output_dir):
+                os.makedirs(self.output_dir)
+            # tests of different workers, or of previous sessions, may store
+            # artifacts under the same name
+            target = unique_path(self.output_dir,
+                                 artifact_filename(nodeid, name))
+            # a rename when both directories share a file system
+            shutil.move(path, target)
+            path = target
+
+        self.artifacts.setdefault(nodeid, {})[name] = path
+        return path
+
+    def get(self, nodeid):
+        """Return a {name: path} dictionary of the artifacts of a test"""
+        return dict(self.artifacts.get(nodeid, {}))
+
+    def attach(self, report):
+        """Make the paths of a test's artifacts available to hooks receiving
+        its reports, and list them with the test's failure"""
+        report.idapro_artifacts = self.get(report.nodeid)
+        if report.idapro_artifacts and report.failed:
+            paths = sorted(report.idapro_artifacts.items())
+            report.sections.append(("idapro artifacts", "\n".join(
+                "{}: {}".format(name, path) for name, path in paths)))
+
+    def finish(self):
+        # the directory may never have been created
+        shutil.rmtree(self.directory, ignore_errors=True)
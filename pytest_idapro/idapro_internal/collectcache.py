@@ -0,0 +1,141 @@
+"""
+A cache of test node IDs collected by IDA workers, stored using pytest's cache
+provider. Entries are keyed by the collection arguments and by hashes of all
+source files under the collected paths, so collect-only runs and IDE test
+discovery can be answered by the master without starting IDA as long as no
+source file has changed.
+
+Sources are only hashed ahead of collect-only runs. Other runs hash them once
+their collection is stored, which is skipped if any source was modified while
+the tests ran.
+"""
+
+import os
+import json
+import time
+import hashlib
+
+from .watch import SourceWatcher
+
+
+class CollectionCache(object):
+    CACHE_KEY = "idapro/collection"
+
+    # options changing the set of collected tests
+    KEY_OPTIONS = ('keyword', 'markexpr', 'ida', 'ida_file', 'deselect',
+                   'ignore')
+
+    def __init__(self, config):
+        self.config = config
+        self.cache = getattr(config, 'cache', None)
+        self.entry = None
+        self.key = None
+        self.files = None
+        self.started = None
+
+    def invocation_dir(self):
+        """Directory pytest was invoked from, which arguments are relative
+        to (invocation_params was introduced in pytest 5.1)"""
+        params = getattr(self.config, 'invocation_params', None)
+        if params is not None:
+            return str(params.dir)
+        invocation_dir = getattr(self.config, 'invocation_dir', None)
+        return str(invocation_dir or os.getcwd())
+
+    def roots(self):
+        invocation_dir = self.invocation_dir()
+        args = [arg.split("::")[0] for arg in self.config.args]
+        args = args or [invocation_dir]
+        return [os.path.join(invocation_dir, arg) for arg in args]
+
+    def config_files(self, roots):
+        """Configuration files affecting collection: the ini file and
+        conftest.py files between the root directory and collected paths"""
+        rootdir = os.path.join(os.path.abspath(str(self.config.rootdir)), '')
+        inifile = getattr(self.config, 'inifile', None)
+        paths = set([str(inifile)] if inifile else [])
+        for root in roots:
+            directory = os.path.abspath(root)
+            while True:
+                paths.add(os.path.join(directory, "conftest.py"))
+                parent = os.path.dirname(directory)
+                if parent == directory or not directory.startswith(rootdir):
+                    break
+                directory = parent
+        return sorted(path for path in paths if os.path.isfile(path))
+
+    def compute_key(self):
+        options = dict((name, getattr(self.config.option, name, None))
+                       for name in self.KEY_OPTIONS)
+        key = json.dumps([self.config.args, options], sort_keys=True,
+                         default=str)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def hash_files(self, cached_files):
+        """Hash all python files under the collected paths. Files with the
+        same modification time and size as cached ones are not rehashed"""
+        roots = self.roots()
+        files = {}
+        paths = list(SourceWatcher(roots).iter_files())
+        for path in paths + self.config_files(roots):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            cached = cached_files.get(path)
+            if cached and cached[:2] == [stat.st_mtime, stat.st_size]:
+                files[path] = cached
+                continue
+
+            with open(path, 'rb') as fh:
+                digest = hashlib.sha1(fh.read()).hexdigest()
+            files[path] = [stat.st_mtime, stat.st_size, digest]
+        return files
+
+    def load(self):
+        """Return the cached collection if it is still valid, or None
+        otherwise. Sources are only hashed for collect-only runs"""
+        self.started = time.time()
+        if self.cache is None:
+            return None
+
+        self.entry = self.cache.get(self.CACHE_KEY, None) or {}
+        if not getattr(self.config.option, 'collectonly', False):
+            return None
+
+        self.prepare()
+        cached_files = self.entry.get('files', {})
+        # without any source hashed there is nothing to validate against
+        if not self.files or self.entry.get('key') != self.key:
+            return None
+        if self.digests(cached_files) != self.digests(self.files):
+            return None
+        return self.entry.get('collected')
+
+    def prepare(self):
+        """Compute the current cache key and source hashes"""
+        self.key = self.compute_key()
+        self.files = self.hash_files((self.entry or {}).get('files', {}))
+
+    @staticmethod
+    def digests(files):
+        return dict((path, value[2]) for path, value in files.items())
+
+    def store(self, collected):
+        """Store a list of (label, nodeids, locations) tuples, computed with
+        the sources hashed by the last call to load, or hashed now if they
+        did not change since it was called"""
+        if self.cache is None or self.started is None:
+            return
+        if self.files is None:
+            self.prepare()
+            if any(value[0] >= self.started for value in self.files.values()):
+                return
+        if not self.files:
+            return
+
+        collected = [[label, list(nodeids), [list(loc) for loc in locations]]
+                     for label, nodeids, locations in collected]
+        self.cache.set(self.CACHE_KEY, {'key': self.key, 'files': self.files,
+                                        'collected': collected})
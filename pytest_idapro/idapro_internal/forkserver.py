@@ -0,0 +1,134 @@
+"""
+Run mocked test sessions as a fork server. The main pytest process imports
+pytest, the mocked IDAPython modules and Qt, and collects the tests only once,
+after which a child process is forked for every test module. Every module
+therefore starts from the same pristine mock state (netnodes, mapped bytes,
+the Qt application) at the cost of a fork instead of a new interpreter.
+
+Children run their tests without reporting them, and send the reports to the
+main process which logs them as usual, along with the artifacts they store. A
+child exiting in the middle of a test
+fails that test, and the rest of its module continues in a new child.
+"""
+
+import os
+import signal
+import sys
+import traceback
+from collections import OrderedDict
+from multiprocessing import Pipe
+
+from _pytest.runner import runtestprotocol, TestReport
+
+
+class ForkServer(object):
+    def __init__(self, session, serialize_report, child_finish=None,
+                 artifact_writer=None):
+        self.session = session
+        self.hook = session.config.hook
+        self.serialize_report = serialize_report
+        self.child_finish = child_finish
+        self.artifact_writer = artifact_writer
+
+    def run(self):
+        modules = OrderedDict()
+        for item in self.session.items:
+            modules.setdefault(str(item.fspath), []).append(item)
+
+        for items in modules.values():
+            while items:
+                items = self.run_module(items)
+                if self.session.shouldstop:
+                    raise self.session.Interrupted(self.session.shouldstop)
+
+    def run_module(self, items):
+        """Run `items` in a forked child, returning the items left to run if
+        the child exited before running all of them"""
+        conn, child_conn = Pipe(duplex=False)
+        pid = os.fork()
+        if pid == 0:
+            conn.close()
+            self.child_main(items, child_conn)
+
+        child_conn.close()
+        try:
+            ran = self.receive(conn)
+        finally:
+            conn.close()
+            if self.session.shouldstop:
+                os.kill(pid, signal.SIGKILL)
+            _, status = os.waitpid(pid, 0)
+
+        if self.session.shouldstop or ran == len(items):
+            return []
+
+        # the child exited while running (or before starting) the next test
+        self.report_exit(items[ran], status)
+        return items[ran + 1:]
+
+    def receive(self, conn):
+        """Log reports of the child's tests, returning the number of tests
+        completed"""
+        ran = 0
+        current = None
+        while not self.session.shouldstop:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+
+            if message[0] == 'logstart':
+                current = message[1:]
+                self.hook.pytest_runtest_logstart(nodeid=current[0],
+                                                  location=current[1])
+            elif message[0] == 'artifact':
+                # registered by the main process, before the test's reports
+                self.artifact_writer.send(*message[1])
+            elif message[0] == 'reports':
+                for report in message[1]:
+                    self.hook.pytest_runtest_logreport(
+                        report=TestReport(**report))
+                self.log_finish(*current)
+                current = None
+                ran += 1
+        return ran
+
+    def log_finish(self, nodeid, location):
+        # the pytest_runtest_logfinish hook was introduced in pytest3.4
+        if hasattr(self.hook, 'pytest_runtest_logfinish'):
+            self.hook.pytest_runtest_logfinish(nodeid=nodeid,
+                                               location=location)
+
+    def report_exit(self, item, status):
+        if os.WIFSIGNALED(status):
+            reason = "killed by signal {}".format(os.WTERMSIG(status))
+        else:
+            reason = "exited with status {}".format(os.WEXITSTATUS(status))
+        longrepr = "Forked test process {} while running the test".format(
+            reason)
+        report = TestReport(item.nodeid, item.location, {}, 'failed',
+                            longrepr, 'call')
+        self.hook.pytest_runtest_logreport(report=report)
+        self.log_finish(item.nodeid, item.location)
+
+    def child_main(self, items, conn):
+        status = 1
+        if self.artifact_writer:
+            self.artifact_writer.send = lambda *message: conn.send(
+                ('artifact', message))
+        try:
+            for i, item in enumerate(items):
+                nextitem = items[i + 1] if i + 1 < len(items) else None
+                conn.send(('logstart', item.nodeid, item.location))
+                reports = runtestprotocol(item, log=False, nextitem=nextitem)
+                conn.send(('reports', [self.serialize_report(report)
+                                       for report in reports]))
+            if self.child_finish:
+                self.child_finish()
+            status = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
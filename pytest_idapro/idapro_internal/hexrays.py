@@ -0,0 +1,144 @@
+"""
+Per-session memoization of Hex-Rays decompilation inside IDA. When enabled,
+`ida_hexrays.decompile` (and its `idaapi` alias) is replaced with a wrapper
+serving repeated decompiles of a function from memory, so tests sharing a
+function only pay for running the decompiler once. Memoized functions are
+dropped whenever the decompiler cache is explicitly invalidated
+(`mark_cfunc_dirty`, `clear_cached_cfuncs`) and when a database snapshot is
+restored. Code holding its own reference to `decompile`, bound before the
+session started (`from ida_hexrays import decompile`), bypasses the cache.
+
+Memoized functions are shared, mutable cfunc objects. As with IDA's own
+decompiler cache, tests modifying a decompiled function should mark it dirty
+(or decompile it with DECOMP_NO_CACHE) so later tests decompile it afresh.
+
+Decompiled functions may additionally be recorded as fixture files, which are
+served by the mock `ida_hexrays` module when running outside of IDA.
+"""
+
+import os
+import sys
+import json
+
+
+def serialize_cfunc(ida_hexrays, cfunc):
+    """Serialize a decompiled function into the fixture format read by the
+    mocked ida_hexrays module"""
+    try:
+        from ida_lines import tag_remove
+    except ImportError:
+        def tag_remove(line):
+            return line
+
+    names = [name for name in dir(ida_hexrays)
+             if name.startswith(('cot_', 'cit_'))]
+    ctype_names = dict((getattr(ida_hexrays, name), name) for name in names
+                       if name not in ('cot_last', 'cit_end'))
+
+    pseudocode = [tag_remove(line.line) for line in cfunc.get_pseudocode()]
+
+    treeitems = []
+    for item in cfunc.treeitems:
+        parent = cfunc.body.find_parent_of(item)
+        treeitems.append({'op': ctype_names.get(item.op, 'cot_empty'),
+                          'ea': item.ea,
+                          'parent': parent.index if parent else None})
+
+    lvars = []
+    for lvar in cfunc.get_lvars():
+        is_arg = lvar.is_arg_var
+        if callable(is_arg):
+            is_arg = is_arg()
+        lvars.append({'name': lvar.name, 'type': str(lvar.type()),
+                      'is_arg': bool(is_arg)})
+
+    warnings = [str(getattr(warning, 'text', warning))
+                for warning in cfunc.get_warnings()]
+
+    data = {'entry_ea': cfunc.entry_ea, 'pseudocode': pseudocode,
+            'lvars': lvars, 'treeitems': treeitems, 'warnings': warnings}
+    try:
+        import ida_funcs
+        data['end_ea'] = ida_funcs.get_func(cfunc.entry_ea).end_ea
+    except (ImportError, AttributeError):
+        pass
+    return data
+
+
+class DecompilationCache(object):
+    def __init__(self, ida_hexrays, record_path=None):
+        self.ida_hexrays = ida_hexrays
+        self.record_path = record_path
+        self.cfuncs = {}
+        self.hits = 0
+        self.misses = 0
+        self.originals = {}
+        # (module, name, original) of every replaced function
+        self.patched = []
+
+    def install(self):
+        # idaapi re-exports ida_hexrays, binding the same functions
+        modules = [self.ida_hexrays]
+        if sys.modules.get('idaapi') is not None:
+            modules.append(sys.modules['idaapi'])
+
+        for name in ('decompile', 'mark_cfunc_dirty', 'clear_cached_cfuncs'):
+            original = self.originals[name] = getattr(self.ida_hexrays, name)
+            for module in modules:
+                if getattr(module, name, None) is original:
+                    setattr(module, name, getattr(self, name))
+                    self.patched.append((module, name, original))
+
+    def uninstall(self):
+        for module, name, original in self.patched:
+            setattr(module, name, original)
+        del self.patched[:]
+        self.originals.clear()
+        self.clear()
+
+    def key(self, ea):
+        ea = getattr(ea, 'start_ea', ea)
+        try:
+            import ida_funcs
+            func = ida_funcs.get_func(ea)
+        except (ImportError, AttributeError):
+            func = None
+        return func.start_ea if func else ea
+
+    def decompile(self, ea, *args, **kwargs):
+        # arguments are passed on as given, signatures differ between IDA
+        # versions
+        flags = kwargs.get('flags', args[1] if len(args) > 1 else 0)
+        key = self.key(ea)
+        no_cache = flags & getattr(self.ida_hexrays, 'DECOMP_NO_CACHE', 0)
+        if key in self.cfuncs and not no_cache:
+            self.hits += 1
+            return self.cfuncs[key]
+
+        self.misses += 1
+        cfunc = self.originals['decompile'](ea, *args, **kwargs)
+        if cfunc:
+            self.cfuncs[key] = cfunc
+            if self.record_path:
+                self.record(cfunc)
+        return cfunc
+
+    def mark_cfunc_dirty(self, ea, *args, **kwargs):
+        self.cfuncs.pop(self.key(ea), None)
+        return self.originals['mark_cfunc_dirty'](ea, *args, **kwargs)
+
+    def clear_cached_cfuncs(self):
+        self.clear()
+        return self.originals['clear_cached_cfuncs']()
+
+    def clear(self):
+        self.cfuncs.clear()
+
+    def record(self, cfunc):
+        if not os.path.isdir(self.record_path):
+            os.makedirs(self.record_path)
+
+        data = serialize_cfunc(self.ida_hexrays, cfunc)
+        filename = "{:x}.json".format(data['entry_ea'])
+        with open(os.path.join(self.record_path, filename), 'w') as fh:
+            json.dump(data, fh, indent=1)
@@ -3,21 +3,67 @@ import ida_auto
 from multiprocessing.connection import Client
 import platform
 import logging
+import os
+import sys
+import ast
+import signal
+import time
 
 logging.basicConfig()
 log = logging.getLogger('pytest-idapro.internal.worker')
 
 
 class IdaWorker(object):
-    def __init__(self, conn_addr, *args, **kwargs):
+    # longest time spent advancing auto-analysis before checking for commands
+    ANALYSIS_SLICE = 0.05
+
+    def __init__(self, conn_addr, stackdump_path=None, *args, **kwargs):
         super(IdaWorker, self).__init__(*args, **kwargs)
         self.daemon = True
         self.conn = Client(conn_addr)
         self.stop = False
         self.quit_ida = True
         self.pytest_config = None
-        from PyQt5.QtWidgets import qApp
-        self.qapp = qApp
+        self.stackdump_file = None
+        # auto-analysis started by the master and not yet waited for
+        self.analysis_pending = False
+        if stackdump_path:
+            self.register_stackdump(stackdump_path)
+        self.qapp = self.get_qapp()
+        self.gui = self.qapp is not None
+
+    @staticmethod
+    def get_qapp():
+        """Return the Qt application object of IDA's user interface, or None
+        when running under IDA's text mode executables (idat), in which case
+        Qt is neither available nor needed"""
+        try:
+            import ida_kernwin
+            if not ida_kernwin.is_idaq():
+                return None
+        except (ImportError, AttributeError):
+            pass
+
+        try:
+            from PyQt5.QtWidgets import qApp
+        except ImportError:
+            return None
+        return qApp
+
+    def register_stackdump(self, path):
+        """Dump stacks of all threads to `path` when receiving SIGUSR1, used
+        by the master to diagnose hanging tests. Only available for python3
+        on posix platforms"""
+        try:
+            import faulthandler
+        except ImportError:
+            return
+        if not hasattr(signal, 'SIGUSR1'):
+            return
+
+        self.stackdump_file = open(path, 'w')
+        faulthandler.register(signal.SIGUSR1, file=self.stackdump_file,
+                              all_threads=True)
 
     def run(self):
         try:
@@ -36,7 +82,13 @@ class IdaWorker(object):
 
     def recv(self):
         while not self.stop:
-            self.qapp.processEvents()
+            # without a user interface there are no events to process
+            if self.qapp is not None:
+                self.qapp.processEvents()
+            if self.analysis_pending and not self.conn.poll(0):
+                # make progress with auto-analysis while idle
+                if self.analyze(self.ANALYSIS_SLICE):
+                    continue
             if not self.conn.poll(1):
                 continue
 
@@ -106,11 +158,49 @@ class IdaWorker(object):
             raise RuntimeError("Unexpected dependencies argument: "
                                "{}".format(action))
 
-    @staticmethod
-    def command_autoanalysis(action):
+    def analyze(self, duration):
+        """Advance pending auto-analysis for up to `duration` seconds. Returns
+        False if analysis cannot be advanced step by step"""
+        make_step = getattr(ida_auto, 'auto_make_step', None)
+        if make_step is None:
+            return False
+
+        from ida_idaapi import BADADDR
+        deadline = time.time() + duration
+        progress = True
+        while progress and not ida_auto.auto_is_ok():
+            if time.time() >= deadline:
+                break
+            progress = make_step(0, BADADDR)
+
+        if ida_auto.auto_is_ok():
+            self.analysis_pending = False
+            log.debug("Auto-analysis finished while idle")
+            return True
+        return progress
+
+    def advance_autoanalysis(self):
+        """Advance pending auto-analysis by a single slice. Called by the
+        worker plugin as collectors start and between tests, since commands
+        collecting and running tests leave no idle time to analyze in"""
+        if self.analysis_pending:
+            self.analyze(self.ANALYSIS_SLICE)
+
+    def wait_autoanalysis(self):
+        """Block until auto-analysis started by the master is finished"""
+        if not self.analysis_pending:
+            return
+        ida_auto.auto_wait()
+        self.analysis_pending = False
+
+    def command_autoanalysis(self, action):
         if action == "wait":
             ida_auto.auto_wait()
             return ('autoanalysis', 'done',)
+        elif action == "start":
+            # analysis continues while idle and is waited for by tests
+            self.analysis_pending = not ida_auto.auto_is_ok()
+            return ('autoanalysis', 'started')
         else:
             raise RuntimeError("Invalid action received for command: "
                                "{}".format(action))
@@ -132,6 +222,77 @@ class IdaWorker(object):
         self.pytest_config.hook.pytest_cmdline_main(config=self.pytest_config)
         self.send('cmdline_main', 'finish')
 
+    @staticmethod
+    def command_invalidate(paths, roots):
+        """Remove modules loaded from any of `paths` from sys.modules so they
+        are reimported by the next session, together with any module under
+        `roots` that (transitively) imports an invalidated module. Returns
+        the source files of all invalidated modules."""
+        def module_path(module):
+            path = getattr(module, '__file__', None)
+            if not path:
+                return None
+            path = os.path.abspath(path)
+            if path.endswith(('.pyc', '.pyo')):
+                path = path[:-1]
+            return path
+
+        def module_imports(name, module, path):
+            try:
+                with open(path, 'rb') as fh:
+                    tree = ast.parse(fh.read(), path)
+            except (IOError, SyntaxError, ValueError):
+                return set()
+
+            package = getattr(module, '__package__', None)
+            if package is None:
+                package = name.rpartition('.')[0]
+
+            imports = set()
+            for node in ast.walk(tree):
+                if isinstance(node, ast.Import):
+                    imports.update(alias.name for alias in node.names)
+                elif isinstance(node, ast.ImportFrom):
+                    base = node.module or ''
+                    if node.level:
+                        parts = package.split('.') if package else []
+                        parts = parts[:len(parts) - node.level + 1]
+                        base = '.'.join(p for p in parts + [base] if p)
+                    imports.add(base)
+                    imports.update(base + '.' + alias.name
+                                   for alias in node.names)
+            return imports
+
+        paths = set(os.path.abspath(path) for path in paths)
+        roots = tuple(os.path.join(os.path.abspath(root), '')
+                      for root in roots)
+
+        candidates = {}
+        for name, module in list(sys.modules.items()):
+            path = module_path(module) if module else None
+            if path and path.startswith(roots):
+                candidates[name] = (module, path)
+
+        imports = dict((name, module_imports(name, module, path))
+                       for name, (module, path) in candidates.items())
+
+        invalidated = set(name for name, (_, path) in candidates.items()
+                          if path in paths)
+        while True:
+            dependants = set(name for name in candidates
+                             if imports[name] & invalidated)
+            dependants -= invalidated
+            if not dependants:
+                break
+            invalidated |= dependants
+
+        for name in invalidated:
+            del sys.modules[name]
+
+        affected = sorted(set(candidates[name][1] for name in invalidated))
+        log.debug("Invalidated modules: %s", invalidated)
+        return ('invalidate', 'done', affected)
+
     @staticmethod
     def command_ping():
         return ('pong',)
@@ -0,0 +1,69 @@
+"""
+Incremental reader of the log file written by an IDA worker (IDA's -L switch).
+New content is read as the file grows and only a bounded number of recent
+lines is kept in memory, so long sessions do not accumulate unbounded log data
+in the master process.
+"""
+
+import os
+from collections import deque
+
+
+class LogTail(object):
+    CHUNK_SIZE = 64 * 1024
+    # longer lines are split, so output never ending a line is not kept whole
+    MAX_LINE = 64 * 1024
+
+    def __init__(self, path, maxlines=1000):
+        self.path = path
+        self.lines = deque(maxlen=maxlines)
+        # total number of complete lines read so far, used as a position
+        self.lineno = 0
+        self.partial = b''
+        self.fh = None
+
+    def poll(self):
+        """Read any new content and return the current line position"""
+        if self.fh is None:
+            try:
+                self.fh = open(self.path, 'rb')
+            except IOError:
+                return self.lineno
+
+        while True:
+            data = self.fh.read(self.CHUNK_SIZE)
+            if not data:
+                return self.lineno
+
+            lines = (self.partial + data).split(b'\n')
+            self.partial = lines.pop()
+            while len(self.partial) > self.MAX_LINE:
+                lines.append(self.partial[:self.MAX_LINE])
+                self.partial = self.partial[self.MAX_LINE:]
+            for line in lines:
+                line = line.rstrip(b'\r')
+                self.lines.append(line.decode('utf-8', 'replace'))
+            self.lineno += len(lines)
+
+    def since(self, lineno):
+        """Return lines read after position `lineno` that are still kept"""
+        self.poll()
+        start = len(self.lines) - (self.lineno - lineno)
+        return list(self.lines)[max(start, 0):]
+
+    def text(self, lineno=0):
+        lines = self.since(lineno)
+        if self.partial:
+            lines.append(self.partial.decode('utf-8', 'replace'))
+        return '\n'.join(lines)
+
+    def close(self, remove=True):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+        if remove:
+            try:
+                os.remove(self.path)
+            except OSError:
+                # still held open by IDA on some platforms
+                pass
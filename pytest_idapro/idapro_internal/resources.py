@@ -0,0 +1,142 @@
+"""
+Tracking of the memory and CPU time used by IDA workers. The master samples
+the resident set size and CPU time of every local IDA process from /proc as
+tests start and finish, attaches the difference to the test's report, and
+summarizes usage once the session is over. Tests growing IDA's memory by more
+than a threshold are flagged, as long suites slowly inflating IDA's memory
+until it crashes are otherwise hard to pin on a test.
+
+Sampling requires a /proc file system, and is silently skipped otherwise
+(and for workers executed by remote agents).
+"""
+
+import os
+
+# default memory growth, in bytes, above which tests are flagged
+DEFAULT_THRESHOLD = 50 * 1024 * 1024
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+    _CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = _CLOCK_TICKS = None
+
+
+def sample(pid):
+    """Return a (rss bytes, cpu seconds) tuple for a process, or None if it
+    cannot be sampled"""
+    if _PAGE_SIZE is None:
+        return None
+    try:
+        with open("/proc/{}/statm".format(pid), 'r') as fh:
+            rss = int(fh.read().split()[1]) * _PAGE_SIZE
+        with open("/proc/{}/stat".format(pid), 'r') as fh:
+            # the command name may contain spaces, fields follow its ')'
+            fields = fh.read().rpartition(')')[2].split()
+        # utime and stime, the 14th and 15th fields of the stat file
+        cpu = (int(fields[11]) + int(fields[12])) / float(_CLOCK_TICKS)
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return rss, cpu
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return "{:.1f}{}".format(size, unit)
+        size /= 1024.0
+    return "{:.1f}GB".format(size)
+
+
+class ResourceUsage(object):
+    """Resources used by a single test, attached to its reports as
+    `idapro_resources`"""
+
+    def __init__(self, start, finish):
+        self.rss_start, cpu_start = start
+        self.rss_end, cpu_end = finish
+        self.rss_delta = self.rss_end - self.rss_start
+        self.cpu = cpu_end - cpu_start
+
+    def to_dict(self):
+        return {'rss_start': self.rss_start, 'rss_end': self.rss_end,
+                'rss_delta': self.rss_delta, 'cpu': self.cpu}
+
+    def __str__(self):
+        return "memory {} -> {} ({:+.1f}MB), cpu {:.2f}s".format(
+            format_size(self.rss_start), format_size(self.rss_end),
+            self.rss_delta / (1024.0 * 1024), self.cpu)
+
+
+class ResourceSampler(object):
+    """Worker proxy side: samples a process as its tests start and finish"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.start = None
+
+    def test_start(self):
+        self.start = sample(self.pid)
+
+    def test_finish(self):
+        """Return the usage of the test since it started, or None"""
+        start, self.start = self.start, None
+        finish = sample(self.pid)
+        if start is None or finish is None:
+            return None
+        return ResourceUsage(start, finish)
+
+
+class ResourceSummary(object):
+    """Master side: accumulates test usage of all workers"""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.tests = {}
+        # peak resident size by worker label
+        self.peaks = {}
+
+    def add(self, nodeid, label, usage):
+        """Record a test's usage, returning True if it grew memory above the
+        threshold"""
+        self.tests[nodeid] = usage
+        self.peaks[label] = max(self.peaks.get(label, 0), usage.rss_end)
+        return usage.rss_delta > self.threshold
+
+    def flagged(self):
+        return sorted((nodeid for nodeid, usage in self.tests.items()
+                       if usage.rss_delta > self.threshold),
+                      key=lambda nodeid: -self.tests[nodeid].rss_delta)
+
+    def clear(self):
+        self.tests.clear()
+        self.peaks.clear()
+
+    def report(self, write_line, top=5):
+        if not self.tests:
+            return
+
+        cpu = sum(usage.cpu for usage in self.tests.values())
+        growth = sum(usage.rss_delta for usage in self.tests.values())
+        write_line("{} tests, cpu {:.2f}s, memory growth {}".format(
+            len(self.tests), cpu, format_size(growth)))
+        for label, peak in sorted(self.peaks.items(),
+                                  key=lambda item: str(item[0])):
+            write_line("peak memory{}: {}".format(
+                " " + label if label else "", format_size(peak)))
+
+        growing = sorted(self.tests.items(),
+                         key=lambda item: -item[1].rss_delta)[:top]
+        growing = [(nodeid, usage) for nodeid, usage in growing
+                   if usage.rss_delta > 0]
+        if growing:
+            write_line("largest memory growth:")
+            for nodeid, usage in growing:
+                write_line("  {}: {}".format(nodeid, usage))
+
+        flagged = self.flagged()
+        if flagged:
+            write_line("{} tests grew memory by more than {}:".format(
+                len(flagged), format_size(self.threshold)))
+            for nodeid in flagged:
+                write_line("  {}".format(nodeid))
@@ -0,0 +1,140 @@
+"""
+Duration aware scheduling of tests between IDA workers running the same
+tests. Durations of previous runs are kept using pytest's cache provider, and
+are used to split tests between workers longest-processing-time first. As
+workers run out of tests they steal the last tests of the worker with most
+work left, so a worker falling behind (or one that never started) does not
+hold back the whole session.
+"""
+
+import heapq
+import threading
+from collections import deque
+
+
+class DurationStore(object):
+    CACHE_KEY = "idapro/durations"
+
+    # estimated duration of tests that never ran before
+    DEFAULT_DURATION = 1.0
+
+    def __init__(self, config):
+        self.cache = getattr(config, 'cache', None)
+        self.durations = {}
+        self.current = {}
+        self.pruned = False
+        if self.cache is not None:
+            self.durations = self.cache.get(self.CACHE_KEY, None) or {}
+        self.default = self.median() or self.DEFAULT_DURATION
+
+    def median(self):
+        durations = sorted(self.durations.values())
+        if not durations:
+            return None
+        return durations[len(durations) // 2]
+
+    def get(self, nodeid):
+        return self.durations.get(nodeid, self.default)
+
+    def estimate(self, nodeids):
+        return sum(self.get(nodeid) for nodeid in nodeids)
+
+    def record(self, nodeid, duration):
+        """Add the duration of a test phase (setup, call or teardown)"""
+        self.current[nodeid] = self.current.get(nodeid, 0) + duration
+
+    def prune(self, known, exists):
+        """Forget tests that no longer exist: tests of files collected this
+        run that are not `known`, and tests of files `exists` rejects"""
+        files = set(nodeid.split("::")[0] for nodeid in known)
+        for nodeid in list(self.durations):
+            path = nodeid.split("::")[0]
+            if path in files:
+                removed = nodeid not in known
+            else:
+                removed = not exists(path)
+            if removed:
+                del self.durations[nodeid]
+                self.pruned = True
+
+    def save(self):
+        if self.cache is None or not (self.current or self.pruned):
+            return
+        self.durations.update(self.current)
+        self.current = {}
+        self.pruned = False
+        self.cache.set(self.CACHE_KEY, self.durations)
+
+
+class Scheduler(object):
+    """Hand out tests to a group of workers collecting the same tests. The
+    first collection reported splits the tests between all workers of the
+    group, and workers then request tests as they run them"""
+
+    def __init__(self, workers, duration):
+        self.workers = list(workers)
+        self.duration = duration
+        self.lock = threading.Lock()
+        self.queues = None
+        self.loads = None
+        self.assigned = dict((worker, []) for worker in self.workers)
+
+    def collected(self, nodeids):
+        with self.lock:
+            if self.queues is None:
+                self.plan(nodeids)
+
+    def plan(self, nodeids):
+        order = dict((nodeid, i) for i, nodeid in enumerate(nodeids))
+        heap = [(0, i) for i in range(len(self.workers))]
+        shares = [[] for _ in self.workers]
+        for nodeid in sorted(nodeids, key=self.duration, reverse=True):
+            load, i = heapq.heappop(heap)
+            shares[i].append(nodeid)
+            heapq.heappush(heap, (load + self.duration(nodeid), i))
+
+        # tests of every worker run in collection order, so tests sharing
+        # module and class fixtures run together
+        self.queues = {}
+        self.loads = {}
+        for worker, share in zip(self.workers, shares):
+            share.sort(key=order.get)
+            self.queues[worker] = deque(share)
+            self.loads[worker] = sum(self.duration(nodeid)
+                                     for nodeid in share)
+
+    def next(self, worker):
+        """Return the next test for `worker` to run, or None once there are
+        no more tests left"""
+        with self.lock:
+            if not self.queues:
+                return None
+
+            owner = worker
+            if self.queues[owner]:
+                nodeid = self.queues[owner].popleft()
+            else:
+                # steal from the worker with the most work left
+                victims = [victim for victim in self.workers
+                           if self.queues[victim]]
+                if not victims:
+                    return None
+                owner = max(victims, key=self.loads.get)
+                nodeid = self.queues[owner].pop()
+
+            self.loads[owner] -= self.duration(nodeid)
+            self.assigned[worker].append(nodeid)
+            return nodeid
+
+    def requeue(self, worker, finished):
+        """Return tests assigned to `worker` that did not finish to the head
+        of its queue, used when a worker is restarted"""
+        with self.lock:
+            if self.queues is None:
+                return
+            unfinished = [nodeid for nodeid in self.assigned[worker]
+                          if nodeid not in finished]
+            self.assigned[worker] = []
+            self.queues[worker].extendleft(reversed(unfinished))
+            self.loads[worker] += sum(self.duration(nodeid)
+                                      for nodeid in unfinished)
@@ -0,0 +1,64 @@
+"""
+A minimal polling source watcher used by the --ida-watch mode. Watching is
+done by periodically comparing modification times of python files under a set
+of root directories, which avoids depending on platform specific file system
+notification packages and is good enough for interactive use.
+"""
+
+import os
+import time
+
+
+class SourceWatcher(object):
+    IGNORED_DIRS = {'__pycache__', '.git', '.hg', '.svn', '.tox', '.nox',
+                    '.pytest_cache', '.cache', 'node_modules'}
+
+    def __init__(self, roots, interval=1.0):
+        self.roots = [os.path.abspath(str(root)) for root in roots]
+        self.interval = interval
+        self.mtimes = self.scan()
+
+    def iter_files(self):
+        for root in self.roots:
+            if os.path.isfile(root):
+                yield root
+                continue
+
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames
+                               if d not in self.IGNORED_DIRS]
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                for filename in filenames:
+                    if filename.endswith('.py'):
+                        yield os.path.join(dirpath, filename)
+
+    def scan(self):
+        mtimes = {}
+        for path in self.iter_files():
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                # file was removed while scanning
+                continue
+        return mtimes
+
+    def poll(self):
+        """Return a sorted list of paths added, removed or modified since
+        the last call to poll"""
+        mtimes = self.scan()
+        changed = set(mtimes) ^ set(self.mtimes)
+        changed.update(path for path, mtime in mtimes.items()
+                       if path in self.mtimes and self.mtimes[path] != mtime)
+        self.mtimes = mtimes
+        return sorted(changed)
+
+    def wait(self, stop=None):
+        """Block until at least one change is detected and return the changed
+        paths. `stop` is an optional callable polled every interval, when it
+        returns True waiting is aborted and an empty list is returned."""
+        while stop is None or not stop():
+            changed = self.poll()
+            if changed:
+                return changed
+            time.sleep(self.interval)
+        return []
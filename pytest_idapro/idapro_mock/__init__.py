@@ -45,4 +45,5 @@ from . import ida_strlist
 from . import ida_struct
 from . import ida_typeinf
 from . import ida_ua
+from . import ida_undo
 from . import ida_xref
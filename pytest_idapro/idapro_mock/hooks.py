@@ -0,0 +1,207 @@
+"""Dispatch of IDB, IDP and UI events to installed hooks (the mocked IDB_Hooks,
+IDP_Hooks and UI_Hooks classes), and a harness replaying streams of events at
+high rates to measure how long every handler takes.
+
+Plugins react to every rename, patch and function change, and handlers that
+are too slow freeze IDA during auto-analysis. Replaying a synthetic (or
+recorded) event storm into a plugin's hooks makes handler latency a property
+tests can assert on:
+
+    storm = EventStorm()
+    storm.synthetic('idb', 'renamed', lambda i: (0x1000 + i, "f%d" % i, 0),
+                    100000)
+    report = storm.replay()
+    assert report.percentile('MyHooks.renamed', 99) < 0.001
+"""
+
+import json
+import math
+import time
+from collections import OrderedDict
+
+# time.perf_counter was introduced in python3.3
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+class Dispatcher(object):
+    """Calls the handlers of installed hooks of a single kind"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.hooks = []
+        # {handler name: [durations]} while latencies are measured
+        self.timings = None
+        # list of dispatched (kind, event, args) while events are recorded
+        self.recording = None
+        # called with every event before hooks are, letting mocked modules
+        # follow changes
+        self.listeners = []
+
+    def install(self, hooks):
+        if hooks in self.hooks:
+            return False
+        self.hooks.append(hooks)
+        return True
+
+    def uninstall(self, hooks):
+        if hooks not in self.hooks:
+            return False
+        self.hooks.remove(hooks)
+        return True
+
+    def dispatch(self, event, *args):
+        if self.recording is not None:
+            self.recording.append((self.kind, event, list(args)))
+        for listener in self.listeners:
+            listener(event, *args)
+
+        result = 0
+        for hooks in list(self.hooks):
+            handler = getattr(hooks, event, None)
+            if handler is None:
+                continue
+            if self.timings is None:
+                result = handler(*args) or result
+                continue
+
+            start = _clock()
+            result = handler(*args) or result
+            duration = _clock() - start
+            name = "{}.{}".format(type(hooks).__name__, event)
+            self.timings.setdefault(name, []).append(duration)
+        return result
+
+
+dispatchers = {'idb': Dispatcher('idb'), 'idp': Dispatcher('idp'),
+               'ui': Dispatcher('ui')}
+
+
+def notify(kind, event, *args):
+    """Dispatch an event to all installed hooks of `kind`"""
+    return dispatchers[kind].dispatch(event, *args)
+
+
+class hooks_t(object):
+    """Base of mocked hook classes, handlers are methods named after events"""
+
+    kind = None
+
+    def hook(self):
+        return dispatchers[self.kind].install(self)
+
+    def unhook(self):
+        return dispatchers[self.kind].uninstall(self)
+
+
+def _percentile(durations, p):
+    """Nearest-rank percentile of sorted durations: the smallest duration
+    greater than or equal to at least `p` percent of them"""
+    rank = int(math.ceil(p / 100.0 * len(durations)))
+    return durations[max(rank, 1) - 1]
+
+
+class LatencyReport(object):
+    """Handler latencies measured while replaying events, in seconds"""
+
+    def __init__(self, timings, elapsed):
+        self.timings = OrderedDict((name, sorted(durations))
+                                   for name, durations
+                                   in sorted(timings.items()))
+        self.elapsed = elapsed
+
+    def handlers(self):
+        return list(self.timings.keys())
+
+    def count(self, handler):
+        return len(self.timings.get(handler, ()))
+
+    def percentile(self, handler, p):
+        durations = self.timings.get(handler)
+        if not durations:
+            return None
+        return _percentile(durations, p)
+
+    def summary(self):
+        """Return {handler: {count, p50, p90, p99, max}} for all handlers"""
+        return OrderedDict((name, {'count': len(durations),
+                                   'p50': _percentile(durations, 50),
+                                   'p90': _percentile(durations, 90),
+                                   'p99': _percentile(durations, 99),
+                                   'max': durations[-1]})
+                           for name, durations in self.timings.items())
+
+    def format(self):
+        lines = ["{:<40} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+            "handler", "calls", "p50 (us)", "p90 (us)", "p99 (us)",
+            "max (us)")]
+        for name, stats in self.summary().items():
+            lines.append("{:<40} {:>8} {:>10.1f} {:>10.1f} {:>10.1f} "
+                         "{:>10.1f}".format(name, stats['count'],
+                                            stats['p50'] * 1e6,
+                                            stats['p90'] * 1e6,
+                                            stats['p99'] * 1e6,
+                                            stats['max'] * 1e6))
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.format()
+
+
+class EventStorm(object):
+    """A stream of (kind, event, args) events to replay into installed
+    hooks"""
+
+    def __init__(self, events=None):
+        self.events = list(events or [])
+
+    def add(self, kind, event, *args):
+        self.events.append((kind, event, list(args)))
+
+    def synthetic(self, kind, event, args_factory, count):
+        """Add `count` events, `args_factory(i)` returning arguments of the
+        i'th event"""
+        for i in range(count):
+            self.events.append((kind, event, list(args_factory(i))))
+
+    def record(self):
+        """Start recording events dispatched by the mocked modules (patching
+        bytes, for example) into this storm, until `stop` is called"""
+        for dispatcher in dispatchers.values():
+            dispatcher.recording = self.events
+
+    @staticmethod
+    def stop():
+        for dispatcher in dispatchers.values():
+            dispatcher.recording = None
+
+    def save(self, path):
+        with open(path, 'w') as fh:
+            json.dump(self.events, fh)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as fh:
+            return cls((kind, event, args)
+                       for kind, event, args in json.load(fh))
+
+    def replay(self, rate=None, repeat=1):
+        """Dispatch all events `repeat` times, as fast as possible or at
+        `rate` events per second, and return a LatencyReport"""
+        timings = {}
+        for dispatcher in dispatchers.values():
+            dispatcher.timings = timings
+        start = _clock()
+        try:
+            sent = 0
+            for _ in range(repeat):
+                for kind, event, args in self.events:
+                    dispatchers[kind].dispatch(event, *args)
+                    sent += 1
+                    if rate:
+                        delay = start + float(sent) / rate - _clock()
+                        if delay > 0:
+                            time.sleep(delay)
+        finally:
+            for dispatcher in dispatchers.values():
+                dispatcher.timings = None
+        return LatencyReport(timings, _clock() - start)
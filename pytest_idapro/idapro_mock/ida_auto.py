@@ -0,0 +1,11 @@
+def auto_wait():
+    # the mocked database has no auto-analysis to wait for
+    return True
+
+
+def auto_is_ok():
+    return True
+
+
+def auto_make_step(ea1, ea2):
+    return False
@@ -0,0 +1,288 @@
+"""Mock the database byte store. Bytes are kept as a sorted list of
+non-overlapping mapped ranges, each backed by a single bytearray. Tests (or
+the mocked loader) map content using `map_bytes` or `map_file`, after which
+the usual byte access, patching and binary search functions operate on it.
+
+Binary patterns are compiled into regular expressions by `parse_binpat_str`,
+and `bin_search` runs them directly over the mapped ranges, so a search over
+a whole image is performed in bulk instead of address by address."""
+
+import bisect
+import os
+import re
+
+from . import ida_undo
+from .hooks import notify
+from .ida_idaapi import BADADDR
+
+
+BIN_SEARCH_CASE = 0x01
+BIN_SEARCH_NOCASE = 0x00
+BIN_SEARCH_NOBREAK = 0x02
+BIN_SEARCH_INITED = 0x04
+BIN_SEARCH_NOSHOW = 0x08
+BIN_SEARCH_FORWARD = 0x00
+BIN_SEARCH_BACKWARD = 0x10
+
+# size of windows searched when looking for the last match of a pattern
+BACKWARD_WINDOW = 0x10000
+
+# mapped ranges, as parallel lists of start addresses and contents
+_starts = []
+_ranges = []
+
+# input files backing unmodified mapped ranges, by range start address
+_sources = {}
+
+
+def map_bytes(ea, data):
+    """Map `data` at `ea`, replacing any previously mapped content it overlaps
+    with. Adjacent or overlapping ranges are merged"""
+    start, content = ea, bytearray(data)
+    end = start + len(content)
+
+    i = bisect.bisect_left(_starts, start)
+    if i and _starts[i - 1] + len(_ranges[i - 1]) >= start:
+        i -= 1
+
+    while i < len(_starts) and _starts[i] <= end:
+        other_start, other = _starts.pop(i), _ranges.pop(i)
+        _sources.pop(other_start, None)
+        other_end = other_start + len(other)
+        if other_start < start:
+            content[:0] = other[:start - other_start]
+            start = other_start
+        if other_end > end:
+            content.extend(other[end - other_start:])
+            end = other_end
+
+    _starts.insert(i, start)
+    _ranges.insert(i, content)
+
+
+def map_file(path, ea=0):
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    map_bytes(ea, data)
+
+    stat = os.stat(path)
+    start, content = _locate(ea)
+    if start == ea and len(content) == len(data):
+        _sources[ea] = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+
+
+def unmap_all():
+    del _starts[:]
+    del _ranges[:]
+    _sources.clear()
+
+
+def mapped_ranges():
+    """Return (start_ea, end_ea) tuples of all mapped ranges"""
+    return [(start, start + len(content))
+            for start, content in zip(_starts, _ranges)]
+
+
+def mapped_contents():
+    """Return (start_ea, bytearray) tuples of all mapped ranges"""
+    return list(zip(_starts, _ranges))
+
+
+def range_source(start_ea):
+    """Return a (path, mtime, size) tuple identifying the input file mapped
+    at `start_ea`, or None if the range was not mapped from a file or was
+    modified since"""
+    return _sources.get(start_ea)
+
+
+def _locate(ea):
+    i = bisect.bisect_right(_starts, ea) - 1
+    if i < 0 or ea >= _starts[i] + len(_ranges[i]):
+        return None, None
+    return _starts[i], _ranges[i]
+
+
+def is_loaded(ea):
+    return _locate(ea)[0] is not None
+
+
+def get_byte(ea):
+    start, content = _locate(ea)
+    if start is None:
+        return 0xFF
+    return content[ea - start]
+
+
+def get_bytes(ea, size):
+    start, content = _locate(ea)
+    if start is None or ea + size > start + len(content):
+        return None
+    return bytes(content[ea - start:ea - start + size])
+
+
+def patch_byte(ea, value):
+    start, content = _locate(ea)
+    if start is None:
+        return False
+    old_value = content[ea - start]
+    content[ea - start] = value
+    if old_value == value:
+        return False
+    _sources.pop(start, None)
+    notify('idb', 'byte_patched', ea, old_value)
+    return True
+
+
+def patch_bytes(ea, data):
+    for offset, value in enumerate(bytearray(data)):
+        patch_byte(ea + offset, value)
+
+
+put_byte = patch_byte
+put_bytes = patch_bytes
+
+
+class compiled_binpat_t(object):
+    """A compiled binary pattern. Each element of `parts` is either a byte
+    value, a string literal byte (matched case insensitively unless asked
+    otherwise) or None for a wildcard"""
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.length = len(parts)
+        self.regexes = {}
+
+    def regex(self, case):
+        if case not in self.regexes:
+            regex = b''.join(self.part_regex(part, case)
+                             for part in self.parts)
+            self.regexes[case] = re.compile(regex, re.DOTALL)
+        return self.regexes[case]
+
+    @staticmethod
+    def part_regex(part, case):
+        if part is None:
+            return b'.'
+        value, literal = part
+        char = bytes(bytearray([value]))
+        if literal and not case and char.isalpha():
+            return b'[' + char.lower() + char.upper() + b']'
+        return re.escape(char)
+
+
+class compiled_binpat_vec_t(list):
+    pass
+
+
+def parse_binpat_str(out, ea, text, radix=16, strlits_encoding=0):
+    """Compile an IDA binary pattern into `out`. Patterns are whitespace
+    separated numbers in `radix`, '?' (or '??') wildcards and quoted string
+    literals; numbers larger than a byte are encoded as little endian. Each
+    comma separated alternative becomes an item of `out`. Returns None on
+    success or an error message"""
+    for alternative in text.split(','):
+        parts = []
+        for token in re.findall(r'"[^"]*"|\S+', alternative):
+            if token in ('?', '??'):
+                parts.append(None)
+            elif token.startswith('"'):
+                parts.extend((value, True) for value
+                             in bytearray(token[1:-1].encode('utf-8')))
+            else:
+                try:
+                    value = int(token, radix)
+                except ValueError:
+                    return "Invalid pattern token '{}'".format(token)
+                while True:
+                    parts.append((value & 0xFF, False))
+                    value >>= 8
+                    if not value:
+                        break
+
+        if not parts:
+            return "Empty binary pattern"
+        out.append(compiled_binpat_t(parts))
+    return None
+
+
+def _search_forward(regex, content, lo, hi):
+    match = regex.search(content, lo, hi)
+    return match.start() if match else None
+
+
+def _search_backward(regex, length, content, lo, hi):
+    """Find the last match starting in [lo, hi - length], searching windows
+    of the content from its end"""
+    window = max(BACKWARD_WINDOW, 2 * length)
+    window_end = hi
+    while window_end - lo >= length:
+        window_start = max(lo, window_end - window)
+        last = None
+        match = regex.search(content, window_start, window_end)
+        while match:
+            last = match.start()
+            match = regex.search(content, last + 1, window_end)
+        if last is not None or window_start == lo:
+            return last
+        # matches may cross into the previous window
+        window_end = window_start + length - 1
+    return None
+
+
+def bin_search(start_ea, end_ea, data, flags):
+    """Search the mapped ranges between `start_ea` and `end_ea` (exclusive)
+    for any of the compiled patterns in `data`. Returns the address of the
+    first (or last, when searching backward) match, or BADADDR"""
+    if isinstance(data, compiled_binpat_t):
+        data = [data]
+    backward = flags & BIN_SEARCH_BACKWARD
+    case = bool(flags & BIN_SEARCH_CASE)
+
+    ranges = list(zip(_starts, _ranges))
+    if backward:
+        ranges.reverse()
+
+    for range_start, content in ranges:
+        lo = max(start_ea, range_start) - range_start
+        hi = min(end_ea, range_start + len(content)) - range_start
+        if lo >= hi:
+            continue
+
+        found = None
+        for binpat in data:
+            regex = binpat.regex(case)
+            if backward:
+                offset = _search_backward(regex, binpat.length, content,
+                                          lo, hi)
+            else:
+                offset = _search_forward(regex, content, lo, hi)
+            if offset is None:
+                continue
+            if found is None:
+                found = offset
+            elif backward:
+                found = max(found, offset)
+            else:
+                found = min(found, offset)
+
+        # ranges are searched in order, the first one matching is the one
+        if found is not None:
+            return range_start + found
+
+    return BADADDR
+
+
+def _capture_state():
+    return ([(start, bytes(content))
+             for start, content in zip(_starts, _ranges)], dict(_sources))
+
+
+def _restore_state(state):
+    ranges, sources = state
+    _starts[:] = [start for start, _ in ranges]
+    _ranges[:] = [bytearray(content) for _, content in ranges]
+    _sources.clear()
+    _sources.update(sources)
+
+
+ida_undo.register_state(_capture_state, _restore_state)
@@ -0,0 +1,260 @@
+"""Mock function flow charts. Basic blocks of a function are either added to
+the mocked database using `add_flowchart`, or served from recorded fixtures:
+JSON files (one per function, named after its hexadecimal start address) in
+FIXTURES_PATH, as produced by running `serialize_flowchart` over IDA's own
+FlowChart objects.
+
+Blocks of a flow chart are kept in flat arrays, with successors and
+predecessors stored as offsets into shared edge arrays, and BasicBlock objects
+are only created when accessed. Flow charts of huge functions therefore cost
+a few bytes per block and edge, and are shared between FlowChart objects of
+the same function."""
+
+import array
+import bisect
+import json
+import os
+
+from . import ida_undo
+
+
+FIXTURES_PATH = "flowcharts/"
+
+FC_PRINT = 0x0001
+FC_NOEXT = 0x0002
+FC_PREDS = 0x0004
+FC_APPND = 0x0008
+FC_CHKBREAK = 0x0010
+FC_CALL_ENDS = 0x0020
+FC_NOPREDS = 0x0040
+
+fcb_normal = 0
+fcb_indjump = 1
+fcb_ret = 2
+fcb_cndret = 3
+fcb_noret = 4
+fcb_enoret = 5
+fcb_extern = 6
+fcb_error = 7
+
+try:
+    _EA_TYPE = array.array('Q').typecode
+except ValueError:
+    # python2 arrays lack 64bit integers, longs are 64bit on most platforms
+    _EA_TYPE = 'L'
+
+
+def _offsets(counts):
+    offsets = array.array('L', [0])
+    for count in counts:
+        offsets.append(offsets[-1] + count)
+    return offsets
+
+
+class _graph_t(object):
+    """Compact storage of a flow chart: block bounds and types in parallel
+    arrays, and adjacency lists in compressed sparse row form"""
+
+    def __init__(self, start_ea, end_ea, blocks):
+        self.start_ea = start_ea
+        self.end_ea = end_ea
+        self.starts = array.array(_EA_TYPE)
+        self.ends = array.array(_EA_TYPE)
+        self.types = array.array('B')
+        self.succ_targets = array.array('L')
+        counts = []
+        for block in blocks:
+            start, end, succs = block[:3]
+            self.starts.append(start)
+            self.ends.append(end)
+            self.types.append(block[3] if len(block) > 3 else fcb_normal)
+            self.succ_targets.extend(succs)
+            counts.append(len(succs))
+        self.succ_offsets = _offsets(counts)
+
+        # predecessors are derived by counting sort over the edges
+        pred_counts = [0] * len(self.starts)
+        for target in self.succ_targets:
+            pred_counts[target] += 1
+        self.pred_offsets = _offsets(pred_counts)
+        self.pred_sources = array.array('L', [0] * len(self.succ_targets))
+        positions = list(self.pred_offsets[:-1])
+        for source in range(len(self.starts)):
+            for i in range(self.succ_offsets[source],
+                           self.succ_offsets[source + 1]):
+                target = self.succ_targets[i]
+                self.pred_sources[positions[target]] = source
+                positions[target] += 1
+
+    def __len__(self):
+        return len(self.starts)
+
+    def succs(self, n):
+        return self.succ_targets[self.succ_offsets[n]:
+                                 self.succ_offsets[n + 1]]
+
+    def preds(self, n):
+        return self.pred_sources[self.pred_offsets[n]:
+                                 self.pred_offsets[n + 1]]
+
+
+# flow charts by function start address, kept sorted for lookups of
+# addresses inside functions
+_starts = []
+_graphs = {}
+_indexed_paths = set()
+
+
+def add_flowchart(start_ea, blocks, end_ea=None):
+    """Add the flow chart of the function starting at `start_ea`. `blocks`
+    is a sequence of (start_ea, end_ea, successors[, type]) tuples, where
+    successors are indices of other blocks"""
+    blocks = list(blocks)
+    if end_ea is None:
+        end_ea = max([block[1] for block in blocks] or [start_ea + 1])
+    if start_ea not in _graphs:
+        bisect.insort(_starts, start_ea)
+    _graphs[start_ea] = _graph_t(start_ea, end_ea, blocks)
+
+
+def del_flowchart(start_ea):
+    if _graphs.pop(start_ea, None) is None:
+        return False
+    _starts.remove(start_ea)
+    return True
+
+
+def load_fixtures(path=None):
+    """Index all fixture files in `path` (defaults to FIXTURES_PATH). Files
+    are only read once a flow chart of their function is requested"""
+    path = path or FIXTURES_PATH
+    if path in _indexed_paths or not os.path.isdir(path):
+        return
+    _indexed_paths.add(path)
+
+    for filename in sorted(os.listdir(path)):
+        name, ext = os.path.splitext(filename)
+        if ext != '.json':
+            continue
+        try:
+            ea = int(name, 16)
+        except ValueError:
+            continue
+        if ea not in _graphs:
+            bisect.insort(_starts, ea)
+            _graphs[ea] = os.path.join(path, filename)
+
+
+def clear_flowcharts():
+    del _starts[:]
+    _graphs.clear()
+    _indexed_paths.clear()
+
+
+def _graph_for(ea):
+    load_fixtures()
+
+    i = bisect.bisect_right(_starts, ea) - 1
+    if i < 0:
+        return None
+    start = _starts[i]
+    graph = _graphs[start]
+    if not isinstance(graph, _graph_t):
+        with open(graph, 'r') as fh:
+            data = json.load(fh)
+        graph = _graphs[start] = _graph_t(data['start_ea'], data['end_ea'],
+                                          data['blocks'])
+    if ea >= graph.end_ea:
+        return None
+    return graph
+
+
+def serialize_flowchart(flowchart, start_ea=None, end_ea=None):
+    """Return a fixture of a flow chart, which may also be one of IDA's"""
+    blocks = [[block.start_ea, block.end_ea,
+               [succ.id for succ in block.succs()], block.type]
+              for block in flowchart]
+    if start_ea is None:
+        start_ea = min(block[0] for block in blocks)
+    if end_ea is None:
+        end_ea = max(block[1] for block in blocks)
+    return {'start_ea': start_ea, 'end_ea': end_ea, 'blocks': blocks}
+
+
+class BasicBlock(object):
+    def __init__(self, id, fc):
+        self.id = id
+        self._fc = fc
+        graph = fc._q
+        self.start_ea = graph.starts[id]
+        self.end_ea = graph.ends[id]
+        self.type = graph.types[id]
+
+    # IDA 6.x names
+    @property
+    def startEA(self):
+        return self.start_ea
+
+    @property
+    def endEA(self):
+        return self.end_ea
+
+    def succs(self):
+        for n in self._fc._q.succs(self.id):
+            yield self._fc[n]
+
+    def preds(self):
+        if self._fc.flags & FC_NOPREDS:
+            return
+        for n in self._fc._q.preds(self.id):
+            yield self._fc[n]
+
+    def __repr__(self):
+        return "<BasicBlock(mock) {} {:#x}-{:#x}>".format(self.id,
+                                                          self.start_ea,
+                                                          self.end_ea)
+
+
+class FlowChart(object):
+    def __init__(self, f=None, bounds=None, flags=0):
+        if f is None and bounds is None:
+            raise Exception("Either f or bounds must be provided")
+        if f is not None:
+            self.ea = getattr(f, 'start_ea', getattr(f, 'startEA', f))
+        else:
+            self.ea = bounds[0]
+        self.flags = flags
+        self.refresh()
+
+    def refresh(self):
+        self._q = _graph_for(self.ea)
+        if self._q is None:
+            self._q = _graph_t(self.ea, self.ea, [])
+        self.size = len(self._q)
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise KeyError(index)
+        return BasicBlock(index, self)
+
+    _getitem = __getitem__
+
+    def __iter__(self):
+        return (self[index] for index in range(self.size))
+
+
+def _capture_state():
+    return list(_starts), dict(_graphs), set(_indexed_paths)
+
+
+def _restore_state(state):
+    starts, graphs, indexed_paths = state
+    _starts[:] = starts
+    _graphs.clear()
+    _graphs.update(graphs)
+    # fixtures indexed since the state was captured are indexed again
+    _indexed_paths.clear()
+    _indexed_paths.update(indexed_paths)
+
+
+ida_undo.register_state(_capture_state, _restore_state)
@@ -1,5 +1,107 @@
-from .mock import MockObject
+"""Mock custom graph views. GraphViewer builds its node and edge model by
+calling OnRefresh, exactly like IDA does, but never renders it: no Qt widget
+or layout is created, so graphs of hundreds of thousands of nodes can be
+built and inspected by tests. Edges are kept in flat arrays, and adjacency
+lists are only built when queried using the mock specific `Succs` and
+`Preds` methods."""
 
+import array
 
-class GraphViewer(MockObject):
-    pass
+
+class GraphViewer(object):
+    def __init__(self, title, close_open=False):
+        self._title = title
+        self._close_open = close_open
+        self._shown = False
+        self._selected = None
+        self._adjacency = None
+        self.Clear()
+
+    def AddNode(self, obj):
+        self._nodes.append(obj)
+        return len(self._nodes) - 1
+
+    def AddEdge(self, src_node, dest_node):
+        self._edge_srcs.append(src_node)
+        self._edge_dsts.append(dest_node)
+        self._adjacency = None
+
+    def Clear(self):
+        self._nodes = []
+        self._edge_srcs = array.array('L')
+        self._edge_dsts = array.array('L')
+        self._adjacency = None
+
+    def Count(self):
+        return len(self._nodes)
+
+    def EdgeCount(self):
+        return len(self._edge_srcs)
+
+    def __getitem__(self, idx):
+        return self._nodes[idx]
+
+    def Show(self):
+        if not self.OnRefresh():
+            return False
+        self._shown = True
+        return True
+
+    def Refresh(self):
+        return self.OnRefresh()
+
+    def Close(self):
+        if not self._shown:
+            return
+        self._shown = False
+        self.OnClose()
+
+    def Select(self, node_id):
+        self._selected = node_id
+        self.OnSelect(node_id)
+        return True
+
+    def OnRefresh(self):
+        return True
+
+    def OnGetText(self, node_id):
+        return str(self[node_id])
+
+    def OnSelect(self, node_id):
+        return True
+
+    def OnClose(self):
+        pass
+
+    def _build_adjacency(self):
+        """Sort edges by source and by destination, in linear time"""
+        count = len(self._nodes)
+        adjacency = []
+        for keys, values in ((self._edge_srcs, self._edge_dsts),
+                             (self._edge_dsts, self._edge_srcs)):
+            offsets = [0] * (count + 1)
+            for key in keys:
+                offsets[key + 1] += 1
+            for i in range(count):
+                offsets[i + 1] += offsets[i]
+            positions = offsets[:-1]
+            targets = array.array('L', [0] * len(values))
+            for key, value in zip(keys, values):
+                targets[positions[key]] = value
+                positions[key] += 1
+            adjacency.append((offsets, targets))
+        self._adjacency = adjacency
+
+    def _neighbours(self, direction, node_id):
+        if self._adjacency is None:
+            self._build_adjacency()
+        offsets, targets = self._adjacency[direction]
+        return list(targets[offsets[node_id]:offsets[node_id + 1]])
+
+    def Succs(self, node_id):
+        """Mock only: destinations of the edges leaving `node_id`"""
+        return self._neighbours(0, node_id)
+
+    def Preds(self, node_id):
+        """Mock only: sources of the edges entering `node_id`"""
+        return self._neighbours(1, node_id)
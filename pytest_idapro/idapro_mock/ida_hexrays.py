@@ -0,0 +1,325 @@
+"""Mock the Hex-Rays decompiler by serving pseudocode and ctree items from a
+store of recorded fixtures, indexed by function address. Fixtures are JSON
+files (one per function) in FIXTURES_PATH, as written by the
+`--ida-hexrays-record` option when running inside IDA, and may be added
+explicitly using `load_fixtures` or `add_fixture`.
+
+The fixture directory is indexed once, and every function is only loaded and
+built once; later calls to `decompile` return the same cfunc_t object, much
+like the decompiler's own cache of decompiled functions."""
+
+import bisect
+import json
+import os
+
+
+FIXTURES_PATH = "hexrays/"
+
+DECOMP_NO_WAIT = 0x0001
+DECOMP_NO_CACHE = 0x0002
+DECOMP_NO_FRAME = 0x0004
+DECOMP_WARNINGS = 0x0008
+
+MERR_OK = 0
+MERR_FUNCSIZE = -29
+
+# ctree item types, expressions first and statements right after
+_ctypes = ['cot_empty', 'cot_comma', 'cot_asg', 'cot_asgbor', 'cot_asgxor',
+           'cot_asgband', 'cot_asgadd', 'cot_asgsub', 'cot_asgmul',
+           'cot_asgsshr', 'cot_asgushr', 'cot_asgshl', 'cot_asgsdiv',
+           'cot_asgudiv', 'cot_asgsmod', 'cot_asgumod', 'cot_tern', 'cot_lor',
+           'cot_land', 'cot_bor', 'cot_xor', 'cot_band', 'cot_eq', 'cot_ne',
+           'cot_sge', 'cot_uge', 'cot_sle', 'cot_ule', 'cot_sgt', 'cot_ugt',
+           'cot_slt', 'cot_ult', 'cot_sshr', 'cot_ushr', 'cot_shl', 'cot_add',
+           'cot_sub', 'cot_mul', 'cot_sdiv', 'cot_udiv', 'cot_smod',
+           'cot_umod', 'cot_fadd', 'cot_fsub', 'cot_fmul', 'cot_fdiv',
+           'cot_fneg', 'cot_neg', 'cot_cast', 'cot_lnot', 'cot_bnot',
+           'cot_ptr', 'cot_ref', 'cot_postinc', 'cot_postdec', 'cot_preinc',
+           'cot_predec', 'cot_call', 'cot_idx', 'cot_memref', 'cot_memptr',
+           'cot_num', 'cot_fnum', 'cot_str', 'cot_obj', 'cot_var', 'cot_insn',
+           'cot_sizeof', 'cot_helper', 'cot_type', 'cit_empty', 'cit_block',
+           'cit_expr', 'cit_if', 'cit_for', 'cit_while', 'cit_do',
+           'cit_switch', 'cit_break', 'cit_continue', 'cit_return',
+           'cit_goto', 'cit_asm']
+globals().update((name, value) for value, name in enumerate(_ctypes))
+cot_last = _ctypes.index('cot_type')
+cit_end = len(_ctypes)
+
+CV_FAST = 0x0000
+CV_PRUNE = 0x0001
+CV_PARENTS = 0x0002
+CV_POST = 0x0004
+CV_RESTART = 0x0008
+CV_INSNS = 0x0010
+
+
+class DecompilationFailure(Exception):
+    pass
+
+
+class hexrays_failure_t(object):
+    def __init__(self, code=MERR_OK, errea=None, desc=""):
+        self.code = code
+        self.errea = errea
+        self._desc = desc
+
+    def desc(self):
+        return self._desc
+
+    def __str__(self):
+        return self._desc
+
+
+class citem_t(object):
+    def __init__(self, op, ea, index):
+        self.op = op
+        self.ea = ea
+        self.index = index
+        self.children = []
+
+    def is_expr(self):
+        return self.op <= cot_last
+
+    def contains_label(self):
+        return False
+
+    def find_parent_of(self, item):
+        for child in self.children:
+            if child is item:
+                return self
+            parent = child.find_parent_of(item)
+            if parent is not None:
+                return parent
+        return None
+
+    @property
+    def to_specific_type(self):
+        return self
+
+    def __repr__(self):
+        return "<{}({}) at {:#x}>".format(self.__class__.__name__,
+                                          _ctypes[self.op], self.ea)
+
+
+class cexpr_t(citem_t):
+    pass
+
+
+class cinsn_t(citem_t):
+    pass
+
+
+class simpleline_t(object):
+    def __init__(self, line):
+        self.line = line
+
+
+class lvar_t(object):
+    def __init__(self, name, type_name="", is_arg=False):
+        self.name = name
+        self.type_name = type_name
+        self._is_arg = is_arg
+
+    def is_arg_var(self):
+        return self._is_arg
+
+    def type(self):
+        return self.type_name
+
+
+class cfunc_t(object):
+    def __init__(self, data):
+        self.entry_ea = data['entry_ea']
+        self.end_ea = data.get('end_ea', self.entry_ea + 1)
+        self.pseudocode = [simpleline_t(line) for line in data['pseudocode']]
+        self.lvars = [lvar_t(var['name'], var.get('type', ""),
+                             var.get('is_arg', False))
+                      for var in data.get('lvars', [])]
+        self.warnings = list(data.get('warnings', []))
+
+        self.treeitems = []
+        self.body = None
+        for index, item in enumerate(data.get('treeitems', [])):
+            op = globals()[item['op']]
+            cls = cexpr_t if op <= cot_last else cinsn_t
+            citem = cls(op, item['ea'], index)
+            self.treeitems.append(citem)
+            if item.get('parent') is None:
+                self.body = self.body or citem
+            else:
+                self.treeitems[item['parent']].children.append(citem)
+
+    def get_pseudocode(self):
+        return self.pseudocode
+
+    def get_lvars(self):
+        return self.lvars
+
+    def get_warnings(self):
+        return self.warnings
+
+    def refresh_func_ctext(self):
+        pass
+
+    def __str__(self):
+        return "\n".join(line.line for line in self.pseudocode)
+
+
+class ctree_visitor_t(object):
+    def __init__(self, flags=CV_FAST):
+        self.cv_flags = flags
+        self.parents = []
+
+    def prune_now(self):
+        self.cv_flags |= CV_PRUNE
+
+    def apply_to(self, item, parent):
+        return self._visit(item)
+
+    def apply_to_exprs(self, item, parent):
+        return self._visit(item, exprs_only=True)
+
+    def _visit(self, item, exprs_only=False):
+        if item.is_expr():
+            # CV_INSNS visits statements only, pruning all expressions
+            if self.cv_flags & CV_INSNS:
+                return 0
+            result = self.visit_expr(item)
+        elif exprs_only:
+            result = 0
+        else:
+            result = self.visit_insn(item)
+        if result:
+            return result
+
+        if self.cv_flags & CV_PRUNE:
+            self.cv_flags &= ~CV_PRUNE
+        else:
+            if self.cv_flags & CV_PARENTS:
+                self.parents.append(item)
+            for child in item.children:
+                result = self._visit(child, exprs_only)
+                if result:
+                    return result
+            if self.cv_flags & CV_PARENTS:
+                self.parents.pop()
+
+        if self.cv_flags & CV_POST:
+            if item.is_expr():
+                return self.leave_expr(item)
+            return self.leave_insn(item)
+        return 0
+
+    def visit_insn(self, insn):
+        return 0
+
+    def visit_expr(self, expr):
+        return 0
+
+    def leave_insn(self, insn):
+        return 0
+
+    def leave_expr(self, expr):
+        return 0
+
+
+class ctree_parentee_t(ctree_visitor_t):
+    def __init__(self, post=False):
+        flags = CV_PARENTS | (CV_POST if post else 0)
+        super(ctree_parentee_t, self).__init__(flags)
+
+
+# fixture store, indexed by function start address
+_fixtures = {}
+_starts = []
+_cfuncs = {}
+_indexed_paths = set()
+
+
+def add_fixture(data):
+    """Add a single function fixture, provided as a dictionary in the same
+    format as recorded fixture files"""
+    ea = data['entry_ea']
+    if ea not in _fixtures:
+        bisect.insort(_starts, ea)
+    _fixtures[ea] = data
+    _cfuncs.pop(ea, None)
+
+
+def load_fixtures(path=None):
+    """Index all fixture files in `path` (defaults to FIXTURES_PATH). Files
+    are only parsed once the function they describe is first decompiled"""
+    path = path or FIXTURES_PATH
+    if path in _indexed_paths or not os.path.isdir(path):
+        return
+    _indexed_paths.add(path)
+
+    for filename in sorted(os.listdir(path)):
+        name, ext = os.path.splitext(filename)
+        if ext != '.json':
+            continue
+        try:
+            ea = int(name, 16)
+        except ValueError:
+            continue
+        if ea not in _fixtures:
+            bisect.insort(_starts, ea)
+        _fixtures[ea] = os.path.join(path, filename)
+
+
+def clear_fixtures():
+    del _starts[:]
+    _fixtures.clear()
+    _cfuncs.clear()
+    _indexed_paths.clear()
+
+
+def _fixture_for(ea):
+    load_fixtures()
+
+    i = bisect.bisect_right(_starts, ea) - 1
+    if i < 0:
+        return None
+    start = _starts[i]
+    data = _fixtures[start]
+    if not isinstance(data, dict):
+        with open(data, 'r') as fh:
+            data = _fixtures[start] = json.load(fh)
+    if start != ea and ea >= data.get('end_ea', start + 1):
+        return None
+    return data
+
+
+def init_hexrays_plugin(flags=0):
+    return True
+
+
+def term_hexrays_plugin():
+    pass
+
+
+def decompile(ea, hf=None, flags=0):
+    ea = getattr(ea, 'start_ea', ea)
+    data = _fixture_for(ea)
+    if data is None:
+        failure = "No recorded decompilation for {:#x}".format(ea)
+        if hf is not None:
+            hf.code, hf.errea, hf._desc = MERR_FUNCSIZE, ea, failure
+        raise DecompilationFailure(failure)
+
+    start = data['entry_ea']
+    if flags & DECOMP_NO_CACHE or start not in _cfuncs:
+        _cfuncs[start] = cfunc_t(data)
+    return _cfuncs[start]
+
+
+def mark_cfunc_dirty(ea, close_views=False):
+    return _cfuncs.pop(ea, None) is not None
+
+
+def clear_cached_cfuncs():
+    _cfuncs.clear()
+
+
+def get_ctype_name(op):
+    return _ctypes[op].split('_', 1)[1]
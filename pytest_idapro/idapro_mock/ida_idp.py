@@ -0,0 +1,12 @@
+from .hooks import hooks_t
+
+
+class IDB_Hooks(hooks_t):
+    """Database event hooks, handlers are called by the mocked modules (for
+    example byte_patched when patching bytes) and by replayed event storms"""
+
+    kind = 'idb'
+
+
+class IDP_Hooks(hooks_t):
+    kind = 'idp'
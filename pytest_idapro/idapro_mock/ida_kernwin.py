@@ -1,8 +1,18 @@
+from collections import OrderedDict
+
 from .mock import MockObject
+from .ida_idaapi import BADADDR
+from .hooks import hooks_t, dispatchers
 
 # TODO: support other pyqt libraries
 from PyQt5 import QtWidgets
 
+
+def is_idaq():
+    # the mocked user interface is always available
+    return True
+
+
 # Passed as 'flags' parameter to attach_action_to_menu()
 SETMENU_INS = 0  # add menu item before the specified path (default)
 SETMENU_APP = 1  # add menu item after the specified path
@@ -22,28 +32,355 @@ AST_DISABLE_FOR_FORM = 6
 AST_DISABLE = 7
 
 
-class action_handler_t(MockObject):
+AST_ALWAYS = (AST_ENABLE_ALWAYS, AST_DISABLE_ALWAYS)
+AST_FOR_IDB = (AST_ENABLE_FOR_IDB, AST_DISABLE_FOR_IDB)
+AST_FOR_FORM = (AST_ENABLE_FOR_FORM, AST_DISABLE_FOR_FORM)
+
+
+class action_handler_t(object):
+    def __init__(self):
+        pass
+
+    def activate(self, ctx):
+        return 0
+
+    def update(self, ctx):
+        return AST_DISABLE
+
+
+class action_ctx_base_t(object):
+    def __init__(self, action=None, widget=None):
+        self.action = action
+        self.widget = widget
+        self.widget_type = -1
+        self.widget_title = ""
+        self.cur_ea = BADADDR
+        self.focus = widget
+
+
+class action_activation_ctx_t(action_ctx_base_t):
     pass
 
 
-class action_desc_t(MockObject):
+class action_update_ctx_t(action_ctx_base_t):
     pass
 
 
+class action_desc_t(object):
+    def __init__(self, name, label, handler, shortcut=None, tooltip=None,
+                 icon=-1, flags=0):
+        self.name = name
+        self.label = label
+        self.handler = handler
+        self.shortcut = shortcut
+        self.tooltip = tooltip
+        self.icon = icon
+        self.flags = flags
+
+
 class py_load_custom_icon_fn(MockObject):
     pass
 
 
-class register_action(MockObject):
-    pass
+# Registered actions are kept as Qt actions on the mocked main window, created
+# along with the window when actions are registered before it (as happens in
+# forked children, which create Qt objects on first use). Menus and toolbars
+# actions are attached to before are populated once the window exists. Their
+# handlers' update methods are polled by `update_actions` like IDA does when
+# the user interface context changes, honoring the validity of the returned
+# AST_* states: *_ALWAYS states are final, *_FOR_IDB states last until the
+# database changes and *_FOR_FORM states until another widget is activated.
+# How many times every handler was polled is counted, so tests can catch
+# handlers updating (and doing expensive work) more often than they have to.
 
+_main_window = None
+_current_widget = None
+_actions = OrderedDict()
+_update_counts = {}
+# incremented on database and widget changes, invalidating cached states
+_idb_generation = [0]
+_form_generation = [0]
+# set while handlers are polled, handlers refreshing the user interface from
+# their update are not polled again
+_updating = [False]
 
-class attach_action_to_menu(MockObject):
-    pass
 
+class _action_t(object):
+    def __init__(self, desc):
+        self.desc = desc
+        self.state = None
+        # generations at the time of the last update
+        self.idb_generation = None
+        self.form_generation = None
+        self.menus = []
+        self.toolbars = []
+        # attachments waiting for the main window, as (function, args)
+        self.pending = []
+        self.qaction = None
+        self.materialize()
 
-class attach_action_to_toolbar(MockObject):
-    pass
+    def materialize(self):
+        """Create the Qt action and perform pending attachments, once the
+        main window exists"""
+        if self.qaction is not None or _main_window is None:
+            return
+        desc = self.desc
+        self.qaction = QtWidgets.QAction(desc.label, _main_window)
+        self.qaction.setObjectName(desc.name)
+        if desc.shortcut:
+            self.qaction.setShortcut(desc.shortcut)
+        if desc.tooltip:
+            self.qaction.setToolTip(desc.tooltip)
+        self.qaction.triggered.connect(
+            lambda checked=False: process_ui_action(desc.name))
+        self.qaction.setEnabled(self.enabled())
+
+        pending, self.pending = self.pending, []
+        for attach, args in pending:
+            attach(*args)
+
+    def detach_pending(self, attach, target):
+        for i, (pending_attach, args) in enumerate(self.pending):
+            if pending_attach is attach and args[0] == target:
+                del self.pending[i]
+                return True
+        return False
+
+    def enabled(self):
+        return self.state is None or self.state < AST_DISABLE_ALWAYS
+
+    def needs_update(self):
+        if self.state is None or self.state in (AST_ENABLE, AST_DISABLE):
+            return True
+        if self.state in AST_FOR_IDB:
+            return self.idb_generation != _idb_generation[0]
+        if self.state in AST_FOR_FORM:
+            return self.form_generation != _form_generation[0]
+        return False
+
+    def update(self):
+        ctx = action_update_ctx_t(self.desc.name, _current_widget)
+        _update_counts[self.desc.name] = _update_counts.get(self.desc.name,
+                                                            0) + 1
+        _updating[0] = True
+        try:
+            self.set_state(self.desc.handler.update(ctx))
+        finally:
+            _updating[0] = False
+        self.idb_generation = _idb_generation[0]
+        self.form_generation = _form_generation[0]
+
+    def set_state(self, state):
+        self.state = state
+        if self.qaction is not None:
+            self.qaction.setEnabled(self.enabled())
+
+
+def set_main_window(window):
+    """Set the mocked main window, holding menus and toolbars of actions"""
+    global _main_window
+    _main_window = window
+    for action in list(_actions.values()):
+        action.materialize()
+
+
+def update_actions(database_changed=False, widget_changed=False):
+    """Poll the handlers of registered actions whose states are no longer
+    valid, as IDA does whenever the user interface context changes"""
+    if database_changed:
+        _idb_generation[0] += 1
+    if widget_changed:
+        _form_generation[0] += 1
+    if _updating[0]:
+        return
+    for action in list(_actions.values()):
+        if action.needs_update():
+            action.update()
+
+
+def _database_changed(event, *args):
+    # every database event invalidates the states of actions depending on
+    # the database
+    _idb_generation[0] += 1
+
+
+dispatchers['idb'].listeners.append(_database_changed)
+
+
+def get_update_count(name):
+    """Return the number of times the handler of an action was polled"""
+    return _update_counts.get(name, 0)
+
+
+def reset_update_counts():
+    _update_counts.clear()
+
+
+def activate_widget(widget, take_focus):
+    global _current_widget
+    _current_widget = widget
+    update_actions(widget_changed=True)
+
+
+def get_current_widget():
+    return _current_widget
+
+
+def register_action(desc):
+    if desc.name in _actions or not desc.name:
+        return False
+    action = _actions[desc.name] = _action_t(desc)
+    action.update()
+    return True
+
+
+def unregister_action(name):
+    action = _actions.pop(name, None)
+    if action is None:
+        return False
+    for menu in action.menus:
+        menu.removeAction(action.qaction)
+    for toolbar in action.toolbars:
+        toolbar.removeAction(action.qaction)
+    if action.qaction is not None:
+        action.qaction.deleteLater()
+    return True
+
+
+def get_registered_actions():
+    return list(_actions.keys())
+
+
+def get_action_label(name):
+    action = _actions.get(name)
+    return action.desc.label if action is not None else None
+
+
+def get_action_state(name):
+    action = _actions.get(name)
+    return action.state if action is not None else None
+
+
+def get_action_enabled(name):
+    action = _actions.get(name)
+    return action.enabled() if action is not None else None
+
+
+def update_action_state(name, state):
+    action = _actions.get(name)
+    if action is None:
+        return False
+    action.set_state(state)
+    return True
+
+
+def update_action_label(name, label):
+    action = _actions.get(name)
+    if action is None:
+        return False
+    action.desc.label = label
+    if action.qaction is not None:
+        action.qaction.setText(label)
+    return True
+
+
+def process_ui_action(name, flags=0):
+    action = _actions.get(name)
+    if action is None or not action.enabled():
+        return False
+    ctx = action_activation_ctx_t(name, _current_widget)
+    action.desc.handler.activate(ctx)
+    return True
+
+
+def _find_menu(parent, title, create):
+    for child in parent.actions():
+        menu = child.menu()
+        if menu is not None and menu.title().replace('&', '') == title:
+            return menu
+    if not create:
+        return None
+    return parent.addMenu(title)
+
+
+def attach_action_to_menu(menupath, name, flags=SETMENU_INS):
+    """Attach an action to a menu. A path ending with a slash (Edit/Plugins/)
+    appends the action to the menu, otherwise the action is placed before
+    (or after, with SETMENU_APP) the named item of the menu"""
+    action = _actions.get(name)
+    if action is None:
+        return False
+    if action.qaction is None:
+        action.pending.append((attach_action_to_menu,
+                               (menupath, name, flags)))
+        return True
+
+    path = menupath.split('/')
+    menu = _main_window.menuWidget()
+    for title in path[:-1]:
+        menu = _find_menu(menu, title, True)
+
+    items = menu.actions()
+    labels = [item.text().replace('&', '') for item in items]
+    if path[-1] in labels:
+        index = labels.index(path[-1]) + (1 if flags & SETMENU_APP else 0)
+        if index < len(items):
+            menu.insertAction(items[index], action.qaction)
+        else:
+            menu.addAction(action.qaction)
+    else:
+        menu.addAction(action.qaction)
+    action.menus.append(menu)
+    return True
+
+
+def detach_action_from_menu(menupath, name):
+    action = _actions.get(name)
+    if action is None:
+        return False
+    if action.detach_pending(attach_action_to_menu, menupath):
+        return True
+    if not action.menus:
+        return False
+    action.menus.pop().removeAction(action.qaction)
+    return True
+
+
+def attach_action_to_toolbar(toolbar, name):
+    action = _actions.get(name)
+    if action is None:
+        return False
+    if action.qaction is None:
+        action.pending.append((attach_action_to_toolbar, (toolbar, name)))
+        return True
+
+    qtoolbar = _main_window.findChild(QtWidgets.QToolBar, toolbar)
+    if qtoolbar is None:
+        qtoolbar = _main_window.addToolBar(toolbar)
+        qtoolbar.setObjectName(toolbar)
+    qtoolbar.addAction(action.qaction)
+    action.toolbars.append(qtoolbar)
+    return True
+
+
+def detach_action_from_toolbar(toolbar, name):
+    action = _actions.get(name)
+    if action is None:
+        return False
+    if action.detach_pending(attach_action_to_toolbar, toolbar):
+        return True
+    if _main_window is None:
+        return False
+    qtoolbar = _main_window.findChild(QtWidgets.QToolBar, toolbar)
+    if qtoolbar not in action.toolbars:
+        return False
+    qtoolbar.removeAction(action.qaction)
+    action.toolbars.remove(qtoolbar)
+    return True
+
+
+class UI_Hooks(hooks_t):
+    kind = 'ui'
 
 
 # Values used to configure specifics of the execute_sync API function, used to
@@ -91,11 +428,10 @@ class PluginForm(QtWidgets.QDialog, MockObject):
         return self
 
 
-# Just let this be called and do nothing, there's no need to execute or return
+# Refreshing views changes the user interface context, polling action states
 def request_refresh(mask, cnd=True):
-    pass
+    update_actions()
 
 
-# Just let this be called and do nothing, there's no need to execute or return
 def refresh_idaview_anyway():
-    pass
+    update_actions()
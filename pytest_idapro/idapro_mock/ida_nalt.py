@@ -0,0 +1,3 @@
+# String types, as used by the string list and string literal items
+STRTYPE_C = 0
+STRTYPE_C_16 = 1
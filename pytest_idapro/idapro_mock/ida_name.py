@@ -1,3 +1,45 @@
+from . import ida_undo
+from .hooks import notify
+
+SN_CHECK = 0x00
+SN_NOCHECK = 0x01
+SN_PUBLIC = 0x02
+SN_NON_PUBLIC = 0x04
+SN_WEAK = 0x08
+SN_NON_WEAK = 0x10
+SN_AUTO = 0x20
+SN_NON_AUTO = 0x40
+SN_NOLIST = 0x80
+SN_NOWARN = 0x100
+SN_LOCAL = 0x200
+
+# names set by set_name, by address
+_names = {}
+
+
 # in IDA7, _from variable should be dropped
 def get_name(_from, ea):
-    return "dummy_function_name_{:x}".format(ea)
+    return _names.get(ea, "dummy_function_name_{:x}".format(ea))
+
+
+def set_name(ea, name, flags=SN_CHECK):
+    """Name (or with an empty name, unname) an address, notifying installed
+    IDB hooks of the rename"""
+    if name:
+        _names[ea] = name
+    else:
+        _names.pop(ea, None)
+    notify('idb', 'renamed', ea, name, bool(flags & SN_LOCAL))
+    return True
+
+
+def _capture_state():
+    return dict(_names)
+
+
+def _restore_state(state):
+    _names.clear()
+    _names.update(state)
+
+
+ida_undo.register_state(_capture_state, _restore_state)
@@ -2,6 +2,8 @@ import json
 import os
 import random
 
+from . import ida_undo
+
 
 atag = 'A'
 stag = 'S'
@@ -56,3 +58,30 @@ class netnode(object):
             return None
 
         return self.data[idx]
+
+
+def _capture_state():
+    state = {}
+    if not os.path.isdir(netnode.NETNODE_PATH):
+        return state
+
+    for filename in os.listdir(netnode.NETNODE_PATH):
+        with open(os.path.join(netnode.NETNODE_PATH, filename), 'r') as fh:
+            state[filename] = fh.read()
+    return state
+
+
+def _restore_state(state):
+    if os.path.isdir(netnode.NETNODE_PATH):
+        for filename in os.listdir(netnode.NETNODE_PATH):
+            if filename not in state:
+                os.remove(os.path.join(netnode.NETNODE_PATH, filename))
+    elif state:
+        os.mkdir(netnode.NETNODE_PATH)
+
+    for filename, content in state.items():
+        with open(os.path.join(netnode.NETNODE_PATH, filename), 'w') as fh:
+            fh.write(content)
+
+
+ida_undo.register_state(_capture_state, _restore_state)
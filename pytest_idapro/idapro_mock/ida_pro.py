@@ -1 +1,6 @@
 IDA_SDK_VERSION = 695
+
+
+def qexit(code):
+    import sys
+    sys.exit(code)
@@ -0,0 +1,65 @@
+"""Mock IDA's search functions over the mocked byte store. Binary patterns are
+compiled once and kept in a bounded cache, so plugins scanning for the same
+signatures repeatedly only pay for pattern parsing the first time."""
+
+from collections import OrderedDict
+
+from . import ida_bytes
+from .ida_idaapi import BADADDR
+
+
+SEARCH_UP = 0x000
+SEARCH_DOWN = 0x001
+SEARCH_NEXT = 0x002
+SEARCH_CASE = 0x004
+SEARCH_REGEX = 0x008
+SEARCH_NOBRK = 0x010
+SEARCH_NOSHOW = 0x020
+SEARCH_IDENT = 0x080
+SEARCH_BRK = 0x100
+
+# maximal number of compiled patterns kept
+PATTERN_CACHE_SIZE = 1024
+
+_patterns = OrderedDict()
+
+
+def compile_binary(ubinstr, radix=16):
+    """Return the compiled form of a binary pattern, or None if it is
+    invalid. Compiled patterns are cached"""
+    key = (ubinstr, radix)
+    if key in _patterns:
+        patterns = _patterns.pop(key)
+    else:
+        patterns = ida_bytes.compiled_binpat_vec_t()
+        if ida_bytes.parse_binpat_str(patterns, 0, ubinstr, radix):
+            patterns = None
+        if len(_patterns) >= PATTERN_CACHE_SIZE:
+            _patterns.popitem(last=False)
+    _patterns[key] = patterns
+    return patterns
+
+
+def find_binary(start_ea, end_ea, ubinstr, radix, sflag):
+    """Search down from `start_ea` up to `end_ea` (exclusive), or up from
+    `start_ea` down to `end_ea` when SEARCH_DOWN is not specified"""
+    patterns = compile_binary(ubinstr, radix)
+    if not patterns:
+        return BADADDR
+
+    flags = ida_bytes.BIN_SEARCH_CASE if sflag & SEARCH_CASE else 0
+    if sflag & SEARCH_DOWN:
+        if sflag & SEARCH_NEXT:
+            start_ea += 1
+        return ida_bytes.bin_search(start_ea, end_ea, patterns, flags)
+
+    # searching up, a match may start at start_ea unless SEARCH_NEXT is set
+    last_start = start_ea - 1 if sflag & SEARCH_NEXT else start_ea
+    flags |= ida_bytes.BIN_SEARCH_BACKWARD
+    found = BADADDR
+    for pattern in patterns:
+        ea = ida_bytes.bin_search(end_ea, last_start + pattern.length,
+                                  pattern, flags)
+        if ea != BADADDR and (found == BADADDR or ea > found):
+            found = ea
+    return found
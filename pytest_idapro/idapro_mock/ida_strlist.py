@@ -0,0 +1,208 @@
+"""Mock IDA's string list by scanning the mapped database bytes for ASCII and
+UTF-16 strings. Ranges are scanned in chunks and strings are produced by a
+generator, and the resulting index is kept in compact arrays. Indices of
+ranges mapped from an input file are cached per file and options, so the
+same input is never scanned twice for the same string list options."""
+
+import array
+import bisect
+import heapq
+import re
+
+from . import ida_bytes
+from .ida_nalt import STRTYPE_C, STRTYPE_C_16
+
+
+# number of bytes scanned at a time
+CHUNK_SIZE = 0x100000
+
+# string list indices of input files, keyed by file and string list options
+_file_indices = {}
+
+# the string list built by the last call to build_strlist, as a list of
+# (range start, index) tuples and the cumulative number of strings before
+# each of them
+_strlist = []
+_strlist_offsets = []
+
+
+class strwinsetup_t(object):
+    def __init__(self):
+        self.minlen = 5
+        self.strtypes = [STRTYPE_C]
+        self.only_7bit = True
+        self.ignore_heads = False
+        self.display_only_existing_strings = False
+
+    def key(self):
+        return (self.minlen, tuple(sorted(self.strtypes)),
+                bool(self.only_7bit))
+
+
+class string_info_t(object):
+    def __init__(self, ea=ida_bytes.BADADDR, length=0, type=STRTYPE_C):
+        self.ea = ea
+        self.length = length
+        self.type = type
+
+
+_options = strwinsetup_t()
+
+
+def get_strlist_options():
+    return _options
+
+
+class StringIndex(object):
+    """Strings found in a single mapped range, as offsets from the range
+    start, byte lengths and string types"""
+
+    def __init__(self):
+        self.offsets = array.array('L')
+        self.lengths = array.array('L')
+        self.types = array.array('B')
+
+    def append(self, offset, length, strtype):
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        self.types.append(strtype)
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+def _regexes(options):
+    chars = b'\t\n\r\x20-\x7e'
+    if not options.only_7bit:
+        chars += b'\x80-\xff'
+    minlen = max(options.minlen, 1)
+    regexes = []
+    if STRTYPE_C in options.strtypes:
+        regexes.append((STRTYPE_C, 1, re.compile(
+            b'[' + chars + b']{' + str(minlen).encode() + b',}')))
+    if STRTYPE_C_16 in options.strtypes:
+        regexes.append((STRTYPE_C_16, 2, re.compile(
+            b'(?:[' + chars + b']\x00){' + str(minlen).encode() + b',}')))
+    return regexes
+
+
+def _scan(content, options):
+    """Yield (offset, length, type) tuples for strings in `content`, which is
+    searched one chunk at a time. Strings crossing a chunk boundary are
+    searched again together with the next chunk"""
+    regexes = _regexes(options)
+    positions = [0] * len(regexes)
+    overlap = 2 * max(options.minlen, 1)
+    size = len(content)
+
+    # strings found but possibly preceded by strings of other types not yet
+    # found, as a heap
+    found = []
+    chunk_end = 0
+    while chunk_end < size:
+        chunk_end = min(chunk_end + CHUNK_SIZE, size)
+        for i, (strtype, char_size, regex) in enumerate(regexes):
+            pos = positions[i]
+            for match in regex.finditer(content, pos, chunk_end):
+                if chunk_end - match.end() < char_size and chunk_end < size:
+                    # may continue in the next chunk
+                    pos = match.start()
+                    break
+                heapq.heappush(found, (match.start(),
+                                       match.end() - match.start(), strtype))
+                pos = match.end()
+            else:
+                # strings too short to match may still continue in the next
+                # chunk
+                pos = max(pos, chunk_end - overlap)
+            positions[i] = pos
+
+        done = min(positions) if chunk_end < size else size
+        while found and found[0][0] < done:
+            yield heapq.heappop(found)
+
+
+def _index_key(start, options):
+    source = ida_bytes.range_source(start)
+    if source is None:
+        return None
+    return (source, start, options.key())
+
+
+def _iter_range(start, content, options):
+    key = _index_key(start, options)
+    if key is None:
+        for offset, length, strtype in _scan(content, options):
+            yield offset, length, strtype
+        return
+
+    index = _file_indices.get(key)
+    if index is None:
+        index = StringIndex()
+        for offset, length, strtype in _scan(content, options):
+            index.append(offset, length, strtype)
+            yield offset, length, strtype
+        _file_indices[key] = index
+        return
+
+    for i in range(len(index)):
+        yield index.offsets[i], index.lengths[i], index.types[i]
+
+
+def iter_strings(options=None):
+    """Generate string_info_t objects for all strings in the mapped database
+    bytes, in address order"""
+    options = options or _options
+    for start, content in ida_bytes.mapped_contents():
+        for offset, length, strtype in _iter_range(start, content, options):
+            yield string_info_t(start + offset, length, strtype)
+
+
+def _range_index(start, content, options):
+    key = _index_key(start, options)
+    if key is not None:
+        # ranges mapped from a file share the cached index
+        for _ in _iter_range(start, content, options):
+            pass
+        return _file_indices[key]
+
+    index = StringIndex()
+    for string in _iter_range(start, content, options):
+        index.append(*string)
+    return index
+
+
+def build_strlist():
+    clear_strlist()
+    for start, content in ida_bytes.mapped_contents():
+        index = _range_index(start, content, _options)
+        _strlist_offsets.append(get_strlist_qty())
+        _strlist.append((start, index))
+
+
+def clear_strlist():
+    del _strlist[:]
+    del _strlist_offsets[:]
+
+
+def get_strlist_qty():
+    if not _strlist:
+        return 0
+    return _strlist_offsets[-1] + len(_strlist[-1][1])
+
+
+def get_strlist_item(si, n):
+    if n < 0 or n >= get_strlist_qty():
+        return False
+
+    i = bisect.bisect_right(_strlist_offsets, n) - 1
+    start, index = _strlist[i]
+    n -= _strlist_offsets[i]
+    si.ea = start + index.offsets[n]
+    si.length = index.lengths[n]
+    si.type = index.types[n]
+    return True
+
+
+def clear_file_indices():
+    _file_indices.clear()
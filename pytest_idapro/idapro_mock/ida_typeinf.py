@@ -0,0 +1,989 @@
+"""Mock IDA's type system. A small C declaration parser supports basic types,
+pointers, arrays, function prototypes, structures, unions, enums and
+typedefs, and named types are kept in the local type library returned by
+`get_idati`. Types can be applied to (and retrieved from) addresses.
+
+Plugins commonly parse the same declarations over and over, for example a
+header for every analyzed function. Parsed declarations are immutable and
+memoized by their text, and the layout of every type (size, alignment and
+member offsets) is computed once and shared by all tinfo_t objects of that
+type, until named types it may depend on change."""
+
+import re
+import logging
+from collections import OrderedDict
+
+from . import ida_undo
+from .ida_idaapi import BADADDR
+
+
+log = logging.getLogger('pytest-idapro.mock.typeinf')
+
+BADSIZE = BADADDR
+
+# pointer size of the mocked (32bit) database
+PTR_SIZE = 4
+
+# maximal number of parsed declarations kept
+DECL_CACHE_SIZE = 4096
+
+# parse_decl flags
+PT_SIL = 0x0001
+PT_NDC = 0x0002
+PT_TYP = 0x0004
+PT_VAR = 0x0008
+PT_PACKMASK = 0x0070
+PT_HIGH = 0x0080
+PT_LOWER = 0x0100
+PT_REPLACE = 0x0200
+PT_RAWARGS = 0x0400
+
+# parse_decls flags
+HTI_CPP = 0x00000001
+HTI_INT = 0x00000002
+HTI_EXT = 0x00000004
+HTI_LEX = 0x00000008
+HTI_UNP = 0x00000010
+HTI_TST = 0x00000020
+HTI_FIL = 0x00000040
+HTI_MAC = 0x00000080
+HTI_NWR = 0x00000100
+HTI_NER = 0x00000200
+HTI_DCL = 0x00000400
+HTI_NDC = 0x00000800
+HTI_HIGH = 0x00008000
+HTI_LOWER = 0x00010000
+HTI_RAWARGS = 0x00020000
+
+# apply_tinfo flags
+TINFO_GUESSED = 0x0000
+TINFO_DEFINITE = 0x0001
+TINFO_DELAYFUNC = 0x0002
+TINFO_STRICT = 0x0004
+
+# find_udt_member flags
+STRMEM_OFFSET = 0x00000000
+STRMEM_INDEX = 0x00000001
+STRMEM_AUTO = 0x00000002
+STRMEM_NAME = 0x00000003
+STRMEM_TYPE = 0x00000004
+STRMEM_SIZE = 0x00000005
+STRMEM_MINS = 0x00000006
+STRMEM_MAXS = 0x00000007
+
+# changes whenever named types (which layouts may depend on) change
+_generation = [0]
+
+
+class _type(object):
+    """Base of parsed type nodes. Nodes are immutable once parsed, which lets
+    them be shared by memoized declarations and cache their layout"""
+
+    _layout = None
+
+    def layout(self, til):
+        """Return a (size, alignment, member offsets) tuple, or None if the
+        size is unknown"""
+        key = (_generation[0], PTR_SIZE, id(til))
+        if self._layout is None or self._layout[0] != key:
+            # a type containing itself by value meets its own layout while
+            # computing it, and has no size
+            self._layout = (key, None)
+            self._layout = (key, self.compute_layout(til))
+        return self._layout[1]
+
+    def compute_layout(self, til):
+        return None
+
+    def resolve(self, til):
+        return self
+
+
+class _basic(_type):
+    def __init__(self, name, size, kind, signed=False):
+        self.name = name
+        self.size = size
+        self.kind = kind
+        self.signed = signed
+
+    def compute_layout(self, til):
+        if self.kind == 'void':
+            return None
+        size = PTR_SIZE if self.size is None else self.size
+        return size, size, ()
+
+    def c_str(self, inner):
+        return self.name + (" " + inner if inner else "")
+
+
+class _named(_type):
+    """Reference to a named type, resolved using the type library"""
+
+    def __init__(self, name, tag=None):
+        self.name = name
+        self.tag = tag
+
+    def resolve(self, til):
+        seen = set()
+        node = self
+        while isinstance(node, _named):
+            if node.name in seen:
+                return None
+            seen.add(node.name)
+            node = til.types.get(node.name)
+        return node
+
+    def compute_layout(self, til):
+        node = self.resolve(til)
+        return node.layout(til) if node is not None else None
+
+    def c_str(self, inner):
+        name = "{} {}".format(self.tag, self.name) if self.tag else self.name
+        return name + (" " + inner if inner else "")
+
+
+class _pointer(_type):
+    def __init__(self, target):
+        self.target = target
+
+    def compute_layout(self, til):
+        return PTR_SIZE, PTR_SIZE, ()
+
+    def c_str(self, inner):
+        wrap = isinstance(self.target, (_array, _func))
+        inner = "*" + inner
+        return self.target.c_str("(" + inner + ")" if wrap else inner)
+
+
+class _array(_type):
+    def __init__(self, element, count):
+        self.element = element
+        self.count = count
+
+    def compute_layout(self, til):
+        layout = self.element.layout(til)
+        if layout is None:
+            return None
+        size, align, _ = layout
+        return size * (self.count or 0), align, ()
+
+    def c_str(self, inner):
+        count = self.count if self.count is not None else ""
+        return self.element.c_str("{}[{}]".format(inner, count))
+
+
+class _func(_type):
+    def __init__(self, rettype, args, cc=None, varargs=False):
+        self.rettype = rettype
+        self.args = args
+        self.cc = cc
+        self.varargs = varargs
+
+    def c_str(self, inner):
+        args = [arg.c_str(name or "") for name, arg in self.args]
+        if self.varargs:
+            args.append("...")
+        if self.cc:
+            inner = self.cc + (" " + inner if inner else "")
+        return self.rettype.c_str("{}({})".format(inner,
+                                                  ", ".join(args) or "void"))
+
+
+class _udt(_type):
+    def __init__(self, kind, name, members):
+        self.kind = kind
+        self.name = name
+        self.members = members
+
+    def compute_layout(self, til):
+        if self.members is None:
+            return None
+
+        offset = size = 0
+        align = 1
+        offsets = []
+        for _, member in self.members:
+            layout = member.layout(til)
+            if layout is None:
+                return None
+            member_size, member_align, _ = layout
+            align = max(align, member_align)
+            if self.kind == 'union':
+                offsets.append(0)
+                size = max(size, member_size)
+                continue
+            offset += -offset % member_align
+            offsets.append(offset)
+            offset += member_size
+            size = offset
+        size += -size % align
+        return size, align, tuple(offsets)
+
+    def c_str(self, inner):
+        name = "{} {}".format(self.kind, self.name or "")
+        return name.strip() + (" " + inner if inner else "")
+
+    def definition(self):
+        members = "".join("  {};\n".format(member.c_str(name))
+                          for name, member in self.members or ())
+        return "{} {}\n{{\n{}}};".format(self.kind, self.name, members)
+
+
+class _enum(_type):
+    def __init__(self, name, members, base=None):
+        self.name = name
+        self.members = members
+        # the underlying type, named ones are resolved in the type library
+        self.base = base
+
+    def compute_layout(self, til):
+        if self.base is None:
+            return 4, 4, ()
+        layout = self.base.layout(til)
+        return layout[:2] + ((),) if layout is not None else None
+
+    def c_str(self, inner):
+        return "enum {}".format(self.name or "") + (" " + inner
+                                                    if inner else "")
+
+
+_BASIC_TYPES = {
+    ('void',): ('void', 0, 'void'),
+    ('bool',): ('bool', 1, 'bool'),
+    ('_Bool',): ('bool', 1, 'bool'),
+    ('char',): ('char', 1, 'int', True),
+    ('signed', 'char'): ('signed char', 1, 'int', True),
+    ('unsigned', 'char'): ('unsigned char', 1, 'int'),
+    ('short',): ('short', 2, 'int', True),
+    ('unsigned', 'short'): ('unsigned short', 2, 'int'),
+    ('int',): ('int', 4, 'int', True),
+    ('unsigned',): ('unsigned int', 4, 'int'),
+    ('long',): ('long', 4, 'int', True),
+    ('unsigned', 'long'): ('unsigned long', 4, 'int'),
+    ('long', 'long'): ('long long', 8, 'int', True),
+    ('unsigned', 'long', 'long'): ('unsigned long long', 8, 'int'),
+    ('float',): ('float', 4, 'float', True),
+    ('double',): ('double', 8, 'float', True),
+    ('long', 'double'): ('long double', 8, 'float', True),
+    ('__int8',): ('__int8', 1, 'int', True),
+    ('__int16',): ('__int16', 2, 'int', True),
+    ('__int32',): ('__int32', 4, 'int', True),
+    ('__int64',): ('__int64', 8, 'int', True),
+    ('unsigned', '__int8'): ('unsigned __int8', 1, 'int'),
+    ('unsigned', '__int16'): ('unsigned __int16', 2, 'int'),
+    ('unsigned', '__int32'): ('unsigned __int32', 4, 'int'),
+    ('unsigned', '__int64'): ('unsigned __int64', 8, 'int'),
+    ('_BYTE',): ('_BYTE', 1, 'int'),
+    ('_WORD',): ('_WORD', 2, 'int'),
+    ('_DWORD',): ('_DWORD', 4, 'int'),
+    ('_QWORD',): ('_QWORD', 8, 'int'),
+    ('_BOOL1',): ('_BOOL1', 1, 'bool'),
+    ('_BOOL4',): ('_BOOL4', 4, 'bool'),
+    ('size_t',): ('size_t', None, 'int'),
+}
+
+# type specifier keywords combining into basic types
+_BASIC_WORDS = set(word for words in _BASIC_TYPES for word in words)
+_BASIC_WORDS.add('signed')
+
+# canonical order of basic type keywords, 'unsigned long int' is a long
+_WORD_ORDER = ['signed', 'unsigned', 'long', 'short', 'char', 'int']
+
+_NOISE_WORDS = set(['const', 'volatile', 'static', 'extern', 'inline',
+                    'register', 'restrict', '__restrict', '__unaligned',
+                    '__ptr32', '__ptr64'])
+_CALLING_CONVENTIONS = set(['__cdecl', '__stdcall', '__fastcall',
+                            '__thiscall', '__pascal', '__usercall',
+                            '__userpurge'])
+
+_TOKEN = re.compile(r'\s*(?:(\.\.\.)|([A-Za-z_$][\w$]*)|(0[xX][0-9a-fA-F]+|'
+                    r'\d+)[uUlL]*|(\S))')
+_COMMENT = re.compile(r'//[^\n]*|/\*.*?\*/|^\s*#[^\n]*', re.S | re.M)
+
+
+class _ParseError(Exception):
+    pass
+
+
+class _Parser(object):
+    """Recursive descent parser of C declarations. Identifiers in type
+    positions are parsed as references to named types, so parsing does not
+    depend on the type library and the result of parsing a text can be
+    memoized"""
+
+    def __init__(self, text):
+        self.tokens = []
+        text = _COMMENT.sub(' ', text)
+        position = 0
+        while position < len(text):
+            match = _TOKEN.match(text, position)
+            if not match or match.end() == position:
+                break
+            position = match.end()
+            ellipsis, word, number, punct = match.groups()
+            if number is not None:
+                self.tokens.append(('number', int(number, 0)))
+            elif word is not None:
+                self.tokens.append(('word', word))
+            elif ellipsis or punct:
+                self.tokens.append(('punct', ellipsis or punct))
+        self.position = 0
+        # (name, type node, is a typedef) of every declaration
+        self.declarations = []
+        # named structures, unions and enums defined while parsing
+        self.definitions = []
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        if index < len(self.tokens):
+            return self.tokens[index]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise _ParseError("Unexpected end of declaration")
+        self.position += 1
+        return token
+
+    def accept(self, value):
+        if self.peek()[1] == value and self.peek()[0] != 'number':
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, value):
+        if not self.accept(value):
+            raise _ParseError("Expected '{}' instead of '{}'".format(
+                value, self.peek()[1]))
+
+    def parse(self):
+        while self.peek()[0] is not None:
+            if self.accept(';'):
+                continue
+            self.declaration()
+        return self.declarations, self.definitions
+
+    def declaration(self):
+        is_typedef = self.accept('typedef')
+        base = self.specifiers()
+        if self.accept(';'):
+            # a structure, union or enum declared without declarators is
+            # declared under its own name
+            if isinstance(base, (_udt, _enum)) and base.name is not None:
+                self.declarations.append((base.name, base, is_typedef))
+            return
+        while True:
+            name, node = self.declarator(base)
+            self.declarations.append((name, node, is_typedef))
+            if not self.accept(','):
+                break
+        if self.peek()[0] is not None:
+            self.expect(';')
+
+    def skip_noise(self):
+        cc = None
+        while True:
+            word = self.peek()[1]
+            if word in _NOISE_WORDS:
+                self.position += 1
+            elif word in _CALLING_CONVENTIONS:
+                cc = word
+                self.position += 1
+            else:
+                return cc
+
+    def specifiers(self):
+        self.skip_noise()
+        word = self.peek()[1]
+        if word in ('struct', 'union'):
+            node = self.udt()
+        elif word == 'enum':
+            node = self.enum()
+        elif word in _BASIC_WORDS:
+            node = self.basic()
+        elif self.peek()[0] == 'word':
+            node = _named(self.next()[1])
+        else:
+            raise _ParseError("Expected a type instead of '{}'".format(word))
+        self.skip_noise()
+        return node
+
+    def basic(self):
+        words = []
+        while self.peek()[1] in _BASIC_WORDS:
+            words.append(self.next()[1])
+            self.skip_noise()
+        if 'int' in words and len(words) > 1:
+            words.remove('int')
+        if words[0] == 'signed' and words[1:] and words[1:] != ['char']:
+            words.pop(0)
+        words.sort(key=lambda word: _WORD_ORDER.index(word)
+                   if word in _WORD_ORDER else len(_WORD_ORDER))
+        spec = _BASIC_TYPES.get(tuple(words))
+        if spec is None:
+            raise _ParseError("Invalid type '{}'".format(" ".join(words)))
+        return _basic(*spec)
+
+    def udt(self):
+        kind = self.next()[1]
+        name = None
+        if self.peek()[0] == 'word':
+            name = self.next()[1]
+        if not self.accept('{'):
+            if name is None:
+                raise _ParseError("Anonymous {} without members".format(kind))
+            return _named(name, kind)
+
+        members = []
+        while not self.accept('}'):
+            base = self.specifiers()
+            while True:
+                member_name, member = self.declarator(base)
+                if self.peek()[1] == ':':
+                    raise _ParseError("Bitfields are not supported")
+                members.append((member_name, member))
+                if not self.accept(','):
+                    break
+            self.expect(';')
+        node = _udt(kind, name, tuple(members))
+        if name is not None:
+            self.definitions.append((name, node))
+        return node
+
+    def enum(self):
+        self.next()
+        name = None
+        if self.peek()[0] == 'word':
+            name = self.next()[1]
+        base = None
+        if self.accept(':'):
+            base = self.specifiers()
+            # named underlying types are resolved once laid out
+            if isinstance(base, _named):
+                valid = base.tag is None
+            else:
+                valid = isinstance(base, _basic) and base.kind in ('int',
+                                                                   'bool')
+            if not valid:
+                raise _ParseError("Invalid enum underlying type")
+        if not self.accept('{'):
+            if name is None:
+                raise _ParseError("Anonymous enum without members")
+            return _named(name, 'enum')
+
+        members = []
+        value = 0
+        while not self.accept('}'):
+            member = self.next()[1]
+            if self.accept('='):
+                value = self.constant(dict(members))
+            members.append((member, value))
+            value += 1
+            if not self.accept(','):
+                self.expect('}')
+                break
+        node = _enum(name, tuple(members), base)
+        if name is not None:
+            self.definitions.append((name, node))
+        return node
+
+    def constant(self, known):
+        negative = self.accept('-')
+        kind, value = self.next()
+        if kind == 'word' and value in known:
+            value = known[value]
+        elif kind != 'number':
+            raise _ParseError("Unsupported constant '{}'".format(value))
+        return -value if negative else value
+
+    def declarator(self, base):
+        """Parse a (possibly abstract) declarator applied to `base`,
+        returning its name and type"""
+        pointers = 0
+        cc = self.skip_noise()
+        while self.accept('*'):
+            pointers += 1
+            cc = self.skip_noise() or cc
+
+        name = None
+        inner = None
+        if self.peek()[1] == '(' and self.is_nested_declarator():
+            self.next()
+            # the inner declarator applies to the type built from the rest
+            start = self.position
+            depth = 1
+            while depth:
+                token = self.next()
+                if token[0] == 'punct':
+                    depth += {'(': 1, ')': -1}.get(token[1], 0)
+            inner = (start, self.position - 1)
+        elif self.peek()[0] == 'word':
+            name = self.next()[1]
+
+        suffixes = []
+        while True:
+            if self.accept('['):
+                count = None
+                if not self.accept(']'):
+                    count = self.constant({})
+                    self.expect(']')
+                suffixes.append(('array', count))
+            elif self.accept('('):
+                suffixes.append(('func',) + self.parameters())
+            else:
+                break
+
+        node = base
+        for _ in range(pointers):
+            node = _pointer(node)
+        for suffix in reversed(suffixes):
+            if suffix[0] == 'array':
+                node = _array(node, suffix[1])
+            else:
+                node = _func(node, suffix[1], cc, suffix[2])
+                cc = None
+
+        if inner is not None:
+            end = self.position
+            self.position = inner[0]
+            name, node = self.declarator(node)
+            if self.position != inner[1]:
+                raise _ParseError("Invalid declarator")
+            self.position = end
+        return name, node
+
+    def is_nested_declarator(self):
+        """Tell a parenthesized declarator from a parameter list"""
+        kind, value = self.peek(1)
+        return value in ('*', '(') or value in _CALLING_CONVENTIONS
+
+    def parameters(self):
+        args = []
+        varargs = False
+        if self.peek()[1] == 'void' and self.peek(1)[1] == ')':
+            self.next()
+        while not self.accept(')'):
+            if self.accept('...'):
+                varargs = True
+                self.expect(')')
+                break
+            name, node = self.declarator(self.specifiers())
+            # arrays are passed as pointers
+            if isinstance(node, _array):
+                node = _pointer(node.element)
+            args.append((name, node))
+            if not self.accept(','):
+                self.expect(')')
+                break
+        return tuple(args), varargs
+
+
+_decl_cache = OrderedDict()
+
+
+def _parse(text):
+    """Parse declarations, returning memoized results for known texts"""
+    if text in _decl_cache:
+        result = _decl_cache.pop(text)
+    else:
+        try:
+            result = _Parser(text).parse()
+        except _ParseError as e:
+            result = e
+        if len(_decl_cache) >= DECL_CACHE_SIZE:
+            _decl_cache.popitem(last=False)
+    _decl_cache[text] = result
+    if isinstance(result, _ParseError):
+        raise result
+    return result
+
+
+def clear_decl_cache():
+    _decl_cache.clear()
+
+
+def _contains_itself(node, til, path=()):
+    """Whether a type contains itself by value (through members, arrays and
+    typedefs), giving it an infinite size"""
+    node = node.resolve(til)
+    if node is None:
+        return False
+    if any(node is parent for parent in path):
+        return True
+    path += (node,)
+    if isinstance(node, _array):
+        return _contains_itself(node.element, til, path)
+    if isinstance(node, _udt):
+        return any(_contains_itself(member, til, path)
+                   for _, member in node.members or ())
+    return False
+
+
+def _check_types(til, nodes, named):
+    """Raise a _ParseError if any of `nodes` contains itself, resolving named
+    types in `til` as if the `named` (name, node) pairs were added to it"""
+    staged = til_t()
+    staged.types = dict(til.types)
+    staged.types.update(named)
+    for node in nodes:
+        if _contains_itself(node, staged):
+            raise _ParseError("Type '{}' contains itself".format(
+                node.c_str("")))
+
+
+class til_t(object):
+    def __init__(self, name="", desc=""):
+        self.name = name
+        self.desc = desc
+        self.types = {}
+
+    def set_named_type(self, name, node):
+        self.types[name] = node
+        _generation[0] += 1
+
+    def del_named_type(self, name):
+        if self.types.pop(name, None) is None:
+            return False
+        _generation[0] += 1
+        return True
+
+
+_idati = til_t("local", "Local type definitions")
+
+# applied types by address
+_applied = {}
+
+
+def get_idati():
+    return _idati
+
+
+class udt_member_t(object):
+    def __init__(self):
+        self.name = ""
+        self.offset = 0
+        self.size = 0
+        self.type = tinfo_t()
+
+
+class udt_type_data_t(list):
+    is_union = False
+
+
+class tinfo_t(object):
+    def __init__(self, other=None, til=None):
+        self._node = None
+        self._til = til or _idati
+        if isinstance(other, tinfo_t):
+            self._node, self._til = other._node, other._til
+
+    @classmethod
+    def _wrap(cls, node, til):
+        tif = cls(til=til)
+        tif._node = node
+        return tif
+
+    def _resolved(self):
+        if self._node is None:
+            return None
+        return self._node.resolve(self._til)
+
+    def _is(self, *classes):
+        return isinstance(self._resolved(), classes)
+
+    def empty(self):
+        return self._node is None
+
+    def present(self):
+        return self._node is not None
+
+    def clear(self):
+        self._node = None
+
+    def copy(self):
+        return tinfo_t(self)
+
+    def get_size(self):
+        if self._node is None:
+            return BADSIZE
+        layout = self._node.layout(self._til)
+        return BADSIZE if layout is None else layout[0]
+
+    def is_void(self):
+        node = self._resolved()
+        return isinstance(node, _basic) and node.kind == 'void'
+
+    def is_ptr(self):
+        return self._is(_pointer)
+
+    def is_array(self):
+        return self._is(_array)
+
+    def is_ptr_or_array(self):
+        return self._is(_pointer, _array)
+
+    def is_func(self):
+        return self._is(_func)
+
+    def is_funcptr(self):
+        node = self._resolved()
+        if not isinstance(node, _pointer):
+            return False
+        return isinstance(node.target.resolve(self._til), _func)
+
+    def is_udt(self):
+        return self._is(_udt)
+
+    def is_struct(self):
+        return self._is(_udt) and self._resolved().kind == 'struct'
+
+    def is_union(self):
+        return self._is(_udt) and self._resolved().kind == 'union'
+
+    def is_enum(self):
+        return self._is(_enum)
+
+    def is_forward_decl(self):
+        return self._node is not None and self._resolved() is None
+
+    def is_integral(self):
+        node = self._resolved()
+        return isinstance(node, _basic) and node.kind in ('int', 'bool')
+
+    def is_floating(self):
+        node = self._resolved()
+        return isinstance(node, _basic) and node.kind == 'float'
+
+    def is_signed(self):
+        node = self._resolved()
+        return isinstance(node, _basic) and node.signed
+
+    def is_unsigned(self):
+        node = self._resolved()
+        if not isinstance(node, _basic):
+            return False
+        return node.kind == 'int' and not node.signed
+
+    def get_type_name(self):
+        if isinstance(self._node, _named):
+            return self._node.name
+        return getattr(self._node, 'name', None)
+
+    def get_pointed_object(self):
+        if not self.is_ptr():
+            return tinfo_t()
+        return self._wrap(self._resolved().target, self._til)
+
+    def get_array_element(self):
+        if not self.is_array():
+            return tinfo_t()
+        return self._wrap(self._resolved().element, self._til)
+
+    def get_ptrarr_object(self):
+        if self.is_ptr():
+            return self.get_pointed_object()
+        return self.get_array_element()
+
+    def get_array_nelems(self):
+        if not self.is_array():
+            return -1
+        count = self._resolved().count
+        return count if count is not None else 0
+
+    def get_rettype(self):
+        if not self.is_func():
+            return tinfo_t()
+        return self._wrap(self._resolved().rettype, self._til)
+
+    def get_nargs(self):
+        if not self.is_func():
+            return -1
+        return len(self._resolved().args)
+
+    def get_nth_arg(self, n):
+        if not 0 <= n < self.get_nargs():
+            return tinfo_t()
+        return self._wrap(self._resolved().args[n][1], self._til)
+
+    def get_udt_nmembers(self):
+        if self.is_udt() and self._resolved().members is not None:
+            return len(self._resolved().members)
+        if self.is_enum():
+            return len(self._resolved().members)
+        return -1
+
+    def get_udt_details(self, udt, gtd=0):
+        node = self._resolved()
+        if not isinstance(node, _udt):
+            return False
+        layout = node.layout(self._til)
+        if layout is None:
+            return False
+
+        del udt[:]
+        udt.is_union = node.kind == 'union'
+        for (name, member), offset in zip(node.members, layout[2]):
+            udm = udt_member_t()
+            udm.name = name or ""
+            udm.type = self._wrap(member, self._til)
+            # offsets and sizes of members are in bits
+            udm.offset = offset * 8
+            udm.size = udm.type.get_size() * 8
+            udt.append(udm)
+        return True
+
+    def find_udt_member(self, udm, strmem_flags=STRMEM_NAME):
+        members = udt_type_data_t()
+        if not self.get_udt_details(members):
+            return -1
+        for index, member in enumerate(members):
+            if strmem_flags == STRMEM_NAME:
+                found = member.name == udm.name
+            elif strmem_flags == STRMEM_INDEX:
+                found = index == udm.offset
+            else:
+                end = member.offset + max(member.size, 1)
+                found = member.offset <= udm.offset < end
+            if found:
+                udm.name, udm.offset = member.name, member.offset
+                udm.size, udm.type = member.size, member.type
+                return index
+        return -1
+
+    def get_named_type(self, til, name, *args):
+        til = til or _idati
+        if name not in til.types:
+            return False
+        self._node, self._til = _named(name), til
+        return True
+
+    def create_ptr(self, tif):
+        self._node, self._til = _pointer(tif._node), tif._til
+        return True
+
+    def create_array(self, tif, nelems=0):
+        self._node, self._til = _array(tif._node, nelems), tif._til
+        return True
+
+    def equals_to(self, other):
+        return self.dstr() == other.dstr()
+
+    def __eq__(self, other):
+        return isinstance(other, tinfo_t) and self.equals_to(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def _print(self, name=None, *args):
+        if self._node is None:
+            return ""
+        return self._node.c_str(name or "")
+
+    def dstr(self):
+        return self._print()
+
+    __str__ = dstr
+
+    def __repr__(self):
+        return "<tinfo_t(mock) {}>".format(self.dstr() or "empty")
+
+
+def parse_decl(tif, til, decl, pt_flags=0):
+    """Parse a single declaration into `tif`. Returns the declared name, or
+    None if parsing failed"""
+    til = til or _idati
+    try:
+        declarations, definitions = _parse(decl)
+        if len(declarations) != 1:
+            return None
+        _check_types(til, [declarations[0][1]], definitions)
+    except _ParseError as e:
+        if not pt_flags & PT_SIL:
+            log.warning("Failed parsing declaration '%s': %s", decl, e)
+        return None
+
+    name, node, _ = declarations[0]
+    tif._node, tif._til = node, til
+    return name or ""
+
+
+def parse_decls(til, input, printer=None, hti_flags=0):
+    """Parse declarations (or a header file, with HTI_FIL) and store typedefs
+    and named structures, unions and enums in `til`. Returns the number of
+    errors"""
+    til = til or _idati
+    if hti_flags & HTI_FIL:
+        with open(input, 'r') as fh:
+            input = fh.read()
+    try:
+        declarations, definitions = _parse(input)
+        named = definitions + [(name, node)
+                               for name, node, is_typedef in declarations
+                               if is_typedef and name]
+        _check_types(til, [node for _, node in named], named)
+    except _ParseError as e:
+        if printer is not None:
+            printer("{}\n".format(e))
+        return 1
+
+    for name, node in named:
+        til.set_named_type(name, node)
+    return 0
+
+
+def idc_parse_types(input, flags):
+    return parse_decls(_idati, input, None, flags)
+
+
+def del_named_type(til, name, ntf_flags=0):
+    return (til or _idati).del_named_type(name)
+
+
+def apply_tinfo(ea, tif, flags=TINFO_DEFINITE):
+    if tif.empty():
+        return False
+    _applied[ea] = tinfo_t(tif)
+    return True
+
+
+def get_tinfo(tif, ea):
+    applied = _applied.get(ea)
+    if applied is None:
+        return False
+    tif._node, tif._til = applied._node, applied._til
+    return True
+
+
+def del_tinfo(ea):
+    _applied.pop(ea, None)
+
+
+def apply_decl(ea, decl, flags=TINFO_DEFINITE):
+    tif = tinfo_t()
+    if parse_decl(tif, None, decl, PT_SIL) is None:
+        return False
+    return apply_tinfo(ea, tif, flags)
+
+
+def print_type(ea, prtype_flags=0):
+    tif = tinfo_t()
+    if not get_tinfo(tif, ea):
+        return None
+    return tif.dstr()
+
+
+def _capture_state():
+    return dict(_idati.types), dict(_applied)
+
+
+def _restore_state(state):
+    types, applied = state
+    _idati.types.clear()
+    _idati.types.update(types)
+    _applied.clear()
+    _applied.update(applied)
+    _generation[0] += 1
+
+
+ida_undo.register_state(_capture_state, _restore_state)
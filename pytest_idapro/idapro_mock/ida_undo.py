@@ -0,0 +1,34 @@
+"""Mock IDA's undo facility. Mocked database state is kept by other mock
+modules, which register callables capturing and restoring their state using
+`register_state`. Creating an undo point captures all registered states and
+undoing restores them, so snapshot based test isolation behaves the same way
+with and without IDA."""
+
+_states = []
+_undo_points = []
+
+
+def register_state(capture, restore):
+    _states.append((capture, restore))
+
+
+def create_undo_point(what, size=None):
+    state = [(restore, capture()) for capture, restore in _states]
+    _undo_points.append((what, state))
+    return True
+
+
+def get_undo_action_label():
+    if not _undo_points:
+        return None
+    return _undo_points[-1][0]
+
+
+def perform_undo():
+    if not _undo_points:
+        return False
+
+    _, state = _undo_points.pop()
+    for restore, captured in state:
+        restore(captured)
+    return True
@@ -39,4 +39,5 @@ from .ida_strlist import *
 from .ida_struct import *
 from .ida_typeinf import *
 from .ida_ua import *
+from .ida_undo import *
 from .ida_xref import *
@@ -12,8 +12,11 @@
 """
 idautils.py - High level utility functions for IDA
 """
+from . import ida_bytes
 from . import ida_funcs
 from . import ida_ida
+from . import ida_nalt
+from . import ida_strlist
 
 
 def Functions(start=None, end=None):
@@ -62,3 +65,119 @@ def Chunks(start):
         chunk = func_iter.chunk()
         yield (chunk.startEA, chunk.endEA)
         status = func_iter.next()
+
+
+class Strings(object):
+    """
+    Allows iterating over the string list. The set of strings will not be
+    modified, unless asked explicitly at setup()-time. This string list also
+    is used by the "String window" so it may be changed when this window is
+    updated.
+
+    Example:
+        s = Strings()
+
+        for i in s:
+            print("%x: len=%d type=%d -> '%s'" % (i.ea, i.length, i.strtype, str(i)))
+
+    @note: iterating the string list generates strings as they are found,
+    while len() and indexing build the whole (compact) list on first use.
+    """
+    class StringItem(object):
+        """
+        Class representing each string item.
+        """
+        def __init__(self, si):
+            self.ea = si.ea
+            """String ea"""
+            self.strtype = si.type
+            """string type (STRTYPE_xxxxx)"""
+            self.length = si.length
+            """string length"""
+
+        def is_1_byte_encoding(self):
+            return self.strtype == ida_nalt.STRTYPE_C
+
+        def _toseq(self, as_unicode):
+            data = ida_bytes.get_bytes(self.ea, self.length)
+            encoding = "ascii" if self.is_1_byte_encoding() else "utf-16-le"
+            text = data.decode(encoding, "replace")
+            return text if as_unicode else text.encode("utf-8", "replace")
+
+        def __str__(self):
+            return self._toseq(False) if str is bytes else self._toseq(True)
+
+        def __unicode__(self):
+            return self._toseq(True)
+
+
+    def clear_cache(self):
+        """Clears the string list cache"""
+        ida_strlist.clear_strlist()
+
+
+    def __init__(self, default_setup = False):
+        """
+        Initializes the Strings enumeration helper class
+
+        @param default_setup: Set to True to use default setup (C strings, min len 5, ...)
+        """
+        self._size = None
+        if default_setup:
+            self.setup()
+        else:
+            self.refresh()
+
+        self._si = ida_strlist.string_info_t()
+
+
+    def refresh(self):
+        """Refreshes the string list"""
+        ida_strlist.clear_strlist()
+        self._size = None
+
+
+    @property
+    def size(self):
+        if self._size is None:
+            ida_strlist.build_strlist()
+            self._size = ida_strlist.get_strlist_qty()
+        return self._size
+
+
+    def setup(self,
+              strtypes = [ida_nalt.STRTYPE_C],
+              minlen = 5,
+              only_7bit = True,
+              ignore_instructions = False,
+              display_only_existing_strings = False):
+        t = ida_strlist.get_strlist_options()
+        t.strtypes = strtypes
+        t.minlen = minlen
+        t.only_7bit = only_7bit
+        t.display_only_existing_strings = display_only_existing_strings
+        t.ignore_heads = ignore_instructions
+        self.refresh()
+
+
+    def _get_item(self, index):
+        if not ida_strlist.get_strlist_item(self._si, index):
+            return None
+        else:
+            return Strings.StringItem(self._si)
+
+
+    def __iter__(self):
+        return (Strings.StringItem(si) for si in ida_strlist.iter_strings())
+
+
+    def __len__(self):
+        return self.size
+
+
+    def __getitem__(self, index):
+        """Returns a string item or None"""
+        if index >= self.size:
+            raise KeyError
+        else:
+            return self._get_item(index)
@@ -1,5 +1,8 @@
 import tempfile
 
+from . import ida_name, ida_search
+from .ida_idaapi import BADADDR
+
 
 tempidadir = None
 
@@ -23,4 +26,25 @@ def GetInputMD5():
     return "\xff" * 32
 
 
+SEARCH_UP = ida_search.SEARCH_UP
+SEARCH_DOWN = ida_search.SEARCH_DOWN
+SEARCH_NEXT = ida_search.SEARCH_NEXT
+SEARCH_CASE = ida_search.SEARCH_CASE
+
+
+def FindBinary(ea, flag, searchstr, radix=16):
+    endea = BADADDR if flag & SEARCH_DOWN else 0
+    return ida_search.find_binary(ea, endea, searchstr, radix, flag)
+
+
+find_binary = FindBinary
+
+
+def MakeName(ea, name):
+    return ida_name.set_name(ea, name, ida_name.SN_CHECK)
+
+
+set_name = ida_name.set_name
+
+
 ARGV = ['./fake-script-file.py']
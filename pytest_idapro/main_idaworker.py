@@ -9,7 +9,7 @@ except ImportError:
 
 def main():
     # TODO: use idc.ARGV with some option parsing package
-    worker = idaworker.IdaWorker(idc.ARGV[1])
+    worker = idaworker.IdaWorker(*idc.ARGV[1:])
     should_quit = worker.run()
     if should_quit:
         idaapi.qexit(0)
@@ -1,53 +1,214 @@
 import os
+import glob
+import multiprocessing
 
 import pytest
 
+from .plugin_base import register_markers
+
 
 def pytest_addoption(parser):
     group = parser.getgroup("idapro", "interactive disassembler testing "
                                       "facilities")
-    group._addoption('--ida', help="Run inside an IDA instance instead of "
-                                   "mocking IDA up.")
-    group._addoption('--ida-file', help="Provide a file to load by IDA, "
-                                        "either IDB or any other readable "
-                                        "format. If no file is provided, an "
-                                        "empty database will be automatically "
-                                        "loaded.")
+    group._addoption('--ida', action="append",
+                     help="Run inside an IDA instance instead of mocking IDA "
+                          "up. May be repeated with the executables of "
+                          "several IDA versions, in which case the tests run "
+                          "once for every version concurrently, labeled "
+                          "with the version.")
+    group._addoption('--ida-agent', action="append", metavar="HOST:PORT",
+                     help="Run inside IDA instances executed by a remote "
+                          "worker agent (see pytest-idapro-agent) instead "
+                          "of a local IDA. May be repeated, in which case "
+                          "tests are split between the agents. The agents' "
+                          "authentication key is read from the "
+                          "PYTEST_IDAPRO_AUTHKEY environment variable.")
+    group._addoption('--ida-file', action="append",
+                     help="Provide a file to load by IDA, either IDB or any "
+                          "other readable format. If no file is provided, an "
+                          "empty database will be automatically loaded. May "
+                          "be repeated and may contain glob patterns, in "
+                          "which case the tests run once for every file, "
+                          "labeled with the file name.")
+    group._addoption('--ida-max-workers', type=int, default=None,
+                     help="Maximal number of IDA instances executed "
+                          "concurrently. Defaults to the number of CPUs.")
+    group._addoption('--ida-timeout', type=float, default=None,
+                     help="Fail tests running for longer than the provided "
+                          "number of seconds inside IDA. The hanging IDA "
+                          "instance is restarted and the session resumes "
+                          "from the next test. Only acceptable with --ida.")
     group._addoption('--ida-keep', action="store_true", default=False,
                      help="Keep IDA instance running instead of terminating "
                           "it. Only acceptable with --ida.")
+    group._addoption('--ida-watch', action="store_true", default=False,
+                     help="Keep the IDA instance alive after the test session "
+                          "completes, watch source files for changes and "
+                          "rerun affected tests without restarting IDA. Only "
+                          "acceptable with --ida.")
+    group._addoption('--ida-fork', action="store_true", default=False,
+                     help="When mocking IDA, run the tests of every module in "
+                          "a child process forked from the main one, "
+                          "isolating mocked IDA and Qt state between modules "
+                          "without paying for a new interpreter. Only "
+                          "acceptable without --ida.")
+    group._addoption('--ida-artifacts', metavar="DIR", default=None,
+                     help="Keep artifacts stored by tests using the "
+                          "idapro_artifacts fixture in DIR. Artifacts are "
+                          "otherwise removed once the session is over.")
+    group._addoption('--ida-autoanalysis', default='wait',
+                     choices=('wait', 'collect', 'marked'),
+                     help="When to wait for IDA's auto-analysis. 'wait' "
+                          "(the default) waits before doing anything else, "
+                          "'collect' checks dependencies, configures pytest "
+                          "and collects tests while analysis continues, and "
+                          "waits for it before running tests, and 'marked' "
+                          "only waits before tests marked with "
+                          "idapro_autoanalysis. Only acceptable with --ida.")
+    group._addoption('--ida-memory-threshold', type=float, default=50,
+                     metavar="MB",
+                     help="Flag tests growing the memory of IDA by more than "
+                          "the provided number of megabytes. IDA's memory "
+                          "and cpu usage is sampled as tests start and "
+                          "finish and summarized once the session is over, "
+                          "which requires a /proc file system. Only "
+                          "meaningful with --ida. Defaults to 50.")
+    group._addoption('--ida-hexrays-cache', action="store_true",
+                     default=False,
+                     help="Memoize Hex-Rays decompilation results for the "
+                          "duration of the test session, so repeated "
+                          "decompiles of a function do not run the "
+                          "decompiler again. Only acceptable with --ida.")
+    group._addoption('--ida-hexrays-record', metavar="DIR", default=None,
+                     help="Record functions decompiled during the test "
+                          "session as fixture files in DIR, to be served by "
+                          "the mocked ida_hexrays module. Implies "
+                          "--ida-hexrays-cache. Only acceptable with --ida.")
 
 
 @pytest.hookimpl(tryfirst=True)
 def pytest_cmdline_main(config):
     ida_path = config.getoption('--ida')
+    ida_agent = config.getoption('--ida-agent')
     ida_file = config.getoption('--ida-file')
+    ida_max_workers = config.getoption('--ida-max-workers')
     ida_keep = config.getoption('--ida-keep')
+    ida_watch = config.getoption('--ida-watch')
+    ida_timeout = config.getoption('--ida-timeout')
+    ida_hexrays_cache = config.getoption('--ida-hexrays-cache')
+    ida_hexrays_record = config.getoption('--ida-hexrays-record')
+    ida_fork = config.getoption('--ida-fork')
+
+    internal = ida_path or ida_agent
 
     # force removal of plugins interfering / incompatible with running
     # internally
-    if ida_path:
+    if internal:
         config.pluginmanager.set_blocked("pytest-qt")
         config.pluginmanager.set_blocked("xdist")
         config.pluginmanager.set_blocked("xvfb")
         config.pluginmanager.set_blocked("xvfb.looponfail")
 
-    if ida_path and not os.path.isfile(ida_path):
+    if ida_path and not all(os.path.isfile(path) for path in ida_path):
         raise pytest.UsageError("--ida must point to an IDA executable.")
-    if ida_file and not ida_path:
-        raise pytest.UsageError("--ida-file requires --ida to be specified as "
-                                "well")
-    if ida_file and not os.path.isfile(ida_file):
-        raise pytest.UsageError("--ida-file must point to an IDA file.")
+    if ida_path:
+        # preserve order while dropping duplicates
+        ida_path = config.option.ida = [
+            path for i, path in enumerate(ida_path)
+            if path not in ida_path[:i]]
+    if ida_path and ida_agent:
+        raise pytest.UsageError("--ida and --ida-agent are mutually "
+                                "exclusive.")
+    if ida_agent:
+        from .agent import parse_address, get_authkey
+        try:
+            config.option.ida_agent = [parse_address(address)
+                                       for address in ida_agent]
+            get_authkey()
+        except ValueError as e:
+            raise pytest.UsageError(str(e))
+    if ida_file and not internal:
+        raise pytest.UsageError("--ida-file requires --ida or --ida-agent to "
+                                "be specified as well")
+    if ida_file:
+        ida_file = config.option.ida_file = expand_ida_files(ida_file)
+
+    if ida_max_workers is None and ida_agent:
+        # agents limit the number of IDA instances they execute themselves
+        ida_max_workers = len(ida_agent) * len(ida_file or [None])
+    elif ida_max_workers is None:
+        ida_max_workers = multiprocessing.cpu_count()
+    elif ida_max_workers < 1:
+        raise pytest.UsageError("--ida-max-workers must be a positive "
+                                "number.")
+    config.option.ida_max_workers = ida_max_workers
 
     if ida_keep and not ida_path:
         raise pytest.UsageError("--ida-keep is only meaningful when --ida is "
                                 "also provided.")
+    if ida_timeout is not None and not internal:
+        raise pytest.UsageError("--ida-timeout is only meaningful when --ida "
+                                "is also provided.")
+    if ida_timeout is not None and ida_timeout <= 0:
+        raise pytest.UsageError("--ida-timeout must be a positive number.")
+    if ida_watch and not ida_path:
+        raise pytest.UsageError("--ida-watch is only meaningful when --ida is "
+                                "also provided, and is not supported with "
+                                "--ida-agent.")
+    instances = len(ida_file or [None]) * len(ida_path or [None])
+    if ida_watch and instances > ida_max_workers:
+        raise pytest.UsageError("--ida-watch keeps an IDA instance alive for "
+                                "every file and IDA version, "
+                                "--ida-max-workers must not be lower than "
+                                "their number.")
+    if (ida_hexrays_cache or ida_hexrays_record) and not internal:
+        raise pytest.UsageError("--ida-hexrays-cache and --ida-hexrays-record "
+                                "are only meaningful when --ida is also "
+                                "provided.")
+    if config.getoption('--ida-autoanalysis') != 'wait' and not internal:
+        raise pytest.UsageError("--ida-autoanalysis is only meaningful when "
+                                "--ida is also provided.")
+    if config.getoption('--ida-memory-threshold') < 0:
+        raise pytest.UsageError("--ida-memory-threshold must not be "
+                                "negative.")
+    if ida_fork and internal:
+        raise pytest.UsageError("--ida-fork is only meaningful when mocking "
+                                "IDA, without --ida or --ida-agent.")
+    if ida_fork and not hasattr(os, 'fork'):
+        raise pytest.UsageError("--ida-fork is unavailable on this platform.")
+    if config.getoption('--ida-artifacts'):
+        config.option.ida_artifacts = os.path.abspath(
+            config.getoption('--ida-artifacts'))
+    if ida_hexrays_record:
+        # IDA may run from a different working directory
+        config.option.ida_hexrays_record = os.path.abspath(ida_hexrays_record)
+        config.option.ida_hexrays_cache = True
     # TODO: free text ida args?
 
 
+def expand_ida_files(patterns):
+    files = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(path for path in glob.glob(pattern)
+                             if os.path.isfile(path))
+            if not matches:
+                raise pytest.UsageError("--ida-file pattern '{}' did not "
+                                        "match any file.".format(pattern))
+            files.extend(matches)
+        elif os.path.isfile(pattern):
+            files.append(pattern)
+        else:
+            raise pytest.UsageError("--ida-file must point to an IDA file.")
+
+    # preserve order while dropping duplicates
+    return [path for i, path in enumerate(files) if path not in files[:i]]
+
+
 def pytest_configure(config):
-    if config.getoption('--ida'):
+    register_markers(config)
+
+    if config.getoption('--ida') or config.getoption('--ida-agent'):
         from . import plugin_internal
         deferred_plugin = plugin_internal.InternalDeferredPlugin(config)
     else:
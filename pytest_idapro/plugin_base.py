@@ -19,11 +19,87 @@ class IDAProEntriesScanner(pytest.Module):
             self.idapro_action_entries.add(obj)
 
 
+class DatabaseSnapshot(object):
+    """Snapshot the database state using IDA's undo facility. Restoring a
+    snapshot undoes all database modifications performed after it was taken,
+    which is considerably cheaper than reloading the database."""
+
+    # called after any snapshot is restored, to drop state derived from the
+    # database such as memoized decompilation results
+    restore_callbacks = []
+
+    def __init__(self, label):
+        import ida_undo
+        self.ida_undo = ida_undo
+        self.label = self.to_bytes(label)
+        self.taken = False
+
+    @staticmethod
+    def to_bytes(label):
+        if label is None or isinstance(label, bytes):
+            return label
+        return label.encode('utf-8')
+
+    def take(self):
+        if self.taken:
+            raise RuntimeError("Snapshot '{}' already "
+                               "taken".format(self.label))
+        if not self.ida_undo.create_undo_point(self.label):
+            raise RuntimeError("Failed creating an undo point for snapshot "
+                               "'{}', is undo enabled?".format(self.label))
+        self.taken = True
+
+    def restore(self):
+        if not self.taken:
+            return
+
+        # undo any undo points created after ours, and then ours
+        while True:
+            label = self.to_bytes(self.ida_undo.get_undo_action_label())
+            if not self.ida_undo.perform_undo():
+                raise RuntimeError("Failed restoring snapshot "
+                                   "'{}'".format(self.label))
+            if label == self.label:
+                break
+        self.taken = False
+
+        for callback in self.restore_callbacks:
+            callback()
+
+
+def get_marker(node, name):
+    # get_closest_marker was introduced in pytest 3.6
+    if hasattr(node, 'get_closest_marker'):
+        return node.get_closest_marker(name)
+    return node.get_marker(name)
+
+
+def register_markers(config):
+    config.addinivalue_line("markers",
+                            "idapro_isolated: restore the IDA database to its "
+                            "state before the test once the test is done")
+    config.addinivalue_line("markers",
+                            "idapro_ui: the test requires IDA's user "
+                            "interface, and is skipped when running under "
+                            "IDA's text mode (idat)")
+    config.addinivalue_line("markers",
+                            "idapro_file(path): run the test against the "
+                            "given IDB or binary file (relative to the root "
+                            "directory), loaded once by a dedicated IDA "
+                            "instance")
+    config.addinivalue_line("markers",
+                            "idapro_autoanalysis: the test requires IDA's "
+                            "auto-analysis to be finished, when running with "
+                            "--ida-autoanalysis=marked")
+
+
 class BasePlugin(object):
     def __init__(self, *args, **kwargs):
         super(BasePlugin, self).__init__(*args, **kwargs)
         self.idapro_plugin_entries = set()
         self.idapro_action_entries = set()
+        # stores test artifacts, set up by the executing plugin
+        self.artifact_writer = None
 
     def pytest_collect_file(self, path, parent):
         if not path.ext == '.py':
@@ -42,3 +118,40 @@ class BasePlugin(object):
         if 'idapro_action_entry' in metafunc.fixturenames:
             metafunc.parametrize('idapro_action_entry',
                                  self.idapro_action_entries)
+
+    @pytest.fixture()
+    def idapro_database_snapshot(self, request):
+        snapshot = DatabaseSnapshot("pytest-idapro: " + request.node.nodeid)
+        snapshot.take()
+        yield snapshot
+        snapshot.restore()
+
+    @pytest.fixture()
+    def idapro_artifacts(self, request):
+        return self.artifact_writer.bind(request.node.nodeid)
+
+    @pytest.fixture(autouse=True)
+    def _idapro_isolated(self, request):
+        if get_marker(request.node, 'idapro_isolated') is not None:
+            request.getfixturevalue('idapro_database_snapshot')
+        yield
+
+    @staticmethod
+    def serialize_report(report):
+        from py.path import local
+        from pytest import Item
+
+        d = vars(report).copy()
+        if hasattr(report.longrepr, "toterminal"):
+            d['longrepr'] = str(report.longrepr)
+        else:
+            d['longrepr'] = report.longrepr
+
+        for name, value in d.items():
+            if isinstance(value, local):
+                d[name] = str(value)
+            elif name == "result":
+                d['result'] = [{'name': item.name} for item in d['result']
+                               if isinstance(item, Item)]
+
+        return d
@@ -1,60 +1,205 @@
 import os
+import re
 import tempfile
 import subprocess
+import fnmatch
+import threading
+import signal
+import time
+from collections import Counter, OrderedDict
 
-from multiprocessing.connection import Listener
+from multiprocessing.connection import Listener, Client
 import platform
 import copy
 
 import logging
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .idapro_internal.logtail import LogTail
+from .idapro_internal.collectcache import CollectionCache
+from .idapro_internal.schedule import DurationStore, Scheduler
+from .idapro_internal.artifacts import ArtifactStore
+from .idapro_internal.resources import ResourceSampler, ResourceSummary
+from .agent import script_switch
+
 logging.basicConfig()
 log = logging.getLogger('pytest-idapro.internal.manager')
 
 
-class InternalDeferredPlugin(object):
-    def __init__(self, config):
-        self.ida_path = config.getoption('--ida')
-        self.ida_file = config.getoption('--ida-file')
+def label_nodeid(nodeid, label):
+    """Add a parameter ID to a node ID, the same way pytest labels
+    parametrized tests"""
+    if not label:
+        return nodeid
+    if nodeid.endswith(']'):
+        return "{}-{}]".format(nodeid[:-1], label)
+    return "{}[{}]".format(nodeid, label)
+
+
+def file_labels(files):
+    """Generate short and unique labels for a list of files, used as parameter
+    IDs when running a matrix of files"""
+    basenames = [os.path.basename(path) for path in files]
+    return [basename if basenames.count(basename) == 1 else
+            os.path.relpath(path) for basename, path in zip(basenames, files)]
+
+
+def ida_labels(paths):
+    """Generate short and unique labels for IDA executables, using the IDA
+    version found in their installation paths when there is one"""
+    labels = []
+    for path in paths:
+        directory = os.path.dirname(os.path.abspath(path))
+        versions = re.findall(r'\d+(?:\.\d+)+(?:sp\d+)?', directory)
+        labels.append("ida" + versions[-1] if versions else
+                      os.path.basename(directory))
+    if len(set(labels)) == len(labels):
+        return labels
+    return file_labels([os.path.dirname(os.path.abspath(path))
+                        for path in paths])
+
+
+def join_labels(*labels):
+    return "-".join(label for label in labels if label) or None
+
+
+class WorkerTimeout(Exception):
+    def __init__(self, nodeid, location, elapsed, when):
+        super(WorkerTimeout, self).__init__(nodeid, location, elapsed, when)
+        self.nodeid = nodeid
+        self.location = location
+        self.elapsed = elapsed
+        # the test phase (setup, call or teardown) that hung
+        self.when = when
+
+
+class WorkerProxy(object):
+    """Master side of a single IDA worker. Implements the master end of the
+    worker protocol, while hook calls derived from worker responses are queued
+    as events for the plugin to dispatch, since proxies are driven by threads
+    other than the main one."""
+
+    # maximal number of recent worker log lines kept in memory
+    LOG_LINES = 1000
+
+    def __init__(self, config, events, ida_path, ida_file, label=None):
+        self.ida_path = ida_path
+        self.ida_file = ida_file
+        # labels of the IDA version and file this worker runs, when running
+        # a matrix of either
+        self.version = None
+        self.file_label = None
+        # hands out tests when several workers split the same tests
+        self.scheduler = None
+        # tests to run instead of the session's arguments, and whether only
+        # tests marked for this worker's database are run
+        self.args = None
+        self.marked_only = False
+        self.failed = False
+        # directory shared with the worker for storing test artifacts
+        self.artifact_dir = None
         self.keep_ida_running = config.getoption('--ida-keep')
         self.config = config
-        self.session = None
-        self.listener = Listener()
+        self.events = events
+        self.label = label
+        self.timeout = config.getoption('--ida-timeout')
+        self.autoanalysis = config.getoption('--ida-autoanalysis')
+        self.listener = None
         self.conn = None
-        self.logfile = tempfile.NamedTemporaryFile(delete=False)
+        self.unread = None
+        self.logtail = None
+        self.stackfile = None
         self.proc = None
         self.stop = False
+        # samples IDA's memory and cpu usage as tests start and finish
+        self.resources = None
+
+        # bookkeeping required to resume a session after a hang
+        self.collected = []
+        self.rootdir = None
+        self.finished = set()
+        self.current_test = None
+        # phase of the current test expected to be reported next
+        self.current_when = None
+        self.resuming = False
+        self.test_log_start = 0
+        # set while a session or command is in progress, when the worker
+        # cannot be asked to quit
+        self.busy = False
+
+    def emit(self, *event):
+        self.events.put((self, event))
 
     def ida_start(self):
         internal_script = os.path.join(os.path.dirname(__file__),
                                        "main_idaworker.py")
 
-        script_args = '{}'.format(self.listener.address)
+        # every IDA instance gets fresh log files, previous ones are removed
+        self.cleanup_files()
+        self.logtail = LogTail(self.temp_path("log"), self.LOG_LINES)
+        self.stackfile = self.temp_path("stacks")
+
+        self.listener = Listener()
         args = [
             self.ida_path,
             # autonomous mode. IDA will not display dialog boxes.
             # Designed to be used together with -S switch.
             "-A",
-            "-S\"{}\" {}".format(internal_script, script_args),
-            "-L{}".format(self.logfile.name),
+            script_switch(internal_script, self.listener.address,
+                          self.stackfile),
+            "-L{}".format(self.logtail.path),
             # Load user-provided or start with an empty database
             self.ida_file if self.ida_file else "-t"
         ]
         log.debug("worker execution arguments: %s", args)
         self.proc = subprocess.Popen(args=args)
+        self.resources = ResourceSampler(self.proc.pid)
 
         # accept a single connection
         self.conn = self.listener.accept()
         self.listener.close()
         self.listener = None
 
+    @staticmethod
+    def temp_path(kind):
+        fd, path = tempfile.mkstemp(prefix="pytest-idapro-",
+                                    suffix="." + kind)
+        os.close(fd)
+        return path
+
+    def cleanup_files(self):
+        if self.logtail:
+            self.logtail.close()
+            self.logtail = None
+        if self.stackfile:
+            try:
+                os.remove(self.stackfile)
+            except OSError:
+                pass
+            self.stackfile = None
+
+    def log_text(self, lineno=0):
+        if not self.logtail:
+            return ""
+        return self.logtail.text(lineno)
+
     def ida_finish(self, interrupted):
         self.stop = True
 
         if interrupted:
             log.warning("Abrupt termination of external test session. worker "
-                        "log: %s", self.logfile.read())
+                        "log: %s", self.log_text())
 
+        try:
+            self.ida_stop()
+        finally:
+            self.cleanup_files()
+
+    def ida_stop(self):
         if not self.proc:
             return
 
@@ -71,6 +216,44 @@ class InternalDeferredPlugin(object):
         log.info("Stopping...")
         self.proc.kill()
 
+    def start(self):
+        self.ida_start()
+        self.command_ping()
+
+        if self.autoanalysis == 'wait':
+            self.command_dependencies()
+            self.command_autoanalysis_wait()
+            return
+
+        # the worker advances auto-analysis while waiting for commands, so
+        # analysis overlaps checking dependencies, configuration and
+        # collection, and tests wait for it to finish
+        self.command_autoanalysis_start()
+        self.command_dependencies()
+
+    def restart(self):
+        log.info("Restarting worker %s", self.label or "")
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self.conn.close()
+        self.conn = None
+        self.unread = None
+        self.start()
+
+    def dump_stacks(self):
+        """Request the worker to dump the stacks of all its threads, which
+        is only supported by python3 workers on posix platforms"""
+        if not hasattr(signal, 'SIGUSR1') or self.proc.poll() is not None:
+            return "Stack dump is unavailable on this platform"
+
+        with open(self.stackfile, 'r') as fh:
+            fh.seek(0, os.SEEK_END)
+            os.kill(self.proc.pid, signal.SIGUSR1)
+            time.sleep(1)
+            stacks = fh.read()
+        return stacks or "Stack dump is unavailable for this worker"
+
     def command_ping(self):
         self.send('ping')
         self.recv('pong')
@@ -92,8 +275,16 @@ class InternalDeferredPlugin(object):
         self.send('autoanalysis', 'wait')
         self.recv('autoanalysis', 'done')
 
-    def command_configure(self, config):
+    def command_autoanalysis_start(self):
+        self.send('autoanalysis', 'start')
+        self.recv('autoanalysis', 'started')
+
+    def command_configure(self, config, args=None):
         option_dict = copy.deepcopy(vars(config.option))
+        option_dict['idapro_scheduled'] = self.scheduler is not None
+        option_dict['idapro_database'] = self.database_path()
+        option_dict['idapro_marked_only'] = self.marked_only
+        option_dict['idapro_artifact_dir'] = self.artifact_dir
 
         # block interfering plugins
         option_dict['plugins'].append("no:cacheprovider")
@@ -105,15 +296,28 @@ class InternalDeferredPlugin(object):
         # cleanup our own plugin configuration
         option_dict["plugins"].append("no:idapro")
         del option_dict['ida']
+        del option_dict['ida_agent']
         del option_dict['ida_file']
 
         if platform.system() == "Windows":
             # remove capturing, this doesn't properly work in windows
             option_dict["plugins"].append("no:terminal")
             option_dict["capture"] = "sys"
-        self.send('configure', config.args, option_dict)
+        if args is None:
+            args = config.args
+        self.send('configure', args, option_dict)
         self.recv('configure', 'done')
 
+    def database_path(self):
+        """Path of the loaded database, as seen by the worker"""
+        return self.ida_file and os.path.abspath(self.ida_file)
+
+    @staticmethod
+    def resolve_path(path):
+        """Translate a path relative to the worker's working directory to a
+        master path"""
+        return os.path.abspath(path)
+
     def command_cmdline_main(self):
         self.send('cmdline_main')
         self.recv('cmdline_main', 'start')
@@ -124,31 +328,37 @@ class InternalDeferredPlugin(object):
         # self.config.hook.pytest_sessionstart(session=self.session)
 
     def command_report_header(self):
-        startdir, = self.recv('report', 'header')
-        self.config.hook.pytest_report_header(config=self.config,
-                                              startdir=startdir)
+        r = self.recv()
+        if r[:2] != ('report', 'header'):
+            # quiet sessions do not report a header
+            self.unread = r
+            return
+        self.emit('report_header', r[2])
 
     def command_collect(self):
         self.recv('collection', 'start')
-        self.config.hook.pytest_collectstart()
+        # a resumed session collects tests that were already reported
+        emit = self.emit if not self.resuming else (lambda *event: None)
+        emit('collectstart')
 
         while True:
             r = self.recv('collection')
             if r[0] == 'report':
-                report = self.deserialize_report("collect", r[1])
-                self.config.hook.pytest_collectreport(report=report)
+                emit('collectreport', r[1])
             elif r[0] == 'finish':
-                collected_tests = r[1]
-                self.session.testscollected = len(collected_tests)
-                self.config.hook.pytest_collection_finish(session=self.session)
+                if not self.resuming:
+                    self.collected, self.rootdir = r[1], r[2]
+                    self.finished.clear()
+                    if self.scheduler:
+                        self.scheduler.collected(r[1])
+                emit('collection_finish', r[1], r[2], r[3])
                 break
             elif r[0] == 'modifyitems':
-                self.config.hook.pytest_collection_modifyitems(
-                    session=self.session,
-                    config=self.config,
-                    items=r[1])
+                emit('collection_modifyitems', r[1])
             elif r[0] == 'deselected':
-                self.config.hook.pytest_deselected(items=r[1])
+                emit('deselected', r[1])
+            elif r[0] == 'databases':
+                emit('databases', r[1])
             else:
                 raise RuntimeError("Invalid collect response received: "
                                    "{}".format(r))
@@ -157,27 +367,59 @@ class InternalDeferredPlugin(object):
         while True:
             r = self.recv('runtest')
             if r[0] == 'logstart':
-                self.config.hook.pytest_runtest_logstart(nodeid=r[1],
-                                                         location=r[2])
+                self.current_test = (r[1], r[2], time.time())
+                self.current_when = 'setup'
+                if self.logtail:
+                    self.test_log_start = self.logtail.poll()
+                if self.resources:
+                    self.resources.test_start()
+                self.emit('logstart', r[1], r[2])
             elif r[0] == 'logreport':
-                report = self.deserialize_report("test", r[1])
-                self.config.hook.pytest_runtest_logreport(report=report)
+                # tests failing or skipped in setup continue with teardown
+                if r[1]['when'] == 'setup' and r[1]['outcome'] == 'passed':
+                    self.current_when = 'call'
+                else:
+                    self.current_when = 'teardown'
+                if r[1]['when'] == 'teardown':
+                    # workers running pytest<3.4 never send logfinish
+                    self.current_test = None
+                    self.finished.add(r[1]['nodeid'])
+                    self.attach_usage(r[1])
+                if r[1]['outcome'] == 'failed':
+                    self.attach_log(r[1])
+                self.emit('logreport', r[1])
             elif r[0] == 'logfinish':
-                # the pytest_runtest_logfinish hook was introduced in pytest3.4
-                if hasattr(self.config.hook, 'pytest_runtest_logfinish'):
-                    self.config.hook.pytest_runtest_logfinish(nodeid=r[1],
-                                                              location=r[2])
+                self.current_test = None
+                self.finished.add(r[1])
+                self.emit('logfinish', r[1], r[2])
+            elif r[0] == 'artifact':
+                self.emit('artifact', r[1], r[2], r[3])
+            elif r[0] == 'next':
+                self.send('schedule', self.scheduler.next(self))
             elif r[0] == 'finish':
                 break
             else:
                 raise RuntimeError("Invalid runtest response received: "
                                    "{}".format(r))
 
+    def attach_usage(self, report):
+        """Attach IDA's resource usage during a test to its teardown report,
+        the last one sent before the test finishes (workers running pytest
+        older than 3.4 do not report finishing tests)"""
+        usage = self.resources.test_finish() if self.resources else None
+        if usage is not None:
+            report['idapro_resources'] = usage
+
     def command_report_terminalsummary(self):
         exitstatus = self.recv('report', 'terminalsummary')
-        tr = self.config.pluginmanager.get_plugin('terminalreporter')
-        self.config.hook.pytest_terminal_summary(terminalreporter=tr,
-                                                 exitstatus=exitstatus)
+        self.emit('terminal_summary', exitstatus)
+
+    def command_invalidate(self, paths, roots):
+        self.busy = True
+        self.send('invalidate', paths, roots)
+        affected, = self.recv('invalidate', 'done')
+        self.busy = False
+        return affected
 
     def command_quit(self):
         self.send('quit', not self.keep_ida_running)
@@ -188,25 +430,591 @@ class InternalDeferredPlugin(object):
         return self.conn.send(s)
 
     def recv(self, *args):
+        if self.unread is not None:
+            r, self.unread = self.unread, None
+        else:
+            r = self.recv_message()
+
+        if args and r[:len(args)] != args:
+            raise RuntimeError("Invalid response recieved; while expecting "
+                               "'{}' got '{}'".format(args, r))
+
+        return r[len(args):]
+
+    def attach_log(self, report):
+        """Attach worker log lines written since the test started to a
+        serialized report"""
+        text = self.log_text(self.test_log_start)
+        if text:
+            report['sections'] = list(report.get('sections', ()))
+            report['sections'].append(("Captured IDA log", text))
+
+    def recv_message(self):
         try:
             while not self.conn.poll(1):
                 if self.stop:
                     raise KeyboardInterrupt
+                self.check_timeout()
+                if self.logtail:
+                    self.logtail.poll()
 
             r = self.conn.recv()
             log.debug("Received: %s", r)
+        except WorkerTimeout:
+            raise
         except Exception:
             log.critical("Exception during receive, worker output: %s",
-                         self.logfile.read())
+                         self.log_text())
             raise
+        return r
 
-        if args and r[:len(args)] != args:
-            raise RuntimeError("Invalid response recieved; while expecting "
-                               "'{}' got '{}'".format(args, r))
+    def check_timeout(self):
+        if not self.timeout or not self.current_test:
+            return
 
-        return r[len(args):]
+        nodeid, location, start_time = self.current_test
+        elapsed = time.time() - start_time
+        if elapsed > self.timeout:
+            raise WorkerTimeout(nodeid, location, elapsed, self.current_when)
+
+    def run_session(self, args):
+        """Run a test session, restarting the worker and resuming from the
+        next test whenever a test exceeds the configured timeout"""
+        self.resuming = False
+        while True:
+            try:
+                return self.run_session_once(args)
+            except WorkerTimeout as e:
+                self.current_test = None
+                self.report_timeout(e)
+                self.restart()
+
+            self.resuming = True
+            if self.scheduler:
+                # scheduled tests that did not run are handed out again
+                self.scheduler.requeue(self, self.finished)
+                continue
+
+            args = [os.path.join(self.rootdir, nodeid)
+                    for nodeid in self.collected
+                    if nodeid not in self.finished]
+            if not args:
+                return
+
+    def report_timeout(self, e):
+        log.error("Test %s timed out after %.2f seconds", e.nodeid, e.elapsed)
+        longrepr = ("Timeout: test exceeded {} seconds, IDA worker was "
+                    "restarted. Worker stacks:\n{}".format(self.timeout,
+                                                           self.dump_stacks()))
+        report = {'nodeid': e.nodeid, 'location': e.location, 'keywords': {},
+                  'outcome': 'failed', 'longrepr': longrepr, 'when': e.when,
+                  'sections': [], 'duration': e.elapsed}
+        self.attach_log(report)
+        self.finished.add(e.nodeid)
+        self.emit('logreport', report)
+        self.emit('logfinish', e.nodeid, e.location)
+
+    def run_session_once(self, args):
+        self.busy = True
+        self.command_configure(self.config, args)
+        self.command_cmdline_main()
+
+        self.command_session_start()
+        self.command_report_header()
+
+        self.command_collect()
+        response = self.recv()
+
+        if response == ('runtest', 'start'):
+            self.command_runtest()
+            exitstatus = self.recv('session', 'finish')
+        elif response[:2] == ('session', 'finish'):
+            exitstatus = response[2]
+        else:
+            raise RuntimeError("Unexpected response: {}".format(response))
+
+        # TODO: The same exit status will be derived by pytest. might be
+        # useful to make sure they match
+        del exitstatus
+
+        self.command_report_terminalsummary()
+
+        self.recv('cmdline_main', 'finish')
+        self.busy = False
+
+
+class RemoteWorkerProxy(WorkerProxy):
+    """Master side of a worker executed by a remote worker agent. The agent
+    starts IDA when connected to and terminates it once disconnected, after
+    which the worker protocol is relayed unchanged. Test paths are sent
+    relative to the master's root directory, and resolved by the agent
+    relative to its own."""
+
+    def __init__(self, config, events, address, authkey, *args, **kwargs):
+        super(RemoteWorkerProxy, self).__init__(config, events, None, *args,
+                                                **kwargs)
+        self.address = address
+        self.authkey = authkey
+        self.agent_rootdir = None
+
+    def ida_start(self):
+        self.conn = Client(self.address, authkey=self.authkey)
+        self.send('agent', 'start', self.database_path())
+        self.agent_rootdir, = self.recv('agent', 'started')
+
+    def relative_path(self, path):
+        """Translate a master path to one relative to the root directory,
+        leaving paths outside of it (such as worker node IDs of resumed
+        sessions) unchanged"""
+        rootdir = str(self.config.rootdir)
+        path, sep, rest = path.partition("::")
+        abspath = os.path.abspath(path)
+        if abspath != rootdir and not abspath.startswith(
+                os.path.join(rootdir, '')):
+            return path + sep + rest
+        return os.path.relpath(abspath, rootdir) + sep + rest
+
+    def database_path(self):
+        return self.ida_file and self.relative_path(self.ida_file)
+
+    def resolve_path(self, path):
+        # agents execute workers from their root directory
+        return os.path.join(str(self.config.rootdir), path)
+
+    def command_configure(self, config, args=None):
+        if args is None:
+            args = config.args
+        args = [self.relative_path(arg) for arg in args]
+        super(RemoteWorkerProxy, self).command_configure(config, args)
+
+    def ida_stop(self):
+        # the agent terminates IDA once the connection is closed
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def restart(self):
+        log.info("Reconnecting to worker agent %s:%s", *self.address)
+        self.ida_stop()
+        self.unread = None
+        self.start()
 
-    def deserialize_report(self, reporttype, report):
+    def dump_stacks(self):
+        return "Stack dump is unavailable for remote workers"
+
+
+class InternalDeferredPlugin(object):
+    ONCE_PER_ROUND = ('report_header', 'collectstart', 'collection_finish',
+                      'collection_modifyitems')
+
+    def __init__(self, config):
+        self.ida_paths = config.getoption('--ida') or [None]
+        self.ida_files = config.getoption('--ida-file') or [None]
+        self.max_workers = config.getoption('--ida-max-workers')
+        self.watch = config.getoption('--ida-watch')
+        self.config = config
+        self.session = None
+        self.events = queue.Queue()
+        self.stop = False
+        self.rootdir = None
+        self.test_files = set()
+        self.artifacts = ArtifactStore(config.getoption('--ida-artifacts'))
+        self.resources = ResourceSummary(
+            config.getoption('--ida-memory-threshold') * 1024 * 1024)
+
+        self.versions = [None]
+        if len(self.ida_paths) > 1:
+            self.versions = ida_labels(self.ida_paths)
+        labels = [None]
+        if len(self.ida_files) > 1:
+            labels = file_labels(self.ida_files)
+
+        self.agents = config.getoption('--ida-agent')
+        self.authkey = None
+        if self.agents:
+            from .agent import get_authkey
+            self.authkey = get_authkey()
+
+        # every file is tested with every IDA version
+        self.proxies = []
+        for ida_path, version in zip(self.ida_paths, self.versions):
+            for ida_file, label in zip(self.ida_files, labels):
+                self.proxies.extend(self.create_proxies(ida_path, ida_file,
+                                                        version, label))
+
+        self.matrix = OrderedDict((proxy.label, Counter())
+                                  for proxy in self.proxies if proxy.label)
+        # {(test, file label): {version: outcome}}, comparing IDA versions
+        self.outcomes = OrderedDict()
+        self.round_events = set()
+        self.exitstatus = None
+
+        self.collection_cache = CollectionCache(config)
+        self.collected = OrderedDict()
+        self.collect_failed = False
+        self.deselected = set()
+        self.durations = DurationStore(config)
+        # workers started for databases requested by idapro_file markers
+        self.spawned = []
+
+        # workers running the same file split its tests
+        self.groups = OrderedDict()
+        for proxy in self.proxies:
+            self.groups.setdefault(proxy.label, []).append(proxy)
+
+    def create_proxies(self, ida_path, ida_file, version, file_label):
+        """Create the workers running tests against `ida_file`, one for
+        every agent when running remotely, splitting the tests between
+        them"""
+        label = join_labels(version, file_label)
+        if self.agents:
+            proxies = [RemoteWorkerProxy(self.config, self.events, address,
+                                         self.authkey, ida_file, label)
+                       for address in self.agents]
+        else:
+            proxies = [WorkerProxy(self.config, self.events, ida_path,
+                                   ida_file, label)]
+            # local workers write large artifacts directly to shared memory
+            proxies[0].artifact_dir = self.artifacts.directory
+
+        for proxy in proxies:
+            proxy.version = version
+            proxy.file_label = file_label
+        return proxies
+
+    def spawn_database_workers(self, reporter, databases):
+        """Start workers for databases requested by idapro_file markers
+        that no worker loads yet. Every database is loaded once, by workers
+        running only the tests marked for it"""
+        # databases are loaded by every IDA version
+        loaded = set((proxy.ida_path, os.path.abspath(proxy.ida_file))
+                     for proxy in self.proxies if proxy.ida_file)
+
+        for path, args in sorted(databases.items()):
+            path = reporter.resolve_path(path)
+            if (reporter.ida_path, path) in loaded:
+                continue
+            loaded.add((reporter.ida_path, path))
+
+            file_label = os.path.basename(path)
+            if join_labels(reporter.version, file_label) in self.groups:
+                file_label = os.path.relpath(path)
+            group = self.create_proxies(reporter.ida_path, path,
+                                        reporter.version, file_label)
+            label = group[0].label
+            for proxy in group:
+                proxy.args = [reporter.resolve_path(arg) for arg in args]
+                proxy.marked_only = True
+            if len(group) > 1:
+                scheduler = Scheduler(group, self.duration_getter(label))
+                for proxy in group:
+                    proxy.scheduler = scheduler
+
+            log.info("Starting workers for database %s", path)
+            self.proxies.extend(group)
+            self.groups[label] = group
+            self.matrix[label] = Counter()
+            self.spawned.extend(group)
+
+    def run_spawned(self, proxy):
+        """Run a worker started for a marked database. Tests removed from
+        the sessions of other workers are reported as errors if every worker
+        of the database failed before running them"""
+        try:
+            self.run_proxy(proxy)
+        except Exception:
+            log.exception("Worker for database %s failed", proxy.ida_file)
+            proxy.ida_finish(True)
+            proxy.failed = True
+
+            group = self.groups[proxy.label]
+            if not all(member.failed for member in group):
+                return
+            finished = set()
+            for member in group:
+                finished.update(member.finished)
+            rootdir = self.rootdir or str(self.config.rootdir)
+            for arg in proxy.args:
+                path, sep, rest = arg.partition("::")
+                nodeid = os.path.relpath(path, rootdir) + sep + rest
+                if nodeid not in finished:
+                    self.report_lost(proxy, nodeid)
+
+    @staticmethod
+    def report_lost(proxy, nodeid):
+        location = (nodeid.split("::")[0], None, nodeid)
+        longrepr = ("Worker loading database {} failed before running the "
+                    "test".format(proxy.ida_file))
+        report = {'nodeid': nodeid, 'location': location, 'keywords': {},
+                  'outcome': 'failed', 'longrepr': longrepr, 'when': 'setup',
+                  'sections': [], 'duration': 0}
+        proxy.emit('logstart', nodeid, location)
+        proxy.emit('logreport', report)
+        proxy.emit('logfinish', nodeid, location)
+
+    def run_proxy(self, proxy):
+        proxy.start()
+        proxy.run_session(proxy.args or self.config.args)
+
+        # in watch mode workers are kept alive until watching is over
+        if not self.watch:
+            proxy.command_quit()
+
+    def run_parallel(self, proxies, task):
+        """Run `task` for each of `proxies` in a separate thread, with at most
+        max_workers running concurrently, while dispatching their events in
+        the calling thread. An error in one proxy does not interrupt the
+        others, and is raised once all proxies are done."""
+        pending = [(proxy, task) for proxy in proxies]
+        running = {}
+        errors = []
+
+        def target(proxy, task):
+            try:
+                task(proxy)
+            except BaseException as e:
+                log.exception("Worker %s failed", proxy.label or "")
+                proxy.ida_finish(True)
+                errors.append(e)
+            finally:
+                proxy.emit('done')
+
+        try:
+            while pending or running or self.spawned:
+                # workers started for marked databases run whole sessions
+                pending.extend((proxy, self.run_spawned)
+                               for proxy in self.spawned)
+                del self.spawned[:]
+
+                while pending and len(running) < self.max_workers:
+                    proxy, proxy_task = pending.pop(0)
+                    running[proxy] = threading.Thread(target=target,
+                                                      args=(proxy,
+                                                            proxy_task))
+                    running[proxy].daemon = True
+                    running[proxy].start()
+
+                try:
+                    proxy, event = self.events.get(timeout=1)
+                except queue.Empty:
+                    continue
+
+                if event == ('done',):
+                    running.pop(proxy).join()
+                else:
+                    self.dispatch(proxy, *event)
+        except BaseException:
+            self.stop = True
+            for proxy in running:
+                proxy.stop = True
+            for thread in running.values():
+                thread.join()
+            raise
+
+        if errors:
+            raise errors[0]
+
+    def run_round(self, proxies, task):
+        """Run a test session round over `proxies` and report its summary"""
+        self.reset_round()
+        self.run_parallel(self.order_proxies(proxies), task)
+        if not self.collect_failed:
+            self.prune_durations()
+        self.durations.save()
+
+        self.config.hook.pytest_terminal_summary(
+            terminalreporter=self.terminal_reporter(),
+            exitstatus=self.exitstatus)
+        self.report_matrix()
+        self.report_resources()
+
+    def order_proxies(self, proxies):
+        """Order workers by the expected duration of their tests, longest
+        first, according to the tests they collected last time"""
+        entry = self.collection_cache.entry or {}
+        previous = dict((label, nodeids) for label, nodeids, _
+                        in entry.get('collected') or [])
+
+        def expected(proxy):
+            nodeids = previous.get(proxy.label, [])
+            group = self.groups[proxy.label]
+            return -self.durations.estimate(
+                label_nodeid(nodeid, proxy.label)
+                for nodeid in nodeids) / len(group)
+
+        return sorted(proxies, key=expected)
+
+    def alive_proxies(self):
+        return [proxy for proxy in self.proxies if not proxy.stop]
+
+    def reset_round(self):
+        self.round_events.clear()
+        self.collected.clear()
+        self.collect_failed = False
+        self.deselected.clear()
+        self.resources.clear()
+        if self.session:
+            self.session.testscollected = 0
+        for counter in self.matrix.values():
+            counter.clear()
+        self.outcomes.clear()
+
+        for label, group in self.groups.items():
+            if len(group) < 2:
+                continue
+            scheduler = Scheduler(group, self.duration_getter(label))
+            for proxy in group:
+                proxy.scheduler = scheduler
+
+    def prune_durations(self):
+        known = set(self.deselected)
+        for label, (nodeids, _) in self.collected.items():
+            known.update(label_nodeid(nodeid, label) for nodeid in nodeids)
+        rootdir = self.rootdir or str(self.config.rootdir)
+        self.durations.prune(known, lambda path: os.path.exists(
+            os.path.join(rootdir, path)))
+
+    def duration_getter(self, label):
+        return lambda nodeid: self.durations.get(label_nodeid(nodeid, label))
+
+    def dispatch(self, proxy, event, *args):
+        hook = self.config.hook
+        label = proxy.label
+
+        # session wide hooks are only called for the first worker reaching
+        # them in every round
+        once = event in self.ONCE_PER_ROUND and event in self.round_events
+        self.round_events.add(event)
+
+        if event == 'report_header':
+            if not once:
+                hook.pytest_report_header(config=self.config,
+                                          startdir=args[0])
+        elif event == 'collectstart':
+            if not once:
+                hook.pytest_collectstart()
+        elif event == 'collectreport':
+            report = self.deserialize_report("collect", args[0], label)
+            self.collect_failed |= report.failed
+            hook.pytest_collectreport(report=report)
+        elif event == 'collection_finish':
+            collected_tests, rootdir, locations = args
+            self.rootdir = rootdir
+            self.test_files.update(
+                os.path.join(rootdir, nodeid.split("::")[0])
+                for nodeid in collected_tests)
+            # workers splitting the tests of a file all collect them
+            if label not in self.collected:
+                self.collected[label] = (collected_tests, locations)
+                self.session.testscollected += len(collected_tests)
+            # the master has no test items to list when only collecting
+            if not once and not self.config.option.collectonly:
+                hook.pytest_collection_finish(session=self.session)
+        elif event == 'databases':
+            self.spawn_database_workers(proxy, args[0])
+        elif event == 'collection_modifyitems':
+            if not once:
+                hook.pytest_collection_modifyitems(session=self.session,
+                                                   config=self.config,
+                                                   items=args[0])
+        elif event == 'deselected':
+            # workers splitting a file report the same deselected tests
+            items = [label_nodeid(nodeid, label) for nodeid in args[0]]
+            items = [item for item in items if item not in self.deselected]
+            self.deselected.update(items)
+            if items:
+                hook.pytest_deselected(items=items)
+        elif event == 'logstart':
+            hook.pytest_runtest_logstart(
+                nodeid=label_nodeid(args[0], label),
+                location=self.label_location(args[1], label))
+        elif event == 'logreport':
+            usage = args[0].pop('idapro_resources', None)
+            key = (args[0]['nodeid'], proxy.file_label)
+            report = self.deserialize_report("test", args[0], label)
+            self.durations.record(report.nodeid, report.duration)
+            self.artifacts.attach(report)
+            self.attach_resources(report, usage, label)
+            if label and (report.when == 'call' or not report.passed):
+                self.matrix[label][report.outcome] += 1
+                outcomes = self.outcomes.setdefault(key, OrderedDict())
+                if outcomes.get(proxy.version) != 'failed':
+                    outcomes[proxy.version] = report.outcome
+            hook.pytest_runtest_logreport(report=report)
+        elif event == 'logfinish':
+            # the pytest_runtest_logfinish hook was introduced in pytest3.4
+            if hasattr(hook, 'pytest_runtest_logfinish'):
+                hook.pytest_runtest_logfinish(
+                    nodeid=label_nodeid(args[0], label),
+                    location=self.label_location(args[1], label))
+        elif event == 'artifact':
+            nodeid, name, handle = args
+            self.artifacts.receive(label_nodeid(nodeid, label), name, handle)
+        elif event == 'terminal_summary':
+            self.exitstatus = args[0]
+        else:
+            raise RuntimeError("Invalid worker event: {}".format(event))
+
+    def attach_resources(self, report, usage, label):
+        """Attach IDA's memory and cpu usage during a test to its teardown
+        report, flagging tests growing memory above the threshold"""
+        if usage is None:
+            return
+        report.idapro_resources = usage.to_dict()
+        if self.resources.add(report.nodeid, label, usage):
+            report.sections.append(("idapro resources", "IDA memory grew "
+                                    "above the threshold: {}".format(usage)))
+
+    @staticmethod
+    def label_location(location, label):
+        if not label or not location:
+            return location
+        fspath, lineno, domain = location
+        return (fspath, lineno, label_nodeid(domain, label))
+
+    def terminal_reporter(self):
+        return self.config.pluginmanager.get_plugin('terminalreporter')
+
+    def report_matrix(self):
+        tr = self.terminal_reporter()
+        if not self.matrix or not tr:
+            return
+
+        tr.write_sep("=", "IDA matrix summary")
+        for label, counter in self.matrix.items():
+            outcomes = ", ".join("{} {}".format(count, outcome)
+                                 for outcome, count in sorted(counter.items()))
+            tr.write_line("{}: {}".format(label, outcomes or "no tests ran"))
+
+        # compatibility regressions are tests with different outcomes under
+        # different IDA versions, including tests some versions did not run
+        if len(self.ida_paths) < 2:
+            return
+        differing = []
+        for key, outcomes in self.outcomes.items():
+            outcomes = [(version, outcomes.get(version, "not run"))
+                        for version in self.versions]
+            if len(set(outcome for _, outcome in outcomes)) > 1:
+                differing.append((key, outcomes))
+        if not differing:
+            tr.write_line("outcomes are identical across IDA versions")
+            return
+        tr.write_line("tests with outcomes differing across IDA versions:")
+        for (nodeid, file_label), outcomes in differing:
+            tr.write_line("  {}: {}".format(
+                label_nodeid(nodeid, file_label),
+                ", ".join("{} {}".format(version, outcome)
+                          for version, outcome in outcomes)))
+
+    def report_resources(self):
+        tr = self.terminal_reporter()
+        if not self.resources.tests or not tr:
+            return
+
+        tr.write_sep("=", "IDA resource usage")
+        self.resources.report(tr.write_line)
+
+    def deserialize_report(self, reporttype, report, label=None):
         from _pytest.runner import TestReport, CollectReport
         from pytest import Item
         if 'result' in report:
@@ -216,6 +1024,11 @@ class InternalDeferredPlugin(object):
                                 session=self.session)
                 newresult.append(item_obj)
             report['result'] = newresult
+        if label:
+            report['nodeid'] = label_nodeid(report['nodeid'], label)
+            if 'location' in report:
+                report['location'] = self.label_location(report['location'],
+                                                         label)
         if reporttype == "test":
             return TestReport(**report)
         elif reporttype == "collect":
@@ -231,45 +1044,117 @@ class InternalDeferredPlugin(object):
             cov_plugin = self.config.pluginmanager.get_plugin('_cov')
             CovReadOnlyController.silence(cov_plugin.cov_controller)
 
+        # collecting tests does not require IDA if sources did not change
+        cached = self.collection_cache.load()
+        if self.config.option.collectonly and cached is not None:
+            self.report_collected(cached)
+            return True
+
         try:
-            self.ida_start()
-            self.command_ping()
+            self.run_round(self.proxies, self.run_proxy)
 
-            self.command_dependencies()
-            self.command_autoanalysis_wait()
-            self.command_configure(self.config)
-            self.command_cmdline_main()
+            collected = [(label, nodeids, locations)
+                         for label, (nodeids, locations)
+                         in self.collected.items()]
+            if not self.collect_failed:
+                self.collection_cache.store(collected)
+            if self.config.option.collectonly:
+                self.report_collected(collected)
 
-            self.command_session_start()
-            self.command_report_header()
+            if self.watch:
+                self.watch_loop()
+                try:
+                    self.run_parallel(self.alive_proxies(),
+                                      WorkerProxy.command_quit)
+                except (EOFError, IOError):
+                    # workers may have received the same interrupt
+                    log.info("Worker connection lost while quitting")
+        except Exception:
+            self.finish(True)
+            raise
 
-            self.command_collect()
-            response = self.recv()
+        return True
 
-            if response == ('runtest', 'start'):
-                self.command_runtest()
-                exitstatus = self.recv('session', 'finish')
-            elif response[:2] == ('session', 'finish'):
-                exitstatus = response[2]
-            else:
-                raise RuntimeError("Unexpected response: {}".format(response))
+    def report_collected(self, collected):
+        tr = self.terminal_reporter()
+        self.session.testscollected = 0
+        for label, nodeids, locations in collected:
+            self.session.testscollected += len(nodeids)
+            if not tr:
+                continue
 
-            # TODO: The same exit status will be derived by pytest. might be
-            # useful to make sure they match
-            del exitstatus
+            for nodeid, location in zip(nodeids, locations):
+                line = label_nodeid(nodeid, label)
+                if self.config.option.verbose > 0 and location[1] is not None:
+                    line = "{} ({}:{})".format(line, location[0],
+                                               location[1] + 1)
+                tr.write_line(line)
 
-            self.command_report_terminalsummary()
+    def watch_loop(self):
+        """Wait for source changes, invalidate changed modules inside the
+        running IDA instances and rerun affected tests. Returns when
+        interrupted by the user."""
+        from .idapro_internal.watch import SourceWatcher
 
-            self.recv('cmdline_main', 'finish')
-            self.command_quit()
-        except Exception:
-            self.ida_finish(True)
-            raise
+        tr = self.terminal_reporter()
+        roots = [self.rootdir or str(self.config.rootdir)]
+        watcher = SourceWatcher(roots)
 
-        return True
+        try:
+            while not self.stop:
+                if tr:
+                    tr.write_sep("#", "watching for changes, press ctrl-c "
+                                      "to quit")
+                changed = watcher.wait(lambda: self.stop)
+                if not changed:
+                    break
+
+                affected = set()
+                for proxy in self.alive_proxies():
+                    affected.update(proxy.command_invalidate(changed, roots))
+                args = self.affected_args(changed, affected)
+                if tr:
+                    tr.write_line("changed: {}".format(", ".join(changed)))
+                if not args:
+                    if tr:
+                        tr.write_line("no affected tests found")
+                    continue
+
+                if tr:
+                    tr.stats.clear()
+                self.session.testsfailed = 0
+                self.run_round(self.alive_proxies(),
+                               lambda proxy: proxy.run_session(args))
+        except KeyboardInterrupt:
+            log.info("Watch mode interrupted by user")
+            # workers interrupted mid-session or mid-command cannot quit
+            # gracefully and are terminated, the rest are let quit
+            self.stop = False
+            for proxy in self.alive_proxies():
+                if proxy.busy:
+                    proxy.ida_finish(True)
+
+    def affected_args(self, changed, affected):
+        # a changed conftest may influence any test, rerun everything
+        if any(os.path.basename(path) == "conftest.py" for path in changed):
+            return self.config.args
+
+        patterns = self.config.getini('python_files')
+        args = set(path for path in set(changed) | set(affected)
+                   if path in self.test_files)
+        args.update(path for path in changed
+                    if any(fnmatch.fnmatch(os.path.basename(path), pattern)
+                           for pattern in patterns))
+        return sorted(path for path in args if os.path.isfile(path))
+
+    def finish(self, interrupted):
+        self.stop = True
+        for proxy in self.proxies:
+            proxy.ida_finish(interrupted)
+        self.artifacts.finish()
 
     def pytest_sessionfinish(self, exitstatus):
-        self.ida_finish(exitstatus == 2)  # EXIT_ITERRUPTED
+        self.finish(exitstatus == 2)  # EXIT_ITERRUPTED
 
     @staticmethod
     def pytest_collection():
@@ -7,6 +7,8 @@ from PyQt5 import QtWidgets
 import pytest
 
 from .plugin_base import BasePlugin
+from .idapro_internal.artifacts import ArtifactStore, ArtifactWriter
+from .idapro_mock.hooks import EventStorm, dispatchers
 
 modules_list = ['ida_allins', 'ida_area', 'ida_auto', 'ida_bytes', 'ida_dbg',
                 'ida_diskio', 'ida_entry', 'ida_enum', 'ida_expr', 'ida_fixup',
@@ -17,7 +19,7 @@ modules_list = ['ida_allins', 'ida_area', 'ida_auto', 'ida_bytes', 'ida_dbg',
                 'ida_offset', 'ida_pro', 'ida_problems', 'ida_queue',
                 'ida_registry', 'ida_search', 'ida_segment', 'ida_segregs',
                 'ida_srarea', 'ida_strlist', 'ida_struct', 'ida_typeinf',
-                'ida_ua', 'ida_xref', 'ida_range']
+                'ida_ua', 'ida_undo', 'ida_xref', 'ida_range']
 modules_list.extend(['idaapi', 'idc', 'idautils'])
 
 
@@ -28,6 +30,8 @@ class MockDeferredPlugin(BasePlugin):
         self.app_menu = None
         self.app_window = None
         self.app_thread = None
+        self.tempidadir = None
+        self.artifacts = None
 
     @classmethod
     def pytest_configure(cls):
@@ -52,7 +56,54 @@ class MockDeferredPlugin(BasePlugin):
             shutil.rmtree(idapro_mock.idc.tempidadir)
             idapro_mock.idc.tempidadir = None
 
-    def pytest_sessionstart(self):
+    def pytest_sessionstart(self, session):
+        # artifacts are stored in place, there is no master to send them to
+        self.artifacts = ArtifactStore(
+            session.config.getoption('--ida-artifacts'))
+        self.artifact_writer = ArtifactWriter(self.receive_artifact,
+                                              self.artifacts.directory)
+
+        # forked children create their own Qt objects once used, as a Qt
+        # application does not survive a fork
+        if not session.config.getoption('--ida-fork'):
+            self.create_app()
+
+    def receive_artifact(self, *message):
+        nodeid, name, handle = message[2:]
+        self.artifacts.receive(nodeid, name, handle)
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_logreport(self, report):
+        self.artifacts.attach(report)
+
+    def pytest_sessionfinish(self):
+        if self.artifacts:
+            self.artifacts.finish()
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session):
+        if not session.config.getoption('--ida-fork'):
+            return None
+        if session.config.option.collectonly or session.testsfailed:
+            return None
+
+        from .idapro_internal.forkserver import ForkServer
+        self.tempidadir = idapro_mock.idc.tempidadir
+        ForkServer(session, self.serialize_report, self.child_finish,
+                   self.artifact_writer).run()
+        return True
+
+    def child_finish(self):
+        # remove the IDA directory if created by the forked child
+        tempidadir = idapro_mock.idc.tempidadir
+        if tempidadir and tempidadir != self.tempidadir:
+            import shutil
+            shutil.rmtree(tempidadir)
+
+    def create_app(self):
+        if self.app is not None:
+            return
+
         # Create main Qt objects
         self.app = QtWidgets.QApplication([])
         qmdiarea = QtWidgets.QMdiArea()
@@ -63,6 +114,7 @@ class MockDeferredPlugin(BasePlugin):
         self.app_window.setCentralWidget(qmdiarea)
         self.app_window.setMenuWidget(self.app_menu)
         self.app_window.show()
+        idapro_mock.ida_kernwin.set_main_window(self.app_window)
 
         # Create and start a Qt main thread
         self.app_thread = threading.Thread(target=self.app.exec_)
@@ -70,16 +122,34 @@ class MockDeferredPlugin(BasePlugin):
 
     @pytest.fixture()
     def idapro_app(self):
+        self.create_app()
         return self.app
 
     @pytest.fixture()
     def idapro_app_window(self):
+        self.create_app()
         return self.app_window
 
     @pytest.fixture()
     def idapro_app_menu(self):
+        self.create_app()
         return self.app_menu
 
     @pytest.fixture()
     def idapro_app_thread(self):
+        self.create_app()
         return self.app_thread
+
+    @pytest.fixture()
+    def idapro_event_storm(self):
+        installed = dict((kind, list(dispatcher.hooks))
+                         for kind, dispatcher in dispatchers.items())
+        storm = EventStorm()
+        yield storm
+        storm.stop()
+
+        # hooks the test left installed would receive events of later tests
+        for kind, dispatcher in dispatchers.items():
+            for hooks in list(dispatcher.hooks):
+                if hooks not in installed[kind]:
+                    dispatcher.uninstall(hooks)
@@ -1,10 +1,21 @@
+import os
+
 import pytest
 import _pytest
 
 try:
-    from plugin_base import BasePlugin
+    from plugin_base import (BasePlugin, DatabaseSnapshot, get_marker,
+                             register_markers)
+    from idapro_internal.hexrays import DecompilationCache
+    from idapro_internal.artifacts import ArtifactWriter
 except ImportError:
-    from .plugin_base import BasePlugin
+    from .plugin_base import (BasePlugin, DatabaseSnapshot, get_marker,
+                              register_markers)
+    from .idapro_internal.hexrays import DecompilationCache
+    from .idapro_internal.artifacts import ArtifactWriter
+
+
+NO_UI_REASON = "IDA's user interface is unavailable in text mode"
 
 
 class WorkerPlugin(BasePlugin):
@@ -12,36 +23,109 @@ class WorkerPlugin(BasePlugin):
         super(WorkerPlugin, self).__init__(*args, **kwargs)
         self.worker = worker
         self.config = None
+        self.decompilation_cache = None
 
     def pytest_cmdline_main(self, config):
         self.config = config
 
+    def pytest_configure(self, config):
+        register_markers(config)
+        if getattr(config.option, 'idapro_scheduled', False):
+            config.pluginmanager.register(ScheduledRunner(self.worker),
+                                          "idapro_scheduled")
+
     def pytest_collection(self):
         self.worker.send('collection', 'start')
 
+    def pytest_collectstart(self):
+        # pending auto-analysis overlaps collecting tests
+        self.worker.advance_autoanalysis()
+
     def pytest_collectreport(self, report):
         serialized_report = self.serialize_report(report)
         self.worker.send('collection', 'report', serialized_report)
 
-    def pytest_collection_modifyitems(self, items):
+    @pytest.hookimpl(trylast=True)
+    def pytest_collection_modifyitems(self, config, items):
+        # marked tests are listed with the rest when only collecting
+        databases = None
+        if not config.option.collectonly:
+            databases = self.select_database_items(config, items)
+        if databases:
+            self.worker.send('collection', 'databases', databases)
+
         # TODO: cannot serialize items, passing an empty list for now
         # items = [i.nodeid for i in items]
         self.worker.send('collection', 'modifyitems', [])
 
+    @staticmethod
+    def select_database_items(config, items):
+        """Keep only tests to run against the database loaded by this worker.
+        Tests marked with idapro_file for other databases are removed, and
+        returned by database so the master runs them with workers loading
+        those databases. Returned paths are relative to the working directory
+        IDA was started in"""
+        rootdir = str(config.rootdir)
+        database = getattr(config.option, 'idapro_database', None)
+        if database:
+            database = os.path.abspath(database)
+        marked_only = getattr(config.option, 'idapro_marked_only', False)
+
+        databases = {}
+        selected = []
+        for item in items:
+            marker = get_marker(item, 'idapro_file')
+            if marker is None:
+                if not marked_only:
+                    selected.append(item)
+                continue
+
+            path = os.path.abspath(os.path.join(rootdir, marker.args[0]))
+            if path == database:
+                selected.append(item)
+                continue
+
+            test_path, sep, rest = item.nodeid.partition("::")
+            test_path = os.path.relpath(os.path.join(rootdir, test_path))
+            databases.setdefault(os.path.relpath(path), []).append(
+                test_path + sep + rest)
+        items[:] = selected
+        return databases
+
     def pytest_deselected(self, items):
         items = [i.nodeid for i in items]
         self.worker.send('collection', 'deselected', items)
 
     def pytest_collection_finish(self, session):
         items = [i.nodeid for i in session.items]
-        self.worker.send('collection', 'finish', items)
+        locations = [i.location for i in session.items]
+        self.worker.send('collection', 'finish', items,
+                         str(session.config.rootdir), locations)
 
     @pytest.hookimpl(hookwrapper=True)
     def pytest_runtestloop(self, session):
+        # analysis overlapping collection is finished before tests start
+        # running, unless only marked tests wait for it
+        mode = getattr(session.config.option, 'ida_autoanalysis', None)
+        if mode != 'marked' and not session.config.option.collectonly:
+            self.worker.wait_autoanalysis()
         self.worker.send('runtest', 'start')
         yield
         self.worker.send('runtest', 'finish')
 
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        # tests may start before auto-analysis is finished, unless marked as
+        # requiring it. waiting precedes the test's logstart so it does not
+        # count towards the test's timeout
+        if get_marker(item, 'idapro_autoanalysis') is not None:
+            self.worker.wait_autoanalysis()
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_setup(self, item):
+        if not self.worker.gui and get_marker(item, 'idapro_ui') is not None:
+            pytest.skip(NO_UI_REASON)
+
     def pytest_runtest_logstart(self, nodeid, location):
         self.worker.send('runtest', 'logstart', nodeid, location)
 
@@ -53,14 +137,43 @@ class WorkerPlugin(BasePlugin):
     def pytest_runtest_logreport(self, report):
         serialized_report = self.serialize_report(report)
         self.worker.send('runtest', 'logreport', serialized_report)
+        # and running tests, between tests
+        if report.when == 'teardown':
+            self.worker.advance_autoanalysis()
 
     # unsupported
     def pytest_internalerror(self, excrepr, excinfo):
         self.worker.send('internalerr', excrepr, excinfo)
 
     def pytest_sessionstart(self, session):
+        # artifacts are sent inline unless sharing a directory with the master
+        artifact_dir = getattr(session.config.option, 'idapro_artifact_dir',
+                               None)
+        self.artifact_writer = ArtifactWriter(self.worker.send, artifact_dir)
+        if getattr(session.config.option, 'ida_hexrays_cache', False):
+            self.install_decompilation_cache(session.config)
         self.worker.send('session', 'start')
 
+    def install_decompilation_cache(self, config):
+        import ida_hexrays
+        if not ida_hexrays.init_hexrays_plugin():
+            return
+
+        record_path = getattr(config.option, 'ida_hexrays_record', None)
+        self.decompilation_cache = DecompilationCache(ida_hexrays, record_path)
+        self.decompilation_cache.install()
+        DatabaseSnapshot.restore_callbacks.append(
+            self.decompilation_cache.clear)
+
+    def uninstall_decompilation_cache(self):
+        if self.decompilation_cache is None:
+            return
+
+        DatabaseSnapshot.restore_callbacks.remove(
+            self.decompilation_cache.clear)
+        self.decompilation_cache.uninstall()
+        self.decompilation_cache = None
+
     def pytest_report_header(self, config, startdir):
         self.worker.send('report', 'header', startdir)
 
@@ -70,29 +183,81 @@ class WorkerPlugin(BasePlugin):
     @pytest.hookimpl(hookwrapper=True)
     def pytest_sessionfinish(self, exitstatus):
         yield
+        self.uninstall_decompilation_cache()
         self.worker.send('session', 'finish', exitstatus)
 
     @pytest.fixture(scope='session')
     def idapro_app(self):
-        from PyQt5 import QtWidgets
-        yield QtWidgets.qApp
+        if not self.worker.gui:
+            pytest.skip(NO_UI_REASON)
+        yield self.worker.qapp
+
+
+class ScheduledRunner(object):
+    """Run tests handed out by the master one at a time, instead of running
+    all collected tests, when the tests of a file are split between several
+    workers"""
+
+    def __init__(self, worker):
+        self.worker = worker
+
+    def next_nodeid(self):
+        self.worker.send('runtest', 'next')
+        response = self.worker.recv()
+        if response[0] != 'schedule':
+            raise RuntimeError("Invalid schedule response received: "
+                               "{}".format(response))
+        return response[1]
 
     @staticmethod
-    def serialize_report(report):
-        from py.path import local
-        from pytest import Item
-
-        d = vars(report).copy()
-        if hasattr(report.longrepr, "toterminal"):
-            d['longrepr'] = str(report.longrepr)
-        else:
-            d['longrepr'] = report.longrepr
-
-        for name, value in d.items():
-            if isinstance(value, local):
-                d[name] = str(value)
-            elif name == "result":
-                d['result'] = [{'name': item.name} for item in d['result']
-                               if isinstance(item, Item)]
-
-        return d
+    def report_missing(session, nodeid):
+        """Fail a test handed out by the master that this worker did not
+        collect, as happens when collections of workers differ"""
+        from _pytest.runner import TestReport
+
+        hook = session.config.hook
+        location = (nodeid.split("::")[0], None, nodeid)
+        hook.pytest_runtest_logstart(nodeid=nodeid, location=location)
+        longrepr = ("Scheduled test {} was not collected by this "
+                    "worker".format(nodeid))
+        hook.pytest_runtest_logreport(report=TestReport(
+            nodeid, location, {}, 'failed', longrepr, 'setup'))
+        session.testsfailed += 1
+        # the pytest_runtest_logfinish hook was introduced in pytest3.4
+        if hasattr(hook, 'pytest_runtest_logfinish'):
+            hook.pytest_runtest_logfinish(nodeid=nodeid, location=location)
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session):
+        if session.config.option.collectonly:
+            return None
+        # the default loop interrupts the session on collection errors,
+        # without running anything
+        if (session.testsfailed and not
+                session.config.option.continue_on_collection_errors):
+            return None
+
+        items = dict((item.nodeid, item) for item in session.items)
+        pending = []
+        done = False
+        while True:
+            # keep the following test known, so fixtures shared with it are
+            # not torn down in between
+            while not done and len(pending) < 2:
+                nodeid = self.next_nodeid()
+                if nodeid is None:
+                    done = True
+                elif nodeid not in items:
+                    self.report_missing(session, nodeid)
+                else:
+                    pending.append(items[nodeid])
+            if not pending:
+                break
+
+            item = pending.pop(0)
+            nextitem = pending[0] if pending else None
+            item.config.hook.pytest_runtest_protocol(item=item,
+                                                     nextitem=nextitem)
+            if session.shouldstop:
+                raise session.Interrupted(session.shouldstop)
+        return True
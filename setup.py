@@ -30,5 +30,7 @@ setup(
         'Programming Language :: Python :: 3.4',
     ],
     # the following makes a plugin available to py.test
-    entry_points={'pytest11': ['idapro = pytest_idapro.plugin']}
+    entry_points={'pytest11': ['idapro = pytest_idapro.plugin'],
+                  'console_scripts': [
+                      'pytest-idapro-agent = pytest_idapro.agent:main']}
 )
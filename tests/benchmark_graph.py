@@ -0,0 +1,76 @@
+"""
+Benchmark building and walking large mocked flow charts and graph views, as
+CFG walking plugins do over huge functions. Run with pytest-idapro installed:
+
+    python tests/benchmark_graph.py [number of blocks]
+"""
+
+import random
+import sys
+import time
+
+from pytest_idapro.idapro_mock import ida_gdl, ida_graph
+
+
+def random_cfg(count, rng):
+    """Blocks falling through to the next one, some with an extra branch"""
+    blocks = []
+    for i in range(count):
+        succs = [i + 1] if i + 1 < count else []
+        if succs and rng.random() < 0.3:
+            succs.append(rng.randrange(count))
+        blocks.append((0x1000 + i * 0x10, 0x1010 + i * 0x10, succs))
+    return blocks
+
+
+def walk(root):
+    """Visit all blocks reachable from `root`, depth first"""
+    seen = set([root.id])
+    stack = [root]
+    while stack:
+        for succ in stack.pop().succs():
+            if succ.id not in seen:
+                seen.add(succ.id)
+                stack.append(succ)
+    return len(seen)
+
+
+class CfgViewer(ida_graph.GraphViewer):
+    def __init__(self, flowchart):
+        super(CfgViewer, self).__init__("cfg")
+        self.flowchart = flowchart
+
+    def OnRefresh(self):
+        self.Clear()
+        for block in self.flowchart:
+            self.AddNode(block.start_ea)
+        for block in self.flowchart:
+            for succ in block.succs():
+                self.AddEdge(block.id, succ.id)
+        return True
+
+
+def timed(name, func):
+    start = time.time()
+    result = func()
+    print("{:>20}: {:.3f}s".format(name, time.time() - start))
+    return result
+
+
+def main(count=200000):
+    blocks = random_cfg(count, random.Random(0))
+    ida_gdl.clear_flowcharts()
+    timed("add_flowchart", lambda: ida_gdl.add_flowchart(0x1000, blocks))
+    flowchart = timed("FlowChart", lambda: ida_gdl.FlowChart(0x1000))
+    assert timed("walk successors", lambda: walk(flowchart[0])) == count
+
+    viewer = CfgViewer(flowchart)
+    assert timed("GraphViewer.Show", viewer.Show)
+    timed("GraphViewer.Preds", lambda: [viewer.Preds(node)
+                                        for node in range(viewer.Count())])
+    print("{} blocks, {} edges".format(viewer.Count(), viewer.EdgeCount()))
+    ida_gdl.clear_flowcharts()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,60 @@
+"""
+Benchmark the mocked find_binary against naive per-address pattern matching,
+the way signature scanning plugins commonly search an image. Run with
+pytest-idapro installed:
+
+    python tests/benchmark_search.py [image size in KB] [number of scans]
+"""
+
+import random
+import sys
+import time
+
+from pytest_idapro.idapro_mock import ida_bytes, ida_search
+
+
+def compile_naive(pattern):
+    return [None if token.startswith('?') else int(token, 16)
+            for token in pattern.split()]
+
+
+def naive_find_binary(start_ea, end_ea, pattern):
+    parts = compile_naive(pattern)
+    for ea in range(start_ea, end_ea - len(parts) + 1):
+        if all(part is None or ida_bytes.get_byte(ea + i) == part
+               for i, part in enumerate(parts)):
+            return ea
+    return ida_bytes.BADADDR
+
+
+def main(size_kb=256, scans=20):
+    rng = random.Random(0)
+    image = bytearray(rng.randrange(256) for _ in range(size_kb * 1024))
+    ida_bytes.unmap_all()
+    ida_bytes.map_bytes(0x400000, image)
+    end_ea = 0x400000 + len(image)
+
+    # signatures near the end of the image, as a worst case for both
+    patterns = []
+    for _ in range(scans):
+        offset = rng.randrange(len(image) - len(image) // 8, len(image) - 8)
+        patterns.append(" ".join("?" if rng.random() < 0.25 else
+                                 "{:02X}".format(value)
+                                 for value in image[offset:offset + 8]))
+
+    results = {}
+    for name, search in (
+            ('naive', lambda p: naive_find_binary(0x400000, end_ea, p)),
+            ('find_binary', lambda p: ida_search.find_binary(
+                0x400000, end_ea, p, 16, ida_search.SEARCH_DOWN))):
+        start = time.time()
+        results[name] = [search(pattern) for pattern in patterns]
+        print("{:>12}: {:.3f}s for {} scans of {}KB".format(
+            name, time.time() - start, scans, size_kb))
+
+    assert results['naive'] == results['find_binary']
+    ida_bytes.unmap_all()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,485 @@
+import os
+import sys
+import pytest
+
+
+def test_source_watcher(tmpdir):
+    from pytest_idapro.idapro_internal.watch import SourceWatcher
+
+    source = tmpdir.join("module.py")
+    source.write("x = 1")
+    watcher = SourceWatcher([str(tmpdir)])
+    assert watcher.poll() == []
+
+    os.utime(str(source), (1, 1))
+    added = tmpdir.join("test_module.py")
+    added.write("")
+    tmpdir.join("data.txt").write("")
+    assert watcher.poll() == sorted([str(source), str(added)])
+    assert watcher.poll() == []
+
+
+def test_label_nodeid():
+    from pytest_idapro.plugin_internal import label_nodeid, file_labels
+
+    assert label_nodeid("test_a.py::test", None) == "test_a.py::test"
+    assert label_nodeid("test_a.py::test", "a.exe") == "test_a.py::test[a.exe]"
+    assert label_nodeid("test_a.py::test[1]", "a.exe") == \
+        "test_a.py::test[1-a.exe]"
+    assert file_labels(["x/a.exe", "y/b.exe"]) == ["a.exe", "b.exe"]
+    assert file_labels(["x/a.exe", "y/a.exe"]) == ["x/a.exe", "y/a.exe"]
+
+
+def test_ida_labels():
+    from pytest_idapro.plugin_internal import ida_labels, join_labels
+
+    assert ida_labels(["/opt/ida-7.0/idat64", "/opt/idapro-7.5sp3/idat"]) == \
+        ["ida7.0", "ida7.5sp3"]
+    assert ida_labels(["/opt/ida/idat", "/home/ida/idat"]) == \
+        [os.path.relpath("/opt/ida"), os.path.relpath("/home/ida")]
+    assert join_labels("ida7.0", "a.idb") == "ida7.0-a.idb"
+    assert join_labels(None, None) is None
+
+
+def test_log_tail(tmpdir):
+    from pytest_idapro.idapro_internal.logtail import LogTail
+
+    path = tmpdir.join("ida.log")
+    path.write("")
+    tail = LogTail(str(path), maxlines=3)
+    with open(str(path), 'a') as fh:
+        fh.write("first\nsecond\nthi")
+        fh.flush()
+        assert tail.poll() == 2
+        fh.write("rd\nfourth\nfifth\n")
+        fh.flush()
+        position = tail.poll()
+
+    assert position == 5
+    assert tail.since(3) == ["fourth", "fifth"]
+    assert tail.text() == "third\nfourth\nfifth"
+
+    # content is read in chunks, and lines never ending are split
+    tail.CHUNK_SIZE = tail.MAX_LINE = 4
+    path.write("0123456789", mode='a')
+    assert tail.poll() == 7
+    assert tail.text() == "fifth\n0123\n4567\n89"
+
+    tail.close()
+    assert not path.exists()
+
+
+def test_collection_cache(tmpdir):
+    from argparse import Namespace
+    from pytest_idapro.idapro_internal.collectcache import CollectionCache
+
+    class DictCache(dict):
+        def set(self, key, value):
+            self[key] = value
+
+    # arguments are relative to the directory pytest was invoked from
+    config = Namespace(cache=DictCache(), rootdir=tmpdir, args=["test_a.py"],
+                       invocation_dir=tmpdir.join("tests"),
+                       option=Namespace(keyword='', markexpr='',
+                                        collectonly=True))
+    source = tmpdir.join("tests", "test_a.py")
+    source.write("def test(): pass", ensure=True)
+    collected = [[None, ["test_a.py::test"], [["test_a.py", 0, "test"]]]]
+
+    cache = CollectionCache(config)
+    assert cache.load() is None
+    cache.store(collected)
+    assert CollectionCache(config).load() == collected
+
+    source.write("def test(): assert False")
+    assert CollectionCache(config).load() is None
+    cache = CollectionCache(config)
+    cache.load()
+    cache.store(collected)
+    tmpdir.join("conftest.py").write("")
+    assert CollectionCache(config).load() is None
+
+    # nothing hashed is never a match
+    tmpdir.join("conftest.py").remove()
+    config.args = ["missing.py"]
+    cache = CollectionCache(config)
+    cache.load()
+    cache.store(collected)
+    assert CollectionCache(config).load() is None
+
+
+def test_remote_paths(tmpdir):
+    from argparse import Namespace
+    from pytest_idapro.agent import parse_address
+    from pytest_idapro.plugin_internal import RemoteWorkerProxy
+
+    assert parse_address("ida-host:5760") == ("ida-host", 5760)
+    with pytest.raises(ValueError):
+        parse_address("ida-host")
+
+    config = Namespace(rootdir=tmpdir, getoption=lambda name: None)
+    proxy = RemoteWorkerProxy(config, None, ("ida-host", 5760), b"key", None)
+    assert proxy.relative_path(str(tmpdir.join("tests", "test_a.py::t"))) \
+        == os.path.join("tests", "test_a.py::t")
+    assert proxy.relative_path("/agent/root/test_a.py::t") == \
+        "/agent/root/test_a.py::t"
+
+
+def test_agent_handshake():
+    import threading
+    from argparse import Namespace
+    from pytest_idapro.agent import WorkerAgent
+    from pytest_idapro.plugin_internal import RemoteWorkerProxy
+
+    # stand-in workers import pytest_idapro from the agent's root directory
+    rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    agent = WorkerAgent(("localhost", 0), b"key", rootdir=rootdir,
+                        stand_in=True)
+    thread = threading.Thread(target=agent.serve)
+    thread.daemon = True
+    thread.start()
+    while agent.listener is None:
+        thread.join(0.01)
+
+    config = Namespace(rootdir=rootdir, getoption=lambda name: None)
+    proxy = RemoteWorkerProxy(config, None, agent.listener.address, b"key",
+                              None)
+    try:
+        proxy.ida_start()
+        assert proxy.agent_rootdir == rootdir
+        proxy.command_ping()
+    finally:
+        proxy.ida_stop()
+
+
+def test_scheduler():
+    from argparse import Namespace
+    from pytest_idapro.idapro_internal.schedule import (DurationStore,
+                                                        Scheduler)
+
+    class DictCache(dict):
+        def set(self, key, value):
+            self[key] = value
+
+    config = Namespace(cache=DictCache())
+    durations = DurationStore(config)
+    for nodeid, duration in (("a", 5), ("b", 1), ("c", 1), ("d", 3)):
+        durations.record(nodeid, duration)
+    durations.save()
+
+    durations = DurationStore(config)
+    assert durations.estimate(["a", "b", "new"]) == 9
+    scheduler = Scheduler(["w1", "w2"], durations.get)
+    scheduler.collected(["a", "b", "c", "d"])
+    scheduler.collected(["ignored"])
+    assert list(scheduler.queues["w1"]) == ["a"]
+    assert list(scheduler.queues["w2"]) == ["b", "c", "d"]
+
+    # an idle worker steals the last tests of the busiest one
+    assert scheduler.next("w1") == "a"
+    assert scheduler.next("w1") == "d"
+    assert scheduler.next("w2") == "b"
+
+    # unfinished tests of a restarted worker are handed out again
+    scheduler.requeue("w2", set())
+    assert scheduler.next("w2") == "b"
+    assert scheduler.next("w2") == "c"
+    assert scheduler.next("w2") is None
+
+    # tests removed from collected files, and of deleted files, are forgotten
+    for nodeid in ("t.py::a", "t.py::gone", "kept.py::a", "deleted.py::a"):
+        durations.record(nodeid, 1)
+    durations.save()
+    durations.prune({"t.py::a"}, lambda path: path != "deleted.py")
+    durations.save()
+    assert sorted(config.cache[DurationStore.CACHE_KEY]) == [
+        "a", "b", "c", "d", "kept.py::a", "t.py::a"]
+
+
+def test_database_items(tmpdir):
+    from argparse import Namespace
+    from pytest_idapro.plugin_worker import WorkerPlugin
+
+    class Item(object):
+        def __init__(self, nodeid, path=None):
+            self.nodeid = nodeid
+            self.path = path
+
+        def get_closest_marker(self, name):
+            return self.path and Namespace(args=(self.path,))
+
+    option = Namespace(idapro_database=str(tmpdir.join("a.idb")))
+    config = Namespace(rootdir=tmpdir, option=option)
+    items = [Item("t.py::any"), Item("t.py::a", "a.idb"),
+             Item("t.py::b", "b.idb")]
+
+    with tmpdir.as_cwd():
+        databases = WorkerPlugin.select_database_items(config, items)
+        assert [item.nodeid for item in items] == ["t.py::any", "t.py::a"]
+        assert databases == {"b.idb": ["t.py::b"]}
+
+        option.idapro_marked_only = True
+        WorkerPlugin.select_database_items(config, items)
+        assert [item.nodeid for item in items] == ["t.py::a"]
+
+
+def test_artifacts(tmpdir):
+    from argparse import Namespace
+    from pytest_idapro.idapro_internal.artifacts import (ArtifactStore,
+                                                         ArtifactWriter,
+                                                         INLINE_SIZE)
+
+    # sessions without artifacts do not create the directory
+    store = ArtifactStore(str(tmpdir.join("out")))
+    store.finish()
+    assert not os.path.exists(store.directory)
+
+    store = ArtifactStore(str(tmpdir.join("out")))
+    sent = []
+    writer = ArtifactWriter(lambda *message: sent.append(message),
+                            store.directory)
+    artifacts = writer.bind("test_a.py::test")
+    artifacts.store("small", b"small")
+    assert not os.path.exists(store.directory)
+    with artifacts.allocate("dump", INLINE_SIZE) as buf:
+        buf[:4] = b"\x7fELF"
+
+    assert sent[0][4] == ('inline', b"small")
+    assert sent[1][4][0] == 'file'
+    for message in sent:
+        store.receive(*message[2:])
+
+    paths = store.get("test_a.py::test")
+    assert sorted(paths) == ["dump", "small"]
+    assert tmpdir.join("out").join(os.path.basename(paths["dump"])).check()
+    with open(paths["dump"], 'rb') as fh:
+        data = fh.read()
+    assert len(data) == INLINE_SIZE and data.startswith(b"\x7fELF")
+
+    # artifacts of the same name do not overwrite each other's files
+    artifacts.store("small", b"again")
+    store.receive(*sent[-1][2:])
+    assert store.get("test_a.py::test")["small"] != paths["small"]
+    assert os.path.exists(paths["small"])
+
+    report = Namespace(nodeid="test_a.py::test", failed=True, sections=[])
+    store.attach(report)
+    assert sorted(report.idapro_artifacts) == ["dump", "small"]
+    assert report.sections[0][0] == "idapro artifacts"
+
+    store.finish()
+    assert not os.path.exists(store.directory)
+
+
+def test_resources():
+    from pytest_idapro.idapro_internal import resources
+
+    summary = resources.ResourceSummary(threshold=1024 * 1024)
+    grown = resources.ResourceUsage((100 << 20, 1.0), (110 << 20, 1.5))
+    steady = resources.ResourceUsage((110 << 20, 1.5), (110 << 20, 2.0))
+    assert summary.add("test_a.py::test[a.idb]", "a.idb", grown)
+    assert not summary.add("test_b.py::test", None, steady)
+    assert summary.flagged() == ["test_a.py::test[a.idb]"]
+    lines = []
+    summary.report(lines.append)
+    assert "peak memory a.idb: 110.0MB" in lines
+
+    sampler = resources.ResourceSampler(os.getpid())
+    sampler.test_start()
+    data = bytearray(4 * 1024 * 1024)
+    usage = sampler.test_finish()
+    if usage is None:
+        pytest.skip("process usage cannot be sampled on this platform")
+    assert usage.rss_end > 0 and usage.cpu >= 0
+    del data
+
+
+def test_idle_autoanalysis(monkeypatch):
+    import threading
+    import time
+    from multiprocessing.connection import Listener
+    from pytest_idapro.idapro_mock import ida_auto, ida_idaapi, ida_kernwin
+
+    monkeypatch.setitem(sys.modules, 'ida_auto', ida_auto)
+    monkeypatch.setitem(sys.modules, 'ida_idaapi', ida_idaapi)
+    # a text mode worker, without a Qt event loop to process while idle
+    monkeypatch.setitem(sys.modules, 'ida_kernwin', ida_kernwin)
+    monkeypatch.setattr(ida_kernwin, 'is_idaq', lambda: False)
+    from pytest_idapro.idapro_internal.idaworker import IdaWorker
+
+    queued = [100]
+
+    def make_step(ea1, ea2):
+        time.sleep(0.001)
+        queued[0] -= 1
+        return queued[0] > 0
+
+    monkeypatch.setattr(ida_auto, 'auto_is_ok', lambda: queued[0] <= 0)
+    monkeypatch.setattr(ida_auto, 'auto_make_step', make_step)
+
+    listener = Listener()
+    worker = IdaWorker(listener.address)
+    conn = listener.accept()
+    try:
+        assert worker.handle_command('autoanalysis', 'start') == \
+            ('autoanalysis', 'started')
+        assert worker.analysis_pending
+
+        # analysis advances while the worker waits for the next command
+        timer = threading.Timer(0.5, conn.send, [('ping',)])
+        timer.start()
+        assert worker.recv() == ('ping',)
+        timer.join()
+        assert queued[0] == 0 and not worker.analysis_pending
+
+        # and in slices as collectors start, while collecting tests
+        from pytest_idapro.plugin_worker import WorkerPlugin
+        queued[0] = 100
+        worker.handle_command('autoanalysis', 'start')
+        plugin = WorkerPlugin(worker)
+        plugin.pytest_collectstart()
+        assert 0 < queued[0] < 100 and worker.analysis_pending
+        while worker.analysis_pending:
+            plugin.pytest_collectstart()
+        assert queued[0] == 0
+    finally:
+        conn.close()
+        listener.close()
+
+
+FAKE_IDA = """#!{python}
+import os
+import shlex
+import sys
+
+sys.path.insert(0, {rootdir!r})
+switches = dict((arg[:2], arg[2:]) for arg in sys.argv[1:])
+log_fh = open(switches['-L'], 'a')
+os.dup2(log_fh.fileno(), 1)
+os.dup2(log_fh.fileno(), 2)
+script_args = shlex.split(switches['-S'])
+from pytest_idapro.agent import run_stand_in_worker
+run_stand_in_worker(*script_args[1:])
+"""
+
+HANGING_TESTS = """
+import time
+import pytest
+
+@pytest.fixture
+def hangs_in_teardown():
+    yield
+    time.sleep(60)
+
+def test_hang():
+    time.sleep(60)
+
+def test_after_hang():
+    pass
+
+def test_teardown_hang(hangs_in_teardown):
+    pass
+
+def test_after_teardown_hang():
+    pass
+"""
+
+
+# the worker plugin implements hooks with arguments removed in pytest 7
+requires_worker = pytest.mark.skipif(
+    int(pytest.__version__.split('.')[0]) >= 7,
+    reason="the worker plugin's hooks require pytest < 7")
+
+
+def run_stand_in(project, *args):
+    """Run pytest in project with a stand-in IDA executable, executing the
+    internal worker in text mode using the mocked IDAPython modules"""
+    import subprocess
+
+    rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    fake_ida = project.join("idat")
+    fake_ida.write(FAKE_IDA.format(python=sys.executable, rootdir=rootdir))
+    fake_ida.chmod(0o755)
+
+    env = dict(os.environ, PYTHONPATH=rootdir)
+    args = [sys.executable, "-m", "pytest", "-p", "no:cacheprovider",
+            "--ida", str(fake_ida)] + list(args)
+    proc = subprocess.Popen(args,
+                            cwd=str(project), env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return proc.communicate()[0].decode('utf-8', 'replace')
+
+
+@requires_worker
+def test_worker_timeout(tmpdir):
+    # worker script arguments must survive paths containing spaces
+    project = tmpdir.mkdir("with space")
+    project.join("test_hanging.py").write(HANGING_TESTS)
+    output = run_stand_in(project, "--ida-timeout", "3", "test_hanging.py")
+
+    # one report per timeout, for the phase that hung, and the remaining
+    # tests ran in a restarted worker
+    assert "1 failed, 3 passed, 1 error" in output, output
+    assert output.count("Timeout: test exceeded") == 2, output
+    assert "ERROR at teardown of test_teardown_hang" in output, output
+    # stacks dumped from the hung worker point at the hanging code
+    assert " in test_hang\n" in output, output
+    assert " in hangs_in_teardown\n" in output, output
+
+
+def test_text_mode(monkeypatch):
+    from argparse import Namespace
+    from multiprocessing.connection import Listener
+    from pytest_idapro.idapro_mock import ida_kernwin
+
+    monkeypatch.setitem(sys.modules, 'ida_kernwin', ida_kernwin)
+    monkeypatch.setattr(ida_kernwin, 'is_idaq', lambda: False)
+    from pytest_idapro.idapro_internal.idaworker import IdaWorker
+    from pytest_idapro.plugin_worker import WorkerPlugin, NO_UI_REASON
+
+    assert IdaWorker.get_qapp() is None
+    listener = Listener()
+    worker = IdaWorker(listener.address)
+    conn = listener.accept()
+    try:
+        assert worker.qapp is None and not worker.gui
+
+        plugin = WorkerPlugin(worker)
+        marked = Namespace(get_closest_marker=lambda name: (
+            name if name == 'idapro_ui' else None))
+        with pytest.raises(pytest.skip.Exception) as excinfo:
+            plugin.pytest_runtest_setup(marked)
+        assert str(excinfo.value.msg) == NO_UI_REASON
+        unmarked = Namespace(get_closest_marker=lambda name: None)
+        plugin.pytest_runtest_setup(unmarked)
+    finally:
+        conn.close()
+        listener.close()
+
+
+UI_TESTS = """
+import pytest
+
+@pytest.mark.idapro_ui
+def test_ui():
+    pass
+
+def test_app(idapro_app):
+    pass
+
+def test_database():
+    pass
+"""
+
+
+@requires_worker
+def test_text_mode_skips(tmpdir):
+    from pytest_idapro.plugin_worker import NO_UI_REASON
+
+    tmpdir.join("test_ui.py").write(UI_TESTS)
+    output = run_stand_in(tmpdir, "-rs", "test_ui.py")
+    assert "1 passed, 2 skipped" in output, output
+    # both the ui marker and the idapro_app fixture skip their test
+    skipped = set(line for line in output.splitlines()
+                  if line.endswith(NO_UI_REASON))
+    assert len(skipped) == 2, output
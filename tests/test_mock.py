@@ -0,0 +1,440 @@
+import os
+import sys
+import pytest
+
+
+def test_database_snapshot(monkeypatch):
+    from pytest_idapro.idapro_mock import ida_undo
+    from pytest_idapro.plugin_base import DatabaseSnapshot
+
+    monkeypatch.setitem(sys.modules, 'ida_undo', ida_undo)
+    state = {'value': 0}
+    monkeypatch.setattr(ida_undo, '_states', [])
+    ida_undo.register_state(lambda: dict(state), state.update)
+
+    snapshot = DatabaseSnapshot("test")
+    snapshot.take()
+    state['value'] = 1
+    ida_undo.create_undo_point("nested")
+    state['value'] = 2
+    snapshot.restore()
+
+    assert state['value'] == 0
+    assert ida_undo.get_undo_action_label() is None
+
+
+def test_hexrays_decompile(tmpdir, monkeypatch):
+    from pytest_idapro.idapro_mock import ida_hexrays, idaapi
+    from pytest_idapro.idapro_internal.hexrays import DecompilationCache
+
+    ida_hexrays.clear_fixtures()
+    monkeypatch.setattr(ida_hexrays, 'FIXTURES_PATH', str(tmpdir))
+    ida_hexrays.add_fixture({
+        'entry_ea': 0x1000, 'end_ea': 0x1010,
+        'pseudocode': ["int f()", "{", "  return 0;", "}"],
+        'treeitems': [{'op': 'cit_block', 'ea': 0x1000, 'parent': None},
+                      {'op': 'cit_return', 'ea': 0x1008, 'parent': 0},
+                      {'op': 'cot_num', 'ea': 0x1008, 'parent': 1}]})
+
+    cfunc = ida_hexrays.decompile(0x1004)
+    assert cfunc is ida_hexrays.decompile(0x1000)
+    assert str(cfunc).splitlines()[2] == "  return 0;"
+    assert cfunc.body.op == ida_hexrays.cit_block
+    with pytest.raises(ida_hexrays.DecompilationFailure):
+        ida_hexrays.decompile(0x1010)
+
+    class ExprVisitor(ida_hexrays.ctree_parentee_t):
+        def visit_expr(self, expr):
+            self.found = (expr, list(self.parents))
+            return 1
+
+    visitor = ExprVisitor()
+    assert visitor.apply_to(cfunc.body, None) == 1
+    assert visitor.found == (cfunc.treeitems[2], cfunc.treeitems[:2])
+
+    # record decompilations through the memoization cache, and serve them
+    # back from the recorded fixture files
+    record_path = tmpdir.join("recorded")
+    monkeypatch.setitem(sys.modules, 'idaapi', idaapi)
+    cache = DecompilationCache(ida_hexrays, str(record_path))
+    cache.install()
+    try:
+        ida_hexrays.decompile(0x1000)
+        idaapi.decompile(0x1000)
+        assert (cache.hits, cache.misses) == (1, 1)
+        ida_hexrays.decompile(0x1000, None, ida_hexrays.DECOMP_NO_CACHE)
+        ida_hexrays.decompile(0x1000, flags=ida_hexrays.DECOMP_NO_CACHE)
+        assert (cache.hits, cache.misses) == (1, 3)
+    finally:
+        cache.uninstall()
+    assert idaapi.decompile is ida_hexrays.decompile
+    assert not hasattr(idaapi.decompile, '__self__')
+
+    ida_hexrays.clear_fixtures()
+    ida_hexrays.load_fixtures(str(record_path))
+    recorded = ida_hexrays.decompile(0x1000)
+    assert str(recorded) == str(cfunc)
+    assert [(item.op, item.index) for item in recorded.treeitems] == \
+        [(item.op, item.index) for item in cfunc.treeitems]
+    ida_hexrays.clear_fixtures()
+
+
+def test_find_binary():
+    import random
+    from pytest_idapro.idapro_mock import ida_bytes, ida_search, idc
+
+    def naive(start_ea, end_ea, parts, down):
+        eas = range(start_ea, end_ea - len(parts) + 1)
+        for ea in (eas if down else reversed(eas)):
+            if all(part is None or ida_bytes.get_byte(ea + i) == part
+                   for i, part in enumerate(parts)):
+                return ea
+        return ida_bytes.BADADDR
+
+    rng = random.Random(1)
+    ida_bytes.unmap_all()
+    ida_bytes.map_bytes(0x1000, bytearray(rng.randrange(4)
+                                          for _ in range(0x800)))
+    ida_bytes.map_bytes(0x2000, b"Hello World\0")
+    try:
+        for _ in range(50):
+            parts = [None if rng.random() < 0.3 else rng.randrange(4)
+                     for _ in range(rng.randrange(1, 6))]
+            pattern = " ".join("?" if part is None else str(part)
+                               for part in parts)
+            ea = rng.randrange(0x1000, 0x1800)
+            assert ida_search.find_binary(
+                ea, 0x1800, pattern, 16, ida_search.SEARCH_DOWN) == \
+                naive(ea, 0x1800, parts, True)
+            assert ida_search.find_binary(
+                ea, 0x1000, pattern, 16, ida_search.SEARCH_UP) == \
+                naive(0x1000, ea + len(parts), parts, False)
+
+        assert idc.FindBinary(0, idc.SEARCH_DOWN, '"world"') == 0x2006
+        assert idc.FindBinary(0, idc.SEARCH_DOWN | idc.SEARCH_CASE,
+                              '"world"') == ida_bytes.BADADDR
+        assert idc.FindBinary(0x2006, idc.SEARCH_DOWN | idc.SEARCH_NEXT,
+                              '6F') == 0x2007
+        assert idc.FindBinary(0x3000, idc.SEARCH_UP, '6C ? 6F') == 0x2002
+    finally:
+        ida_bytes.unmap_all()
+
+
+def test_strings(tmpdir, monkeypatch):
+    from pytest_idapro.idapro_mock import ida_bytes, ida_nalt, ida_strlist
+    from pytest_idapro.idapro_mock import idautils
+
+    content = b"".join([b"\x01\x02short\0", b"a long ascii string\0",
+                        b"\xff" * 7, u"wide string".encode('utf-16-le'),
+                        b"\0\0", b"end of file"])
+    path = tmpdir.join("input.bin")
+    path.write_binary(content)
+
+    # scan in small chunks, so strings cross chunk boundaries
+    monkeypatch.setattr(ida_strlist, 'CHUNK_SIZE', 4)
+    ida_strlist.clear_file_indices()
+    ida_bytes.unmap_all()
+    ida_bytes.map_file(str(path), 0x1000)
+    try:
+        strings = idautils.Strings(default_setup=False)
+        strings.setup(strtypes=[ida_nalt.STRTYPE_C, ida_nalt.STRTYPE_C_16],
+                      minlen=6)
+        found = [(s.ea, s.strtype, str(s)) for s in strings]
+        assert found == [(0x1008, ida_nalt.STRTYPE_C, "a long ascii string"),
+                         (0x1023, ida_nalt.STRTYPE_C_16, "wide string"),
+                         (0x103b, ida_nalt.STRTYPE_C, "end of file")]
+
+        # the index of the input file is cached and not scanned again
+        monkeypatch.setattr(ida_strlist, '_scan', None)
+        assert len(strings) == 3
+        assert str(strings[1]) == "wide string"
+
+        strings.setup(minlen=5)
+        with pytest.raises(TypeError):
+            list(strings)
+    finally:
+        ida_bytes.unmap_all()
+        ida_strlist.clear_file_indices()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="requires fork")
+def test_fork_server(tmpdir, request):
+    import subprocess
+    if not request.config.pluginmanager.hasplugin('idapro'):
+        pytest.skip("requires the idapro plugin")
+
+    tmpdir.join("test_a.py").write(
+        "import os\n"
+        "import idc\n"
+        "STATE = []\n"
+        "def test_modify():\n"
+        "    STATE.append(1)\n"
+        "def test_crash():\n"
+        "    os._exit(3)\n"
+        "def test_resumed():\n"
+        "    assert STATE == []\n")
+    tmpdir.join("test_b.py").write(
+        "import test_a\n"
+        "def test_isolated():\n"
+        "    assert test_a.STATE == []\n")
+    # actions registered before a forked child creates its main window
+    tmpdir.join("test_c.py").write(
+        "import ida_kernwin\n"
+        "def test_register():\n"
+        "    handler = ida_kernwin.action_handler_t()\n"
+        "    desc = ida_kernwin.action_desc_t('fork:action', 'Forked',\n"
+        "                                     handler)\n"
+        "    assert ida_kernwin.register_action(desc)\n"
+        "    assert ida_kernwin.attach_action_to_menu('Edit/Plugins/',\n"
+        "                                             'fork:action')\n"
+        "def test_attached(idapro_app_window):\n"
+        "    menu = idapro_app_window.menuWidget()\n"
+        "    for title in ('Edit', 'Plugins'):\n"
+        "        menu = ida_kernwin._find_menu(menu, title, False)\n"
+        "    action, = menu.actions()\n"
+        "    assert action.objectName() == 'fork:action'\n"
+        "    assert not action.isEnabled()\n")
+
+    proc = subprocess.Popen([sys.executable, "-m", "pytest", "-p", "no:xvfb",
+                             "--ida-fork", "-v", str(tmpdir)],
+                            cwd=str(tmpdir), stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    output = proc.communicate()[0].decode('utf-8')
+    assert "test_crash FAILED" in output
+    assert "exited with status 3" in output
+    assert "1 failed, 5 passed" in output, output
+
+
+def test_flowchart(tmpdir):
+    import json
+    from pytest_idapro.idapro_mock import ida_gdl, ida_graph, ida_undo
+
+    ida_gdl.clear_flowcharts()
+    # a loop: 0 -> 1 -> (1, 2)
+    ida_gdl.add_flowchart(0x1000, [(0x1000, 0x1010, [1]),
+                                   (0x1010, 0x1020, [1, 2]),
+                                   (0x1020, 0x1024, [], ida_gdl.fcb_ret)])
+    fc = ida_gdl.FlowChart(bounds=(0x1008, 0x1008))
+    assert fc.size == 3
+    assert [succ.id for succ in fc[1].succs()] == [1, 2]
+    assert [pred.id for pred in fc[1].preds()] == [0, 1]
+    assert fc[2].type == ida_gdl.fcb_ret and fc[2].startEA == 0x1020
+    assert ida_gdl.FlowChart(0x2000).size == 0
+
+    # fixtures are recorded from flow charts, and loaded lazily
+    tmpdir.join("1000.json").write(json.dumps(
+        ida_gdl.serialize_flowchart(fc)))
+    ida_gdl.clear_flowcharts()
+    ida_undo.create_undo_point("fixtures")
+    ida_gdl.load_fixtures(str(tmpdir))
+    fc = ida_gdl.FlowChart(0x1000, flags=ida_gdl.FC_NOPREDS)
+    assert [block.end_ea for block in fc] == [0x1010, 0x1020, 0x1024]
+    assert list(fc[1].preds()) == []
+    assert ida_undo.perform_undo()
+    assert ida_gdl.FlowChart(0x1000).size == 0
+    ida_gdl.load_fixtures(str(tmpdir))
+    assert ida_gdl.FlowChart(0x1000).size == 3
+    ida_gdl.clear_flowcharts()
+
+    class ChainGraph(ida_graph.GraphViewer):
+        def OnRefresh(self):
+            self.Clear()
+            for i in range(1000):
+                self.AddNode(i)
+                if i:
+                    self.AddEdge(i - 1, i)
+            return True
+
+    graph = ChainGraph("chain")
+    assert graph.Show()
+    assert (graph.Count(), graph.EdgeCount()) == (1000, 999)
+    assert graph.Succs(0) == [1] and graph.Preds(0) == []
+    assert graph.Preds(999) == [998] and graph.OnGetText(5) == "5"
+
+
+def test_typeinf(monkeypatch):
+    from pytest_idapro.idapro_mock import ida_typeinf, ida_undo
+
+    monkeypatch.setattr(ida_typeinf, '_idati', ida_typeinf.til_t())
+    til = ida_typeinf.get_idati()
+    assert ida_typeinf.parse_decls(til, """
+        /* a header */
+        typedef unsigned int uint;
+        struct point { char c; int x; short y; };
+        typedef struct point point_t;
+        enum color { RED, GREEN = 5, BLUE };
+        typedef int (__stdcall *cb_t)(int a, char *b, ...);
+        struct node { struct node *next; point_t pts[3]; cb_t cb; };
+    """, None, 0) == 0
+
+    tif = ida_typeinf.tinfo_t()
+    assert ida_typeinf.parse_decl(tif, til, "int (*fp)(int);", 0) == "fp"
+    assert tif.is_funcptr() and tif.get_size() == ida_typeinf.PTR_SIZE
+    assert tif.get_pointed_object().get_nth_arg(0).is_integral()
+
+    assert tif.get_named_type(til, "node")
+    members = ida_typeinf.udt_type_data_t()
+    assert tif.get_udt_details(members)
+    assert [(m.name, m.offset // 8) for m in members] == [("next", 0),
+                                                          ("pts", 4),
+                                                          ("cb", 40)]
+    assert tif.get_size() == 44
+
+    # layouts follow changes to the named types they depend on
+    ida_undo.create_undo_point("types")
+    assert ida_typeinf.parse_decls(til, "struct point { int x; };") == 0
+    assert tif.get_size() == 20
+    assert ida_undo.perform_undo()
+    assert tif.get_size() == 44
+
+    assert ida_typeinf.parse_decl(tif, til, "int x : 3;",
+                                  ida_typeinf.PT_SIL) is None
+    assert ida_typeinf.parse_decl(tif, til, "enum e : void { A };",
+                                  ida_typeinf.PT_SIL) is None
+
+    assert ida_typeinf.parse_decl(tif, None, "struct foo { int a; char b; };",
+                                  ida_typeinf.PT_SIL) == "foo"
+    assert tif.is_struct() and tif.get_size() == 8
+    assert ida_typeinf.parse_decl(tif, til, "void (*)(int, char *);", 0) == ""
+    assert str(tif) == "void (*)(int, char *)"
+
+    # enum underlying types are resolved in the type library parsed into
+    assert ida_typeinf.parse_decls(til, """
+        typedef unsigned char byte_t;
+        enum flags : byte_t { F1, F2 };
+    """, None, 0) == 0
+    assert tif.get_named_type(til, "flags") and tif.get_size() == 1
+
+    # types containing themselves by value have no size
+    errors = []
+    assert ida_typeinf.parse_decls(til, "struct a { int x; struct a y; };",
+                                   errors.append, 0) == 1
+    assert ida_typeinf.parse_decls(til, """
+        typedef struct b b_t;
+        struct b { b_t items[2]; };
+    """, errors.append, 0) == 1
+    assert errors == ["Type 'struct a' contains itself\n",
+                      "Type 'struct b' contains itself\n"]
+    assert not tif.get_named_type(til, "a")
+    warnings = []
+    monkeypatch.setattr(ida_typeinf.log, 'warning',
+                        lambda *args: warnings.append(args[-1]))
+    assert ida_typeinf.parse_decl(tif, til, "struct c { struct c z; };",
+                                  0) is None
+    assert [str(e) for e in warnings] == ["Type 'struct c' contains itself"]
+
+
+def test_actions(monkeypatch):
+    from PyQt5 import QtWidgets
+    from pytest_idapro.idapro_mock import ida_kernwin, hooks
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    window = QtWidgets.QMainWindow()
+    window.setMenuWidget(QtWidgets.QMenuBar())
+    monkeypatch.setattr(ida_kernwin, '_main_window', window)
+    monkeypatch.setattr(ida_kernwin, '_actions', ida_kernwin.OrderedDict())
+    ida_kernwin.reset_update_counts()
+
+    class Handler(ida_kernwin.action_handler_t):
+        state = ida_kernwin.AST_ENABLE_FOR_FORM
+        activated = 0
+
+        def activate(self, ctx):
+            Handler.activated += 1
+            return 1
+
+        def update(self, ctx):
+            # refreshing from a handler does not poll it again
+            ida_kernwin.request_refresh(0)
+            return self.state
+
+    handler = Handler()
+    desc = ida_kernwin.action_desc_t("test:action", "Test", handler)
+    assert ida_kernwin.register_action(desc)
+    assert not ida_kernwin.register_action(desc)
+    assert ida_kernwin.attach_action_to_menu("Edit/Plugins/", "test:action",
+                                             ida_kernwin.SETMENU_APP)
+    assert ida_kernwin.attach_action_to_toolbar("AnalysisToolBar",
+                                                "test:action")
+
+    edit = ida_kernwin._find_menu(window.menuWidget(), "Edit", False)
+    plugins = ida_kernwin._find_menu(edit, "Plugins", False)
+    qaction, = plugins.actions()
+    assert qaction.text() == "Test" and app is not None
+    qaction.trigger()
+    assert Handler.activated == 1
+
+    # states are only polled again once no longer valid
+    for _ in range(10):
+        ida_kernwin.request_refresh(0)
+    assert ida_kernwin.get_update_count("test:action") == 1
+    ida_kernwin.activate_widget(window, True)
+    assert ida_kernwin.get_update_count("test:action") == 2
+
+    handler.state = ida_kernwin.AST_DISABLE
+    ida_kernwin.update_actions(widget_changed=True)
+    ida_kernwin.update_actions()
+    assert ida_kernwin.get_update_count("test:action") == 4
+    assert not qaction.isEnabled()
+    assert not ida_kernwin.process_ui_action("test:action")
+
+    # database events invalidate states depending on the database
+    handler.state = ida_kernwin.AST_ENABLE_FOR_IDB
+    ida_kernwin.update_actions()
+    ida_kernwin.activate_widget(window, True)
+    assert ida_kernwin.get_update_count("test:action") == 5
+    hooks.notify('idb', 'renamed', 0x1000, "f", 0)
+    ida_kernwin.request_refresh(0)
+    assert ida_kernwin.get_update_count("test:action") == 6
+    assert qaction.isEnabled()
+
+    assert ida_kernwin.unregister_action("test:action")
+    assert plugins.actions() == []
+
+
+def test_event_storm(tmpdir):
+    from pytest_idapro.idapro_mock import ida_bytes, ida_idp, ida_name
+    from pytest_idapro.idapro_mock.hooks import EventStorm, _percentile
+
+    class RenameHooks(ida_idp.IDB_Hooks):
+        def __init__(self):
+            self.names = {}
+
+        def renamed(self, ea, new_name, local_name):
+            self.names[ea] = new_name
+            return 0
+
+    hooks = RenameHooks()
+    assert hooks.hook()
+    try:
+        storm = EventStorm()
+        storm.synthetic('idb', 'renamed',
+                        lambda i: (0x1000 + i, "f{}".format(i), 0), 1000)
+
+        # events dispatched by the mocked modules can be recorded
+        ida_bytes.map_bytes(0x1000, b"\0" * 4)
+        storm.record()
+        ida_name.set_name(0x1000, "start")
+        ida_bytes.patch_bytes(0x1000, b"\0\1")
+        storm.stop()
+        assert storm.events[-2:] == [('idb', 'renamed', [0x1000, "start",
+                                                         False]),
+                                     ('idb', 'byte_patched', [0x1001, 0])]
+        assert ida_name.get_name(0, 0x1000) == "start"
+
+        path = str(tmpdir.join("storm.json"))
+        storm.save(path)
+        report = EventStorm.load(path).replay(repeat=2)
+    finally:
+        hooks.unhook()
+        ida_bytes.unmap_all()
+        ida_name.set_name(0x1000, "")
+
+    assert hooks.names[0x1000 + 999] == "f999"
+    assert report.handlers() == ["RenameHooks.renamed"]
+    assert report.count("RenameHooks.renamed") == 2002
+    stats = report.summary()["RenameHooks.renamed"]
+    assert stats['p50'] <= stats['p99'] <= stats['max']
+    assert "RenameHooks.renamed" in report.format()
+    assert [_percentile([1, 2, 3, 4], p) for p in (0, 50, 51, 100)] == \
+        [1, 2, 3, 4]